@@ -15,7 +15,8 @@ Advanced strategy tips:
 
   - The GameState.map object can be manually manipulated to create hypothetical 
   board states. Though, we recommended making a copy of the map to preserve 
-  the actual current map state.
+  the actual current map state. game_state.fork() gives a cheap copy on write
+  GameState to experiment on.
 """
 
 
@@ -30,6 +31,8 @@ class AlgoStrategy(gamelib.AlgoCore):
         my_health = 30
         enemy_max_MP = 0
         flag = False
+        # Keep one board for the whole game and only apply each turn's changes to it
+        self.persistent_state = True
 
     def on_game_start(self, config):
         """ 
@@ -37,6 +40,7 @@ class AlgoStrategy(gamelib.AlgoCore):
         """
         gamelib.debug_write('Configuring your custom algo strategy...')
         self.config = config
+        gamelib.coverage.get_coverage_table(config)
         global WALL, SUPPORT, TURRET, SCOUT, DEMOLISHER, INTERCEPTOR, MP, SP
         WALL = config["unitInformation"][0]["shorthand"]
         SUPPORT = config["unitInformation"][1]["shorthand"]
@@ -48,6 +52,49 @@ class AlgoStrategy(gamelib.AlgoCore):
         SP = 0
         # This is a good place to do initial setup
         self.scored_on_locations = []
+        # One path finder for the whole game, the persistent board keeps the one it was created with
+        self.path_finder = gamelib.BitboardPathFinder()
+        self.compile_layouts(config)
+
+    def compile_layouts(self, config):
+        """
+        The hardcoded base used by build_defences, most important structures first.
+        The turret at [19, 10] joins the base after turn 6, between the two layouts.
+        """
+        wall_locations = [[0, 13], [1, 12], [27, 13]]
+        wall_locations += [[x, 11] for x in range(2, 6, 1)]
+        wall_locations += [[x, 12] for x in [26, 23]]
+        wall_locations += [[x, 16 - x] for x in range(6, 9)]
+        wall_locations += [[x, 8] for x in range(9, 18)]
+        wall_locations += [[x, x - 10] for x in [18, 20]]
+        wall_locations += [[22, 11], [22, 10]]
+        turret_locations = [[23, 11], [23, 10], [23, 9], [20, 9], [19, 8], [22, 8], [21, 7], [19, 9], [18, 7]]
+
+        self.base_layout = gamelib.Layout()
+        self.base_layout.add(WALL, wall_locations)
+        self.base_layout.add(TURRET, turret_locations)
+        self.base_layout.add(SUPPORT, [[4, 10], [5, 10]])
+        # self.base_layout.add(SUPPORT, [23, 9])
+        self.base_layout.add(TURRET, [[20, 6], [19, 5]])
+        self.base_layout.compile(config)
+
+        self.core_layout = gamelib.Layout()
+        self.core_layout.add(WALL, [20, 11])
+        self.core_layout.add(TURRET, [[20, 9], [23, 11]], upgrade=True)
+        self.core_layout.add(WALL, [[0, 13], [27, 13], [1, 12]], upgrade=True)
+        self.core_layout.add(SUPPORT, [6, 9])
+        self.core_layout.add(SUPPORT, [5, 10], upgrade=True)
+        self.core_layout.add(WALL, [[5, 11], [23, 12], [6, 10]], upgrade=True)
+        self.core_layout.add(TURRET, turret_locations, upgrade=True)
+        self.core_layout.add(WALL, [[x, 11] for x in range(2, 6, 1)], upgrade=True)
+        self.core_layout.add(WALL, [[20, 11], [22, 11], [22, 10]], upgrade=True)
+        self.core_layout.add(SUPPORT, [4, 10], upgrade=True)
+        self.core_layout.add(WALL, [20, 10], upgrade=True)
+        self.core_layout.add(TURRET, [[19, 8], [19, 5], [18, 7], [18, 4]])
+        self.core_layout.add(WALL, [22, 9])
+        self.core_layout.add(TURRET, [[19, 11], [17, 6]])
+        self.core_layout.add(SUPPORT, [[7, 8], [8, 7]])
+        self.core_layout.compile(config)
 
     def on_turn(self, turn_state):
         """
@@ -58,7 +105,7 @@ class AlgoStrategy(gamelib.AlgoCore):
         game engine.
         """
         global enemy_health, my_health, enemy_max_MP
-        game_state = gamelib.GameState(self.config, turn_state)
+        game_state = self.make_game_state(turn_state, path_finder=self.path_finder)
         gamelib.debug_write('Performing turn {} of your custom algo strategy'.format(game_state.turn_number))
         game_state.suppress_warnings(True)  # Comment or remove this line to enable warnings.
         enemy_max_MP = max(game_state.get_resource(MP, 1), enemy_max_MP)
@@ -73,27 +120,17 @@ class AlgoStrategy(gamelib.AlgoCore):
     """
 
     def has_path_to_edge(self, game_state, start_loc):
-        edges = set([*[tuple(i) for i in game_state.game_map.get_edges()[0]],
-                     *[tuple(i) for i in game_state.game_map.get_edges()[1]]])
-        avail_locs = [start_loc]
-        seen_locs = set([tuple(start_loc)])
-        while avail_locs:
-            old_loc = avail_locs.pop(0)
-            x, y = old_loc
-            new_locs = [(x, y + 1), (x, y - 1), (x + 1, y), (x - 1, y)]
-            for loc in new_locs:
-                if not game_state.game_map.in_arena_bounds(loc):
-                    continue
-                if len(game_state.game_map[loc]) > 0:
-                    continue
-                if loc in edges:
-                    return True
-                if loc in seen_locs:
-                    continue
-                avail_locs.append(loc)
-                seen_locs.add(loc)
-
-        return False
+        """
+        Whether the top edges can be reached from the locations next to start_loc, stepping only on
+        locations that hold no unit at all, mobile units included. start_loc itself may be blocked.
+        The search is a flood fill over bitboard masks rather than a walk over locations.
+        """
+        game_map = game_state.game_map
+        bitboard = gamelib.bitboard
+        open_mask = bitboard.BOARD_MASK & ~(game_map.get_unit_mask(0) | game_map.get_unit_mask(1))
+        start = 1 << gamelib.geometry.cell_id(start_loc[0], start_loc[1])
+        reached = bitboard.flood_fill(bitboard.expand(start) & ~start, open_mask)
+        return bool(reached & (bitboard.EDGE_MASKS[game_map.TOP_RIGHT] | bitboard.EDGE_MASKS[game_map.TOP_LEFT]))
 
     def starter_strategy(self, game_state):
         """
@@ -239,63 +276,11 @@ class AlgoStrategy(gamelib.AlgoCore):
         # Useful tool for setting up your base locations: https://www.kevinbai.design/terminal-map-maker
         # More community tools available at: https://terminal.c1games.com/rules#Download
 
-        wall_locations = [[0, 13], [1, 12], [27, 13]]
-        game_state.attempt_spawn(WALL, wall_locations)
-        for x in range(2, 6, 1):
-            game_state.attempt_spawn(WALL, [x, 11])
-        for x in [26, 23]:
-            game_state.attempt_spawn(WALL, [x, 12])
-        for x in range(6, 9):
-            game_state.attempt_spawn(WALL, [x, 16 - x])
-        for x in range(9, 18):
-            game_state.attempt_spawn(WALL, [x, 8])
-        for x in [18, 20]:
-            game_state.attempt_spawn(WALL, [x, x - 10])
-        wall_locations.append([22, 11])
-        wall_locations.append([22, 10])
-        game_state.attempt_spawn(WALL, wall_locations)
-
-        turret_locations = [[23, 11], [23, 10], [23, 9], [20, 9], [19, 8], [22, 8], [21, 7], [19, 9], [18, 7]]
-        game_state.attempt_spawn(TURRET, turret_locations)
-
-        support_locations = [[4, 10]]
-        game_state.attempt_spawn(SUPPORT, support_locations)
-
-        game_state.attempt_spawn(SUPPORT, [5, 10])
-        # game_state.attempt_spawn(SUPPORT, [23, 9])
-        game_state.attempt_spawn(TURRET, [[20, 6], [19, 5]])
-
+        self.base_layout.apply(game_state)
         if game_state.turn_number > 6:
             game_state.attempt_spawn(TURRET, [19, 10])
             game_state.attempt_upgrade([19, 10])
-        game_state.attempt_spawn(WALL, [20, 11])
-        upgrade_locations = [[20, 9], [23, 11], [0, 13], [27, 13], [1, 12]]
-        game_state.attempt_upgrade(upgrade_locations)
-        game_state.attempt_spawn(SUPPORT, [6, 9])
-        upgrade_locations = [[5, 10], [5, 11], [23, 12], [6, 10]]
-        game_state.attempt_upgrade(upgrade_locations)
-        game_state.attempt_upgrade(turret_locations)
-        for x in range(2, 6, 1):
-            upgrade_locations.append([x, 11])
-        game_state.attempt_upgrade(upgrade_locations)
-        game_state.attempt_upgrade([20, 11])
-        game_state.attempt_upgrade([22, 11])
-        game_state.attempt_upgrade([22, 10])
-        game_state.attempt_upgrade([4, 10])
-        game_state.attempt_upgrade([20, 10])
-
-        turret_locations = []
-
-        for x in range(19, 17, -1):
-            turret_locations.append([x, x - 11])
-            turret_locations.append([x, x - 14])
-        game_state.attempt_spawn(TURRET, turret_locations)
-        game_state.attempt_spawn(WALL, [22, 9])
-        game_state.attempt_spawn(TURRET, [19, 11])
-        game_state.attempt_spawn(TURRET, [17, 6])
-        game_state.attempt_spawn(SUPPORT, [7, 8])
-        support_locations = [[8, 7]]
-        game_state.attempt_spawn(SUPPORT, support_locations)
+        self.core_layout.apply(game_state)
 
         # game_state.attempt_spawn(WALL, [[3, 12], [4, 12], [26, 13], [25, 13], [24, 13]])
         # game_state.attempt_spawn(TURRET, [[2, 12]])
@@ -374,7 +359,7 @@ class AlgoStrategy(gamelib.AlgoCore):
         if game_state.turn_number > 5:
             game_state.attempt_upgrade(upgrade_locations)
         for location in upgrade_locations:
-            for unit in game_state.game_map[location]:
+            for unit in game_state.game_map.units_at(location[0], location[1]):
                 if unit.health <= 0.6 * unit.max_health:
                     game_state.attempt_remove(location)
 
@@ -454,29 +439,52 @@ class AlgoStrategy(gamelib.AlgoCore):
         It gets the path the unit will take then checks locations on that path to 
         estimate the path's damage risk.
         """
-        damages = []
-        # Get the damage estimate each path will take
+        safest = gamelib.AnytimeResult()
+        heatmap = game_state.get_damage_heatmap()
+        # Get the damage estimate each path will take, keeping the safest location found before the turn budget runs out
         for location in location_options:
-            path = game_state.find_path_to_edge(location)
-            damage = 0
-            for path_location in path:
-                # Get number of enemy turrets that can attack each location and multiply by turret damage
-                damage += len(game_state.get_attackers(path_location, 0)) * gamelib.GameUnit(TURRET,
-                                                                                             game_state.config).damage_i
-            damages.append(damage)
+            # Paths to the same edge are all read from one next hop table
+            path = game_state.get_next_hop_table(game_state.get_target_edge(location)).get_path(location)
+            # Sum the damage per frame every enemy turret in range deals at each location of the path
+            safest.offer(location, -heatmap.path_damage(path, 0))
+            if game_state.budget is not None and game_state.budget.expired():
+                break
 
         # Now just return the location that takes the least damage
-        return (min(damages), location_options[damages.index(min(damages))])
+        return (-safest.score, safest.best)
 
     def detect_enemy_unit(self, game_state, unit_type=None, valid_x=None, valid_y=None):
-        total_units = 0
-        for location in game_state.game_map:
-            if game_state.contains_stationary_unit(location):
-                for unit in game_state.game_map[location]:
-                    if unit.player_index == 1 and (unit_type is None or unit.unit_type in unit_type) and (
-                            valid_x is None or location[0] in valid_x) and (valid_y is None or location[1] in valid_y):
-                        total_units += 1
-        return total_units
+        if unit_type is not None:
+            # A single shorthand such as "FF" is one type, not a list of characters
+            unit_type = set([unit_type] if isinstance(unit_type, str) else unit_type)
+        x_band = self.contiguous_band(valid_x)
+        y_band = self.contiguous_band(valid_y)
+        if x_band is not None and y_band is not None:
+            # Only enemy units standing on a structure location are counted, so only structure types matter
+            region_sums = game_state.get_region_sums()
+            types = [WALL, SUPPORT, TURRET] if unit_type is None else [t for t in unit_type if t in (WALL, SUPPORT, TURRET)]
+            return sum(region_sums.count(1, t, x_band[0], y_band[0], x_band[1], y_band[1]) for t in types)
+
+        game_map = game_state.game_map
+        region = game_map.get_blocked_mask()
+        if valid_x is not None:
+            region &= gamelib.bitboard.columns_mask(valid_x)
+        if valid_y is not None:
+            region &= gamelib.bitboard.rows_mask(valid_y)
+        if unit_type is None:
+            return game_map.count_units(1, region=region)
+        return sum(game_map.count_units(1, shorthand, region) for shorthand in unit_type)
+
+    def contiguous_band(self, values):
+        """
+        The inclusive (first, last) bounds of a list of coordinates if it covers a contiguous range, None otherwise
+        """
+        if values is None:
+            return (0, 27)
+        unique = sorted(set(values))
+        if not unique or unique[-1] - unique[0] != len(unique) - 1 or any(type(v) != int for v in unique):
+            return None
+        return (unique[0], unique[-1])
 
     def filter_blocked_locations(self, locations, game_state):
         filtered = []
@@ -502,7 +510,7 @@ class AlgoStrategy(gamelib.AlgoCore):
         Full doc on format of a game frame at in json-docs.html in the root of the Starterkit.
         """
         # Let's record at what position we get scored on
-        state = json.loads(turn_string)
+        state = gamelib.decode_message(turn_string)
         events = state["events"]
         breaches = events["breach"]
         for breach in breaches:
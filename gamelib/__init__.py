@@ -16,14 +16,37 @@ Investigating it is useful for advanced players interested in getting data from
 The Navigation class in navigation.py contains functions related to path-finding, which are used by GameState in pathing related functions. 
 Investigating it is useful for advanced player who want to optimize the slow default pathing algorithm we provide. \n 
 
+bitboard.py contains helpers for representing sets of board locations as integer bitmasks, used by the BitboardPathFinder in navigation.py. \n
+
+budget.py contains the TurnBudget AlgoCore starts for each turn, with checkpoints for long analyses and helpers for anytime searches that keep their best answer so far. \n
+
+coverage.py contains precomputed information about which locations structures can attack, such as the DamageHeatmap used by GameState.get_damage_heatmap(). \n
+
+regions.py contains summed-area tables counting units, health and upgrades over rectangles of the board, used by GameState.get_region_sums(). \n
+
+layout.py contains the Layout, a prioritized list of structures to build and upgrade that is compiled once and only plans the entries missing from the board. \n
+
+geometry.py contains the fixed shape of the board (cell ids, in bounds lookups, edges and neighbors), computed once when gamelib is imported. \n
+
+reader.py contains the MessageReader used by AlgoCore.start when threaded_input is set, which reads stdin on a background thread and coalesces action frames under load. \n
+
+rollout.py contains the RolloutPool, which scores many candidate deploy plans with the Simulator on a pool of worker processes within a time budget. \n
+
+simulation.py contains the Simulator, which plays out deploys of mobile units against the structures of a board frame by frame and reports breaches, damage and destroyed structures. \n
+
+speculation.py contains the SpeculativeRunner behind AlgoCore.register_speculative_task, which precomputes results during the action phase for the next turn. \n
+
 util.py contains a small handful of functions that help with communication, including the debug-printing function, debug_write().
 """
 
 from .algocore import AlgoCore
-from .util import debug_write
+from .util import debug_write, decode_message, GameMessage
 from .game_state import GameState
 from .unit import GameUnit
 from .game_map import GameMap
+from .navigation import ShortestPathFinder, BitboardPathFinder
+from .budget import TurnBudget, BudgetExceeded, AnytimeResult, run_anytime
+from .layout import Layout
 
-__all__ = ["algocore", "game_state", "game_map", "navigation", "unit", "util"]
+__all__ = ["algocore", "bitboard", "budget", "coverage", "game_state", "geometry", "game_map", "layout", "navigation", "reader", "regions", "rollout", "simulation", "speculation", "unit", "util"]
  
\ No newline at end of file
@@ -1,7 +1,10 @@
-import json
-
+from .budget import TurnBudget, BudgetExceeded
+from .coverage import get_coverage_table
 from .game_state import GameState
+from .reader import MessageReader, next_message_from
+from .speculation import SpeculativeRunner
 from .util import get_command, debug_write, BANNER_TEXT, send_command
+from .util import GameMessage, message_type, CONFIG_MESSAGE, TURN_MESSAGE, ACTION_FRAME_MESSAGE, END_MESSAGE
 
 class AlgoCore(object):
     """
@@ -10,10 +13,73 @@ class AlgoCore(object):
 
     Attributes :
         * config (JSON): json object containing information about the game
+        * threaded_input (bool): If True, start reads stdin on a background MessageReader thread
+        * max_queued_frames (int): With threaded_input, how many action frames may wait before new ones are coalesced
+        * frame_fields (list): With threaded_input, the frame fields such as "events.breach" whose lists are
+          kept when frames are coalesced. Other fields of coalesced frames only keep their newest value
+        * speculative_results (dict): The results of speculative tasks computed on this turn's board, by task name.
+          Set before each call to on_turn, see register_speculative_task
+        * turn_budget (:obj: TurnBudget): The time budget of the current turn, started when the turn message is read.
+          Pass it to GameState so the turn is submitted in time, and call its checkpoint method inside long analyses
+        * turn_budget_fraction (float): The share of the config's soft time limit each turn budget gets
+        * persistent_state (bool): If True, make_game_state keeps one GameState for the whole game and brings it
+          to each turn with GameState.update, instead of parsing every turn into a new one
 
     """
     def __init__(self):
         self.config = None
+        self.threaded_input = False
+        self.max_queued_frames = 64
+        self.frame_fields = None
+        self.speculative_results = {}
+        self._speculative_tasks = []
+        self._speculation = None
+        self.turn_budget = None
+        self.turn_budget_fraction = 0.8
+        self.persistent_state = False
+        self._board = None
+
+    def register_speculative_task(self, name, task):
+        """Registers a task to run on a worker thread during the action phase, against the board of the newest frame.
+
+        Args:
+            name: The key of the result in speculative_results
+            task: A function taking a GameState and returning a result. It should return data, such as paths
+                or damage numbers, rather than objects tied to the GameState it was given
+
+        When the next turn arrives, self.speculative_results holds the result of every task that finished
+        on a board whose structures and upgrades match the turn's. Others are dropped.
+        """
+        self._speculative_tasks.append((name, task))
+
+    def make_game_state(self, turn_state, path_finder=None, lazy_units=False):
+        """Builds the GameState of a turn, attached to the turn budget. Call it from on_turn.
+
+        With persistent_state set, the first turn is parsed into a GameState kept by AlgoCore, and later turns
+        only apply what changed to it, so its unit index, edge distance fields, next hop tables and damage heatmap
+        carry over from turn to turn. on_turn is then given a fork of it, see GameState.fork, so the actions
+        it queues never reach the kept board. path_finder and lazy_units are only used for the first turn.
+
+        Args:
+            turn_state: The turn message passed to on_turn
+            path_finder: The path finder of the GameState, see GameState
+            lazy_units: If units are parsed lazily, see GameState. Not used once the board is kept
+
+        Returns:
+            The GameState to play the turn on
+
+        """
+        if not self.persistent_state:
+            return GameState(self.config, turn_state, path_finder, lazy_units, self.turn_budget)
+        if self._board is None:
+            self._board = GameState(self.config, turn_state, path_finder)
+        else:
+            self._board.update(turn_state)
+        game_state = self._board.fork()
+        game_state.budget = self.turn_budget
+        if self.turn_budget is not None:
+            self.turn_budget.attach(game_state)
+        return game_state
 
     def on_game_start(self, config):
         """
@@ -22,11 +88,13 @@ class AlgoCore(object):
         You can override it it in algo_strategy.py to perform start of game setup
         """
         self.config = config
+        get_coverage_table(config)
 
     def on_turn(self, game_state):
         """
         This step function is called at the start of each turn.
         It is passed the current game state, which can be used to initiate a new GameState object. 
+        The game state is a GameMessage: the raw string, whose data attribute holds the decoded JSON, shared with GameState so it is decoded only once. 
         By default, it sends empty commands to the game engine. \n
         algo_strategy.py inherits from AlgoCore and overrides this on turn function. 
         Adjusting the on_turn function in algo_strategy is the main way to adjust your algo's logic. 
@@ -39,7 +107,7 @@ class AlgoCore(object):
         After each deploy phase, the game engine will run the action phase of the round.
         The action phase is made up of a sequence of distinct frames. 
         Each of these frames is sent to the algo in order. 
-        They can be handled in this function. 
+        They can be handled in this function. Each frame is a GameMessage, read action_frame_game_state.data to avoid decoding it again. 
         """
         pass
 
@@ -53,41 +121,58 @@ class AlgoCore(object):
         """
         debug_write(BANNER_TEXT)
 
+        if self.threaded_input:
+            reader = MessageReader(self.max_queued_frames, self.frame_fields).start()
+            next_message = lambda: next_message_from(reader)
+        else:
+            next_message = lambda: GameMessage(get_command())
+
         while True:
             # Note: Python blocks and hangs on stdin. Can cause issues if connections aren't setup properly and may need to
             # manually kill this Python program.
-            game_state_string = get_command()
-            if "replaySave" in game_state_string:
+            game_state_string = next_message()
+            # The message is classified without decoding it. It is decoded at most once, the first time
+            # game_state_string.data is read, by GameState or by the handlers below
+            kind = message_type(game_state_string)
+            if kind == CONFIG_MESSAGE:
                 """
                 This means this must be the config file. So, load in the config file as a json and add it to your AlgoStrategy class.
                 """
-                parsed_config = json.loads(game_state_string)
-                self.on_game_start(parsed_config)
-            elif "turnInfo" in game_state_string:
-                state = json.loads(game_state_string)
-                stateType = int(state.get("turnInfo")[0])
-                if stateType == 0:
-                    """
-                    This is the game turn game state message. Algo must now print to stdout 2 lines, one for build phase one for
-                    deploy phase. Printing is handled by the provided functions.
-                    """
+                self.on_game_start(game_state_string.data)
+            elif kind == TURN_MESSAGE:
+                """
+                This is the game turn game state message. Algo must now print to stdout 2 lines, one for build phase one for
+                deploy phase. Printing is handled by the provided functions.
+                """
+                self.turn_budget = TurnBudget.for_turn(self.config, game_state_string.data, self.turn_budget_fraction)
+                if self._speculation is not None:
+                    self.speculative_results = self._speculation.collect(game_state_string)
+                try:
                     self.on_turn(game_state_string)
-                elif stateType == 1:
-                    """
-                    If stateType == 1, this game_state_string string represents a single frame of an action phase
-                    """
-                    self.on_action_frame(game_state_string)
-                elif stateType == 2:
-                    """
-                    This is the end game message. This means the game is over so break and finish the program.
-                    """
-                    debug_write("Got end state, game over. Stopping algo.")
-                    break
-                else:
-                    """
-                    Something is wrong? Received an incorrect or improperly formatted string.
-                    """
-                    debug_write("Got unexpected string with turnInfo: {}".format(game_state_string))
+                except BudgetExceeded:
+                    debug_write("Turn {} ran out of time, submitting the best plan so far".format(game_state_string.data["turnInfo"][1]))
+                # Submits the GameState attached to the budget if on_turn stopped before submitting it
+                self.turn_budget.finish()
+            elif kind == ACTION_FRAME_MESSAGE:
+                """
+                If stateType == 1, this game_state_string string represents a single frame of an action phase
+                """
+                self.on_action_frame(game_state_string)
+                if self._speculative_tasks:
+                    if self._speculation is None:
+                        self._speculation = SpeculativeRunner(self.config, self._speculative_tasks)
+                    self._speculation.submit(game_state_string)
+            elif kind == END_MESSAGE:
+                """
+                This is the end game message. This means the game is over so break and finish the program.
+                """
+                debug_write("Got end state, game over. Stopping algo.")
+                break
+            elif "turnInfo" in game_state_string:
+                """
+                Something is wrong? Received an incorrect or improperly formatted string.
+                """
+                debug_write("Got unexpected string with turnInfo: {}".format(game_state_string))
             else:
                 """
                 Something is wrong? Received an incorrect or improperly formatted string.
@@ -0,0 +1,138 @@
+"""
+Microbenchmarks for GameMap access patterns.
+
+Run from the folder holding algo_strategy.py with
+
+    python -m gamelib.bench
+
+It times the public, bounds checked game_map[x, y] interface against the unchecked
+units_at and get_cells accessors on a board holding a typical number of structures.
+The same scans are also timed on NestedMap, which keeps the units in nested x/y
+lists as GameMap used to, and each line ends with how many times faster the flat
+storage is.
+"""
+import random
+import timeit
+
+from . import geometry
+from .fixtures import make_turn_0_state
+
+
+class NestedMap:
+    """A reference copy of a board that stores its units in nested x/y lists, as GameMap did before
+    units were stored in a flat list indexed by cell id
+
+    """
+    def __init__(self, game_map):
+        self.__map = [[[] for _ in range(geometry.ARENA_SIZE)] for _ in range(geometry.ARENA_SIZE)]
+        for x, y in geometry.VALID_LOCATIONS:
+            self.__map[x][y] = list(game_map.units_at(x, y))
+
+    def __getitem__(self, location):
+        if len(location) == 2 and self.in_arena_bounds(location):
+            x, y = location
+            return self.__map[x][y]
+
+    def in_arena_bounds(self, location):
+        x, y = location
+        return geometry.in_bounds(x, y)
+
+    def __iter__(self):
+        return ([x, y] for x, y in geometry.VALID_LOCATIONS)
+
+    def contains_stationary_unit(self, location):
+        """The nested lookup GameState.contains_stationary_unit used to make
+
+        """
+        if not self.in_arena_bounds(location):
+            return False
+        x, y = map(int, location)
+        for unit in self[x, y]:
+            if unit.stationary:
+                return unit
+        return False
+
+    def detect_enemy_unit(self, unit_type=None, valid_x=None, valid_y=None):
+        """The scan AlgoStrategy.detect_enemy_unit used to make
+
+        """
+        total_units = 0
+        for location in self:
+            if self.contains_stationary_unit(location):
+                for unit in self[location]:
+                    if unit.player_index == 1 and (unit_type is None or unit.unit_type in unit_type) and (
+                            valid_x is None or location[0] in valid_x) and (valid_y is None or location[1] in valid_y):
+                        total_units += 1
+        return total_units
+
+
+def make_board(structures=120, seed=0):
+    """A turn 0 GameState with structures placed at random locations of both halves
+
+    """
+    game_state = make_turn_0_state()
+    rng = random.Random(seed)
+    for x, y in rng.sample(geometry.VALID_LOCATIONS, structures):
+        game_state.game_map.add_unit(rng.choice(["FF", "EF", "DF"]), [x, y], 0 if y < geometry.HALF_ARENA else 1)
+    return game_state
+
+
+def scan_checked(game_map):
+    """Counts units over the whole board through game_map[x, y]
+
+    """
+    return sum(len(game_map[location]) for location in game_map)
+
+
+def scan_units_at(game_map):
+    """Counts units over the whole board through units_at
+
+    """
+    units_at = game_map.units_at
+    return sum(len(units_at(x, y)) for x, y in geometry.VALID_LOCATIONS)
+
+
+def scan_cells(game_map):
+    """Counts units over the whole board by indexing the flat cell list
+
+    """
+    cells = game_map.get_cells()
+    return sum(len(cells[cell]) for cell in geometry.VALID_CELLS)
+
+
+def contains_stationary_units(game_state):
+    """Calls contains_stationary_unit on every location of the board
+
+    """
+    return sum(1 for location in game_state.game_map if game_state.contains_stationary_unit(location))
+
+
+def main(repeat=5, number=200):
+    game_state = make_board()
+    nested = NestedMap(game_state.game_map)
+    nested_scan = lambda: scan_checked(nested)
+    # (name, nested list case, flat list case)
+    cases = [
+        ("full scan, game_map[x, y]", nested_scan, lambda: scan_checked(game_state.game_map)),
+        ("full scan, units_at", nested_scan, lambda: scan_units_at(game_state.game_map)),
+        ("full scan, get_cells", nested_scan, lambda: scan_cells(game_state.game_map)),
+        ("contains_stationary_unit x 420", lambda: sum(1 for location in nested if nested.contains_stationary_unit(location)),
+         lambda: contains_stationary_units(game_state)),
+    ]
+    try:
+        from algo_strategy import AlgoStrategy
+        algo = AlgoStrategy()
+        algo.on_game_start(game_state.config)
+        cases.append(("detect_enemy_unit", lambda: nested.detect_enemy_unit(unit_type=["DF"]),
+                      lambda: algo.detect_enemy_unit(game_state, unit_type=["DF"])))
+    except ImportError:
+        print("algo_strategy.py not importable, skipping detect_enemy_unit")
+
+    print("{:<32} {:>12} {:>12} {:>8}".format("", "nested", "flat", "speedup"))
+    for name, nested_case, flat_case in cases:
+        before, after = (min(timeit.repeat(case, repeat=repeat, number=number)) / number for case in (nested_case, flat_case))
+        print("{:<32} {:9.1f} us {:9.1f} us {:7.1f}x".format(name, before * 1e6, after * 1e6, before / after))
+
+
+if __name__ == "__main__":
+    main()
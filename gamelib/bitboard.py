@@ -0,0 +1,295 @@
+"""
+Integer bitmask representation of the diamond shaped game board.
+
+Every in-bounds location owns one bit of a Python integer, so a whole set of
+locations (the blocked cells, a flood fill frontier, an edge...) is a single int
+and set operations on them are single bitwise operations.
+
+Bits are laid out row by row, ROW_STRIDE bits per row, so the bit index of a
+location is its gamelib.geometry cell id. The row stride is one larger than the
+arena so that the padding column between two rows is never in bounds, which
+stops horizontal shifts from wrapping onto the next row.
+
+Several boards can be packed side by side into one int, each in its own lane of
+LANE_BYTES bytes. Lanes end with at least one padding row, so the same shifts and
+masks operate on every packed board at once without leaking between boards.
+"""
+
+from . import geometry
+from .geometry import ARENA_SIZE, ROW_STRIDE, TOP_RIGHT, TOP_LEFT, BOTTOM_LEFT, BOTTOM_RIGHT
+from .geometry import row_bounds as _row_bounds, cell_id as bit_index, location_of, in_bounds
+
+ROW_MASK = (1 << ARENA_SIZE) - 1
+
+
+def _mask_of(locations):
+    mask = 0
+    for x, y in locations:
+        mask |= 1 << bit_index(x, y)
+    return mask
+
+
+BOARD_MASK = _mask_of(geometry.VALID_LOCATIONS)
+EDGE_MASKS = [_mask_of(edge) for edge in geometry.EDGES]
+
+LANE_BYTES = ((ARENA_SIZE + 1) * ROW_STRIDE + 7) // 8
+LANE_BITS = LANE_BYTES * 8
+
+
+def contains(mask, location):
+    """True if the bit for location is set in mask. Out of bounds locations are never contained.
+
+    """
+    x, y = location
+    if not in_bounds(x, y):
+        return False
+    return (mask >> bit_index(x, y)) & 1 == 1
+
+
+def from_locations(locations):
+    """Builds a mask from a list of locations, ignoring any that are out of bounds
+
+    """
+    mask = 0
+    for x, y in locations:
+        if in_bounds(x, y):
+            mask |= 1 << bit_index(x, y)
+    return mask
+
+
+def to_locations(mask):
+    """Lists the locations of every set bit, in increasing bit order (bottom row first, left to right)
+
+    """
+    locations = []
+    while mask:
+        low_bit = mask & -mask
+        locations.append(location_of(low_bit.bit_length() - 1))
+        mask ^= low_bit
+    return locations
+
+
+def rows_mask(rows):
+    """The mask of every in bounds location whose y coordinate is in rows
+
+    """
+    mask = 0
+    for y in rows:
+        if 0 <= y < ARENA_SIZE:
+            mask |= ROW_MASK << (y * ROW_STRIDE)
+    return mask & BOARD_MASK
+
+
+def columns_mask(columns):
+    """The mask of every in bounds location whose x coordinate is in columns
+
+    """
+    column = 0
+    for x in columns:
+        if 0 <= x < ARENA_SIZE:
+            column |= 1 << x
+    mask = 0
+    for y in range(ARENA_SIZE):
+        mask |= column << (y * ROW_STRIDE)
+    return mask & BOARD_MASK
+
+
+def count(mask):
+    """The number of locations set in mask
+
+    """
+    return bin(mask).count("1")
+
+
+def blocked_mask(game_map):
+    """Builds the mask of locations holding a structure on the given GameMap
+
+    """
+    mask = 0
+    cells = game_map.get_cells()
+    for cell in geometry.VALID_CELLS:
+        for unit in cells[cell]:
+            if unit.stationary:
+                mask |= 1 << cell
+                break
+    return mask
+
+
+def expand(mask):
+    """The mask plus every location orthogonally adjacent to it. The result is not clipped to the board.
+
+    """
+    return mask | (mask << 1) | (mask >> 1) | (mask << ROW_STRIDE) | (mask >> ROW_STRIDE)
+
+
+def flood_fill(seed, open_mask):
+    """Every location of open_mask reachable from seed by orthogonal steps through open_mask
+
+    """
+    region = seed & open_mask
+    frontier = region
+    while frontier:
+        frontier = expand(frontier) & open_mask & ~region
+        region |= frontier
+    return region
+
+
+def bfs_layers(seeds, open_mask, stop_mask=0):
+    """Breadth first search from seeds through open_mask, one mask per distance.
+
+    Args:
+        * seeds: The mask of distance 0 locations. Seeds outside of open_mask are ignored
+        * open_mask: The mask of traversable locations
+        * stop_mask: If given, the search stops after the first layer that intersects it
+
+    Returns:
+        A list of masks, element i holding every location at distance i from the seeds
+
+    """
+    frontier = seeds & open_mask
+    visited = frontier
+    layers = []
+    while frontier:
+        layers.append(frontier)
+        if frontier & stop_mask:
+            break
+        frontier = expand(frontier) & open_mask & ~visited
+        visited |= frontier
+    return layers
+
+
+def row_of(mask, y):
+    """The bits of row y of mask, shifted down so that bit x represents [x, y]
+
+    """
+    return (mask >> (y * ROW_STRIDE)) & ROW_MASK
+
+
+def most_ideal_bit(pocket, direction):
+    """The bit of the most ideal self destruct location in a pocket of open space.
+    Idealness favours the row furthest towards the target edge, then the column furthest towards it.
+
+    Args:
+        * pocket: A non empty mask
+        * direction: A direction [x,y] representing the target edge. For example, [1,1] for the top right
+
+    """
+    if direction[1] == 1:
+        y = (pocket.bit_length() - 1) // ROW_STRIDE
+    else:
+        y = ((pocket & -pocket).bit_length() - 1) // ROW_STRIDE
+    row = row_of(pocket, y)
+    if direction[0] == 1:
+        x = row.bit_length() - 1
+    else:
+        x = (row & -row).bit_length() - 1
+    return 1 << bit_index(x, y)
+
+
+EDGE_DIRECTIONS = {TOP_RIGHT: [1, 1], TOP_LEFT: [-1, 1], BOTTOM_LEFT: [-1, -1], BOTTOM_RIGHT: [1, -1]}
+
+
+class PocketLabels:
+    """Labels every open location with the pocket of connected open space it belongs to.
+
+    Attributes :
+        * blocked (int): The mask of blocked locations the labels were computed for
+        * pockets (list): The mask of each pocket, indexed by pocket label
+
+    """
+    def __init__(self, blocked):
+        self.blocked = blocked
+        self.pockets = []
+        self._labels = [-1] * (ARENA_SIZE * ROW_STRIDE)
+        self._self_destruct = {}
+
+        remaining = BOARD_MASK & ~blocked
+        while remaining:
+            pocket = flood_fill(remaining & -remaining, remaining)
+            remaining &= ~pocket
+            label = len(self.pockets)
+            self.pockets.append(pocket)
+            while pocket:
+                low_bit = pocket & -pocket
+                self._labels[low_bit.bit_length() - 1] = label
+                pocket ^= low_bit
+
+    def label(self, location):
+        """The label of the pocket holding location, or -1 if it is blocked or out of bounds
+
+        """
+        x, y = location
+        if not in_bounds(x, y):
+            return -1
+        return self._labels[bit_index(x, y)]
+
+    def pocket_mask(self, location):
+        """The mask of the pocket holding location, or 0 if it is blocked or out of bounds
+
+        """
+        label = self.label(location)
+        return self.pockets[label] if label >= 0 else 0
+
+    def edges_touched(self, location):
+        """The edges the pocket holding location reaches, as a list of edge constants
+
+        """
+        pocket = self.pocket_mask(location)
+        return [edge for edge in (TOP_RIGHT, TOP_LEFT, BOTTOM_LEFT, BOTTOM_RIGHT) if pocket & EDGE_MASKS[edge]]
+
+    def can_reach_edge(self, location, edge):
+        """True if a unit at location can walk to the given edge
+
+        """
+        return self.pocket_mask(location) & EDGE_MASKS[edge] != 0
+
+    def self_destruct_location(self, location, edge):
+        """Where a unit at location heading for edge ends its path when it cannot reach the edge
+
+        Returns:
+            The most ideal location of its pocket, or None if the unit can reach the edge or location is blocked
+
+        """
+        label = self.label(location)
+        if label < 0 or self.pockets[label] & EDGE_MASKS[edge]:
+            return None
+        key = (label, edge)
+        if key not in self._self_destruct:
+            self._self_destruct[key] = location_of(most_ideal_bit(self.pockets[label], EDGE_DIRECTIONS[edge]).bit_length() - 1)
+        return list(self._self_destruct[key])
+
+
+def mask_from_grid(grid):
+    """Builds a mask from a 28 x 28 grid indexed grid[x][y], with a truthy value for every set location
+
+    """
+    mask = 0
+    for y in range(ARENA_SIZE):
+        start_x, end_x = _row_bounds(y)
+        for x in range(start_x, end_x + 1):
+            if grid[x][y]:
+                mask |= 1 << bit_index(x, y)
+    return mask
+
+
+def pack_lanes(masks):
+    """Packs a list of board masks into one int, mask i occupying lane i
+
+    """
+    return int.from_bytes(b"".join(mask.to_bytes(LANE_BYTES, "little") for mask in masks), "little")
+
+
+def lane_bytes(packed, count):
+    """The little endian bytes of a packed int holding count lanes. Bit index of lane i is at
+    byte i * LANE_BYTES + index // 8, bit index % 8
+
+    """
+    return packed.to_bytes(count * LANE_BYTES, "little")
+
+
+def unpack_lanes(packed, count):
+    """Splits an int packed by pack_lanes back into a list of count board masks
+
+    """
+    data = lane_bytes(packed, count)
+    return [int.from_bytes(data[i * LANE_BYTES:(i + 1) * LANE_BYTES], "little") for i in range(count)]
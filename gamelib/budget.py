@@ -0,0 +1,193 @@
+"""
+Time budgets for a turn.
+
+A TurnBudget holds a monotonic deadline for the current turn. Long analyses call
+checkpoint() now and then, which raises BudgetExceeded once the deadline has
+passed, and anytime searches keep their best answer in an AnytimeResult so they
+can stop at any checkpoint with something to submit. A GameState attached to
+the budget is submitted when the turn ends early, and by a watchdog thread if
+the algo is still busy shortly after the deadline.
+"""
+import threading
+import time
+
+from .util import debug_write
+
+DEFAULT_SOFT_LIMIT_MS = 5000.0
+
+
+class BudgetExceeded(Exception):
+    """Raised by TurnBudget.checkpoint once the deadline has passed"""
+    pass
+
+
+class TurnBudget:
+    """A monotonic deadline for one turn.
+
+    Attributes :
+        * started (float): The time.monotonic() value the turn started at
+        * deadline (float): The time.monotonic() value by which the turn should be submitted
+        * grace (float): How many seconds after the deadline the watchdog submits an attached GameState
+
+    """
+    def __init__(self, seconds, grace=0.5, clock=time.monotonic):
+        """
+        Args:
+            seconds: The length of the budget from now, in seconds
+            grace: Seconds past the deadline before the watchdog submits an attached GameState
+            clock: The monotonic clock to read, time.monotonic by default
+
+        """
+        self._clock = clock
+        self.started = clock()
+        self.deadline = self.started + seconds
+        self.grace = grace
+        self._lock = threading.Lock()
+        self._game_state = None
+        self._watchdog = None
+
+    def __deepcopy__(self, memo):
+        # Copies of a GameState run against the same clock and deadline
+        return self
+
+    @classmethod
+    def for_turn(cls, config, state, fraction=0.8):
+        """Builds the budget of a turn from the config's soft time limit and the time reported in p1Stats.
+
+        Args:
+            config: The game config. timingAndReplay.waitTimeBotSoft is the soft limit, in milliseconds
+            state: The decoded JSON of the turn message
+            fraction: The share of the soft limit the algo's own work may use
+
+        If the previous turn took longer than the soft limit (p1Stats[3], in milliseconds), the share is halved
+        to leave more room for the time spent outside of on_turn.
+        """
+        soft_limit = config.get("timingAndReplay", {}).get("waitTimeBotSoft", DEFAULT_SOFT_LIMIT_MS)
+        stats = state.get("p1Stats", [])
+        last_time = float(stats[3]) if len(stats) > 3 else 0.0
+        if last_time > soft_limit:
+            fraction /= 2
+        return cls(soft_limit * fraction / 1000.0)
+
+    def elapsed(self):
+        """Seconds since the turn started
+
+        """
+        return self._clock() - self.started
+
+    def remaining(self):
+        """Seconds left before the deadline, never negative
+
+        """
+        return max(self.deadline - self._clock(), 0.0)
+
+    def expired(self):
+        """True once the deadline has passed
+
+        """
+        return self._clock() >= self.deadline
+
+    def checkpoint(self):
+        """Raises BudgetExceeded if the deadline has passed. Call it regularly inside long loops.
+
+        """
+        if self._clock() >= self.deadline:
+            raise BudgetExceeded()
+
+    def sub_budget(self, fraction=None, seconds=None):
+        """A budget for one stage of the turn, ending no later than this one
+
+        Args:
+            fraction: The share of the remaining time the stage may use
+            seconds: The number of seconds the stage may use
+
+        """
+        length = self.remaining()
+        if fraction is not None:
+            length *= fraction
+        if seconds is not None:
+            length = min(length, seconds)
+        return TurnBudget(length, self.grace, self._clock)
+
+    def attach(self, game_state):
+        """Makes a GameState the turn that finish, or the watchdog, submits if the algo did not.
+        The watchdog starts with the first attached GameState.
+
+        """
+        with self._lock:
+            if self._game_state is not None:
+                return
+            self._game_state = game_state
+        if self._clock is time.monotonic:
+            self._watchdog = threading.Timer(self.remaining() + self.grace, self.__on_watchdog)
+            self._watchdog.daemon = True
+            self._watchdog.start()
+
+    def __on_watchdog(self):
+        game_state = self._game_state
+        if game_state is not None and not game_state.submitted:
+            debug_write("Turn budget exceeded by {:.2f}s, submitting the best plan so far".format(self._clock() - self.deadline))
+            game_state.submit_turn()
+
+    def finish(self):
+        """Ends the turn: stops the watchdog and submits the attached GameState if it was not submitted yet
+
+        """
+        if self._watchdog is not None:
+            self._watchdog.cancel()
+        game_state = self._game_state
+        if game_state is not None and not game_state.submitted:
+            game_state.submit_turn()
+
+
+class AnytimeResult:
+    """The best answer found so far by an anytime search.
+
+    Attributes :
+        * best: The best candidate offered, None until one is offered
+        * score: The score of best, higher is better
+        * offers (int): How many candidates were offered
+
+    """
+    def __init__(self):
+        self.best = None
+        self.score = None
+        self.offers = 0
+
+    def offer(self, candidate, score):
+        """Keeps candidate if it scores higher than the best so far
+
+        Returns:
+            True if candidate is the new best
+
+        """
+        self.offers += 1
+        if self.score is None or score > self.score:
+            self.best = candidate
+            self.score = score
+            return True
+        return False
+
+
+def run_anytime(candidates, evaluate, budget, result=None):
+    """Scores candidates one after another until they run out or the budget does.
+
+    Args:
+        candidates: An iterable of candidates, best guesses first
+        evaluate: A function scoring a candidate, higher is better. It may call budget.checkpoint()
+        budget: The TurnBudget to stay within
+        result: An AnytimeResult to add to, a new one if None
+
+    Returns:
+        The AnytimeResult holding the best candidate scored in time
+
+    """
+    if result is None:
+        result = AnytimeResult()
+    try:
+        for candidate in candidates:
+            budget.checkpoint()
+            result.offer(candidate, evaluate(candidate))
+    except BudgetExceeded:
+        pass
+    return result
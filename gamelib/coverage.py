@@ -0,0 +1,206 @@
+"""
+Precomputed information about which locations structures can attack.
+
+A CoverageTable holds, for every location of the board and every range used by the
+game config, the bitboard mask of locations within that range. It is built once per
+config (AlgoCore.on_game_start warms it) so range queries never compute a distance.
+"""
+import math
+
+from . import bitboard
+
+_tables = {}
+
+
+def get_coverage_table(config):
+    """Gets the CoverageTable for a config, building it the first time the config is seen
+
+    """
+    entry = _tables.get(id(config))
+    if entry is None or entry[0] is not config:
+        entry = (config, CoverageTable(config))
+        _tables[id(config)] = entry
+    return entry[1]
+
+
+class CoverageTable:
+    """The locations within range of every location, for every range in the game config.
+
+    Two notions of range are used by gamelib, and both are kept:
+        * in range: the center of the location is closer than radius + getHitRadius,
+          as used by GameMap.get_locations_in_range
+        * attacked: the center of the location is no further than attackRange,
+          as used by GameState.get_attackers
+
+    Tables for the base and upgraded range of every unit type are built up front.
+    Any other range is built the first time it is asked for.
+
+    Attributes :
+        * hit_radius (float): The getHitRadius of the config
+
+    """
+    def __init__(self, config):
+        self.hit_radius = config["unitInformation"][0].get("getHitRadius", 0)
+        self._unit_ranges = {}
+        self._in_range = {}
+        self._attacked = {}
+
+        for unit_info in config["unitInformation"]:
+            upgrade = unit_info.get("upgrade", {})
+            base_range = unit_info.get("attackRange", 0)
+            upgraded_range = upgrade.get("attackRange", base_range)
+            self._unit_ranges[unit_info.get("shorthand")] = (base_range, upgraded_range)
+            for stats in (unit_info, upgrade):
+                for key in ("attackRange", "shieldRange"):
+                    if key in stats:
+                        self.__in_range_table(stats[key])
+                        self.__attacked_table(stats[key])
+
+    def __build(self, radius, covers):
+        reach = int(math.ceil(radius))
+        masks = [0] * (bitboard.ARENA_SIZE * bitboard.ROW_STRIDE)
+        locations = [None] * len(masks)
+        for location in bitboard.to_locations(bitboard.BOARD_MASK):
+            x, y = location
+            mask = 0
+            covered = []
+            for i in range(x - reach, x + reach + 1):
+                for j in range(y - reach, y + reach + 1):
+                    if bitboard.in_bounds(i, j) and covers(math.sqrt((x - i)**2 + (y - j)**2)):
+                        mask |= 1 << bitboard.bit_index(i, j)
+                        covered.append((i, j))
+            index = bitboard.bit_index(x, y)
+            masks[index] = mask
+            locations[index] = tuple(covered)
+        return masks, locations
+
+    def __in_range_table(self, radius):
+        table = self._in_range.get(radius)
+        if table is None:
+            limit = radius + self.hit_radius
+            table = self.__build(radius, lambda distance: distance < limit)
+            self._in_range[radius] = table
+        return table
+
+    def __attacked_table(self, attack_range):
+        table = self._attacked.get(attack_range)
+        if table is None:
+            table = self.__build(attack_range, lambda distance: distance <= attack_range)
+            self._attacked[attack_range] = table
+        return table
+
+    def in_range_mask(self, location, radius):
+        """The mask of locations whose centers are closer than radius + getHitRadius to an in bounds location
+
+        """
+        return self.__in_range_table(radius)[0][bitboard.bit_index(location[0], location[1])]
+
+    def in_range_locations(self, location, radius):
+        """The (x, y) tuples in_range_mask covers, ordered by x then y like GameMap.get_locations_in_range
+
+        """
+        return self.__in_range_table(radius)[1][bitboard.bit_index(location[0], location[1])]
+
+    def attack_mask(self, location, attack_range):
+        """The mask of locations a unit at an in bounds location with the given attackRange can attack.
+        Distances are symmetric, so it is also the mask of locations from which such a unit could attack location.
+
+        """
+        return self.__attacked_table(attack_range)[0][bitboard.bit_index(location[0], location[1])]
+
+    def unit_attack_mask(self, unit):
+        """The mask of locations a GameUnit on the board can attack with its current attackRange
+
+        """
+        return self.attack_mask([unit.x, unit.y], unit.attackRange)
+
+    def type_attack_mask(self, unit_type, location, upgraded=False):
+        """The mask of locations a unit of the given type could attack from an in bounds location
+
+        Args:
+            * unit_type: The shorthand of the unit type, such as TURRET
+            * location: The location of the unit
+            * upgraded: If True, use the upgraded attackRange
+
+        """
+        base_range, upgraded_range = self._unit_ranges[unit_type]
+        return self.attack_mask(location, upgraded_range if upgraded else base_range)
+
+
+class DamageHeatmap:
+    """The damage per frame a mobile unit would take from enemy structures at every location of the board.
+
+    Each structure contributes its own (possibly upgraded) damage to every location within its own
+    attack range, the same locations for which GameState.get_attackers would list it.
+    The heatmap is kept up to date one structure at a time with refresh, so adding or upgrading
+    a turret only touches the locations that turret covers.
+
+    Attributes :
+        * damage (list): damage[player_index][bit_index] is the damage a unit controlled by player_index takes at that location
+
+    """
+    def __init__(self, game_map):
+        """Builds the heatmap from every structure on the map
+
+        Args:
+            game_map: The GameMap to read structures from
+
+        """
+        self.game_map = game_map
+        self._coverage = get_coverage_table(game_map.config)
+        size = bitboard.ARENA_SIZE * bitboard.ROW_STRIDE
+        self.damage = [[0.0] * size, [0.0] * size]
+        self._sources = {}
+        for location in bitboard.to_locations(game_map.get_blocked_mask()):
+            self.refresh(location)
+
+    def copy(self, game_map):
+        """A heatmap with the same damage that reads structures from another map, such as a fork of this one
+
+        """
+        heatmap = DamageHeatmap.__new__(DamageHeatmap)
+        heatmap.game_map = game_map
+        heatmap._coverage = self._coverage
+        heatmap.damage = [list(damage) for damage in self.damage]
+        heatmap._sources = dict(self._sources)
+        return heatmap
+
+    def refresh(self, location):
+        """Updates the heatmap after the structure at location was added, removed, replaced or upgraded
+
+        """
+        index = bitboard.bit_index(location[0], location[1])
+        previous = self._sources.pop(index, None)
+        if previous is not None:
+            self.__apply(location, previous, -1)
+
+        for unit in self.game_map.units_at(location[0], location[1]):
+            if unit.stationary and unit.damage_i > 0 and unit.player_index in (0, 1):
+                source = (unit.player_index, unit.damage_i, unit.attackRange)
+                self._sources[index] = source
+                self.__apply(location, source, 1)
+
+    def __apply(self, location, source, sign):
+        attacker_index, damage, attack_range = source
+        target = self.damage[1 - attacker_index]
+        covered = self._coverage.attack_mask(location, attack_range)
+        while covered:
+            low_bit = covered & -covered
+            target[low_bit.bit_length() - 1] += sign * damage
+            covered ^= low_bit
+
+    def damage_at(self, location, player_index=0):
+        """The damage per frame a unit controlled by player_index takes from structures at location
+
+        """
+        x, y = location
+        if not bitboard.in_bounds(x, y):
+            return 0
+        return self.damage[player_index][bitboard.bit_index(x, y)]
+
+    def path_damage(self, path, player_index=0):
+        """The total damage a unit controlled by player_index takes over a path, one frame per location
+
+        """
+        damage = self.damage[player_index]
+        return sum(damage[bitboard.bit_index(x, y)] for x, y in path)
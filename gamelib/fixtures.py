@@ -0,0 +1,204 @@
+"""
+A game config and turn 0 state for building boards outside of a game.
+
+The tests and gamelib.bench build their boards from these instead of waiting for
+the game engine to send a config.
+"""
+import json
+
+from .game_state import GameState
+
+CONFIG = """
+{
+    "seasonCompatibilityModeP1": 5,
+    "seasonCompatibilityModeP2": 5,
+    "debug":{
+        "printMapString":false,
+        "printTStrings":false,
+        "printActStrings":false,
+        "printHitStrings":false,
+        "printPlayerInputStrings":false,
+        "printBotErrors":true,
+        "printPlayerGetHitStrings":false
+    },
+    "unitInformation": [
+        {
+        "icon": "S3_filter",
+        "iconxScale": 0.4,
+        "iconyScale": 0.4,
+        "cost1": 1.0,
+        "getHitRadius":0.01,
+        "display":"filter",
+        "shorthand":"FF",
+        "startHealth":75.0,
+        "unitCategory": 0,
+        "refundPercentage": 0.75,
+        "turnsRequiredToRemove": 1,
+        "upgrade": {
+            "startHealth": 150.0
+        }
+        },
+        {
+        "icon": "S3_encryptor",
+        "iconxScale": 0.5,
+        "iconyScale": 0.5,
+        "cost1":4.0,
+        "getHitRadius":0.01,
+        "display":"encryptor",
+        "shieldRange":0,
+        "shorthand":"EF",
+        "startHealth":30.0,
+        "unitCategory": 0,
+        "refundPercentage": 0.75,
+        "turnsRequiredToRemove": 1,
+        "generatesResource1": 1,
+        "upgrade": {
+            "generatesResource2": 1
+        }
+        },
+        {
+        "icon": "S3_destructor",
+        "iconxScale": 0.5,
+        "iconyScale": 0.5,
+        "attackDamageWalker":5.0,
+        "cost1":2.0,
+        "getHitRadius":0.01,
+        "display":"destructor",
+        "attackRange":2.5,
+        "shorthand":"DF",
+        "startHealth":90.0,
+        "unitCategory": 0,
+        "refundPercentage": 0.75,
+        "turnsRequiredToRemove": 1,
+        "upgrade": {
+            "cost1": 4.0,
+            "attackRange":3.5,
+            "attackDamageWalker":15.0
+        }
+        },
+        {
+        "icon": "S3_ping",
+        "iconxScale": 0.7,
+        "iconyScale": 0.7,
+        "attackDamageTower":2.0,
+        "attackDamageWalker":2.0,
+        "playerBreachDamage":1.0,
+        "cost2":1.0,
+        "getHitRadius":0.01,
+        "display":"ping",
+        "attackRange":3.5,
+        "shorthand":"PI",
+        "startHealth":15.0,
+        "speed":1,
+        "unitCategory": 1,
+        "selfDestructDamageWalker": 15.0,
+        "selfDestructDamageTower": 15.0,
+        "metalForBreach": 1.0,
+        "selfDestructRange": 1.5,
+        "selfDestructStepsRequired": 5
+        },
+        {
+        "icon": "S3_emp",
+        "iconxScale": 0.47,
+        "iconyScale": 0.47,
+        "attackDamageWalker":6.0,
+        "attackDamageTower":6.0,
+        "playerBreachDamage":1.0,
+        "cost2":3.0,
+        "getHitRadius":0.01,
+        "display":"emp",
+        "attackRange":4.5,
+        "shorthand":"EI",
+        "startHealth":5.0,
+        "speed":0.5,
+        "unitCategory": 1,
+        "selfDestructDamageWalker": 5.0,
+        "selfDestructDamageTower": 5.0,
+        "metalForBreach": 1.0,
+        "selfDestructRange": 1.5,
+        "selfDestructStepsRequired": 5
+        },
+        {
+        "icon": "S3_scrambler",
+        "iconxScale": 0.5,
+        "iconyScale": 0.5,
+        "attackDamageWalker":20.0,
+        "playerBreachDamage":1.0,
+        "cost2":1.0,
+        "getHitRadius":0.01,
+        "display":"scrambler",
+        "attackRange":4.5,
+        "shorthand":"SI",
+        "startHealth":40.0,
+        "speed":0.25,
+        "unitCategory": 1,
+        "selfDestructDamageWalker": 40.0,
+        "selfDestructDamageTower": 40.0,
+        "metalForBreach": 1.0,
+        "selfDestructRange": 1.5,
+        "selfDestructStepsRequired": 5
+        },
+        {
+        "display":"Remove",
+        "shorthand":"RM",
+        "icon": "S3_removal",
+        "iconxScale": 0.4,
+        "iconyScale": 0.4
+        },
+        {
+        "display":"Upgrade",
+        "shorthand":"UP",
+        "icon": "S3_upgrade",
+        "iconxScale": 0.4,
+        "iconyScale": 0.4
+        }
+    ],
+    "timingAndReplay":{
+        "waitTimeBotMax":35000,
+        "playWaitTimeBotMax":40000,
+        "waitTimeManual":1820000,
+        "waitForever":false,
+        "waitTimeBotSoft":5000,
+        "playWaitTimeBotSoft":10000,
+        "replaySave":1,
+        "playReplaySave":0,
+        "storeBotTimes":true,
+        "waitTimeStartGame":3000,
+        "waitTimeEndGame":3000
+    },
+    "resources":{
+        "turnIntervalForBitCapSchedule":10,
+        "turnIntervalForBitSchedule":10,
+        "bitRampBitCapGrowthRate":5.0,
+        "roundStartBitRamp":10,
+        "bitGrowthRate":1.0,
+        "startingHP":40.0,
+        "maxBits":150.0,
+        "bitsPerRound":5.0,
+        "coresPerRound":5.0,
+        "coresForPlayerDamage":1.0,
+        "startingBits":5.0,
+        "bitDecayPerRound":0.25,
+        "startingCores":20.0
+    },
+    "misc":{
+        "numBlockedLocations": 0,
+        "blockedLocations": [
+        ]
+    }
+}
+"""
+
+TURN_0 = """{"p2Units":[[],[],[],[],[],[],[]],"turnInfo":[0,0,-1],"p1Stats":[30.0,25.0,5.0,0],"p1Units":[[],[],[],[],[],[],[]],"p2Stats":[30.0,25.0,5.0,0],"events":{"selfDestruct":[],"breach":[],"damage":[],"shield":[],"move":[],"spawn":[],"death":[],"attack":[],"melee":[]}}"""
+
+
+def make_turn_0_state():
+    """Creates the GameState of turn 0 of a game played with CONFIG, with warnings suppressed
+
+    Returns:
+        A GameState with an empty board
+
+    """
+    state = GameState(json.loads(CONFIG), TURN_0)
+    state.suppress_warnings(True)
+    return state
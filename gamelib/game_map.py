@@ -1,4 +1,6 @@
 import math
+from . import bitboard, geometry
+from .coverage import get_coverage_table
 from .unit import GameUnit
 from .util import debug_write
 
@@ -18,6 +20,20 @@ class GameMap:
         * TOP_LEFT (int): A constant that represents the top left edge
         * BOTTOM_LEFT (int): Hidden challenge! Can you guess what this constant represents???
         * BOTTOM_RIGHT (int): A constant that represents the bottom right edge
+        * structure_version (int): Increases every time a location becomes blocked or unblocked
+        * unit_version (int): Increases every time the units at a location change
+        * unit_arrays (UnitArrays): The arrays loaded by load_unit_arrays, or None
+
+    Units are stored in one flat list with an entry per gamelib.geometry cell id. game_map[x, y] checks
+    its arguments and warns about invalid locations; gamelib code that has already checked a location
+    reads it with units_at or get_cells instead.
+
+    fork returns a child map sharing every cell with its parent. A cell is copied, with its units, the
+    first time either map changes it, so lists and units read from a map that was forked must not be
+    modified in place. Use add_unit, remove_unit and mutable_units_at instead.
+
+    While a savepoint is set, every change made through those methods is logged, and rollback undoes
+    the changes made since a savepoint in reverse order, in time proportional to the number of changes.
 
     """
     def __init__(self, config):
@@ -35,45 +51,330 @@ class GameMap:
         self.TOP_LEFT = 1
         self.BOTTOM_LEFT = 2
         self.BOTTOM_RIGHT = 3
-        self.__map = self.__empty_grid()
-        self.__start = [13,0]
+        self.__cells = [[] for _ in range(geometry.CELL_COUNT)]
+        # The cells this map may change in place, None for all of them. Cells not in it are shared with a fork
+        self.__owned = None
+        # (cell, copies of the units that were there) for every change since the first savepoint, None without savepoints
+        self.__journal = None
+        # Savepoints are (serial, journal length) tokens, oldest first. The serial tells apart savepoints taken at the same length
+        self.__savepoints = []
+        self.__savepoint_serial = 0
+        self.__pending = None
+        self.unit_arrays = None
+        self.__structure_listeners = []
+        self.__blocked = None
+        self.__pocket_labels = None
+        self.__unit_masks = {}
+        self.structure_version = 0
+        self.unit_version = 0
     
     def __getitem__(self, location):
         if len(location) == 2 and self.in_arena_bounds(location):
             x,y = location
-            return self.__map[x][y]
+            cell = y * geometry.ROW_STRIDE + x
+            if self.__pending and cell in self.__pending:
+                return self.__materialize(cell)
+            return self.__cells[cell]
         self._invalid_coordinates(location)
 
     def __setitem__(self, location, val):
         if type(location) == tuple and len(location) == 2 and self.in_arena_bounds(location):
-            self.__map[location[0]][location[1]] = val
+            previous_structure = self.__structure_at(location)
+            cell = geometry.cell_id(location[0], location[1])
+            self.__replace(cell, val)
+            self.__reindex(cell)
+            self.__notify_if_changed(location, previous_structure)
             return
         self._invalid_coordinates(location)
 
     def __iter__(self):
-        self.__start = [13,0]
-        return self
-    
-    def __next__(self):
-        location = self.__start
-        if location == [15,27]:
-            raise StopIteration
-        new_location = [location[0]+1, location[1]]
-        while not self.in_arena_bounds(new_location) and not location == [14,27]:
-            if new_location[0] == self.ARENA_SIZE:
-                new_location = [0, new_location[1]+1]
+        # Row by row from the bottom, left to right. Each call gets its own iterator, so loops can be nested
+        return ([x, y] for x, y in geometry.VALID_LOCATIONS)
+
+    def units_at(self, x, y):
+        """The list of units at [x, y], without checking the location.
+        x and y must be integers of an in bounds location, otherwise the result is meaningless.
+
+        """
+        cell = y * geometry.ROW_STRIDE + x
+        if self.__pending and cell in self.__pending:
+            return self.__materialize(cell)
+        return self.__cells[cell]
+
+    def get_cells(self):
+        """Gets the flat list of cells, element cell_id holding the list of units at that location.
+        Only the entries at geometry.VALID_CELLS are locations of the board. The list must not be modified.
+
+        """
+        if self.__pending:
+            for cell in list(self.__pending):
+                self.__materialize(cell)
+        return self.__cells
+
+    def fork(self):
+        """Creates a child map sharing this map's cells copy on write.
+        Changing either map afterwards copies the changed cells only, so forks can be nested cheaply.
+        Pending lazily loaded units are created first. Structure listeners are not carried over.
+
+        Returns:
+            The child GameMap
+
+        """
+        self.get_cells()
+        child = GameMap.__new__(GameMap)
+        child.__dict__.update(self.__dict__)
+        child.__cells = list(self.__cells)
+        child.__unit_masks = dict(self.__unit_masks)
+        child.__structure_listeners = []
+        child.__journal = None
+        child.__savepoints = []
+        child.__owned = set()
+        self.__owned = set()
+        return child
+
+    def __writable(self, cell):
+        # The units at cell, copied first if the cell is shared with a fork
+        units = self.__cells[cell]
+        owned = self.__owned
+        if owned is None or cell in owned:
+            return units
+        units = [unit.copy() for unit in units]
+        self.__cells[cell] = units
+        owned.add(cell)
+        return units
+
+    def __replace(self, cell, units):
+        self.__record(cell)
+        self.__cells[cell] = units
+        if self.__owned is not None:
+            self.__owned.add(cell)
+
+    def __change(self, cell):
+        # The units at cell, ready to be changed in place
+        self.__record(cell)
+        return self.__writable(cell)
+
+    def __record(self, cell):
+        if self.__journal is not None:
+            self.__journal.append((cell, [unit.copy() for unit in self.__cells[cell]]))
+
+    def savepoint(self):
+        """Starts logging changes, so that they can be undone by rollback
+
+        Returns:
+            The savepoint to pass to rollback or release
+
+        """
+        if self.__journal is None:
+            self.__journal = []
+        self.__savepoint_serial += 1
+        savepoint = (self.__savepoint_serial, len(self.__journal))
+        self.__savepoints.append(savepoint)
+        return savepoint
+
+    def __savepoint_position(self, savepoint):
+        for position, other in enumerate(self.__savepoints):
+            if other == savepoint:
+                return position
+        return None
+
+    def rollback(self, savepoint):
+        """Undoes every change made since a savepoint, newest first. Structure listeners see each undone change.
+        The savepoint stays set, so changes can be tried and rolled back again, but later savepoints are forgotten.
+        Units at the restored locations are copies of the units that were there when the changes were made.
+
+        Returns:
+            True if the changes were undone, False if the savepoint is not set
+
+        """
+        position = self.__savepoint_position(savepoint)
+        if position is None:
+            self.warn("Rolled back to savepoint {}, which is not set".format(savepoint))
+            return False
+        journal = self.__journal
+        length = savepoint[1]
+        while len(journal) > length:
+            cell, units = journal.pop()
+            location = geometry.location_of(cell)
+            previous_structure = self.__structure_at(location)
+            self.__cells[cell] = units
+            if self.__owned is not None:
+                self.__owned.add(cell)
+            self.__reindex(cell)
+            self.__notify_if_changed(location, previous_structure)
+        del self.__savepoints[position + 1:]
+        return True
+
+    def release(self, savepoint):
+        """Keeps the changes made since a savepoint and forgets it, along with every later savepoint.
+        Logging stops once no savepoint is left.
+
+        """
+        position = self.__savepoint_position(savepoint)
+        if position is None:
+            self.warn("Released savepoint {}, which is not set".format(savepoint))
+            return
+        del self.__savepoints[position:]
+        if not self.__savepoints:
+            self.__journal = None
+
+    def mutable_units_at(self, x, y):
+        """The list of units at [x, y], owned by this map so that its units may be changed in place,
+        for example by GameUnit.upgrade. Call unit_changed after changing them.
+        x and y must be integers of an in bounds location.
+
+        """
+        self.units_at(x, y)
+        return self.__change(y * geometry.ROW_STRIDE + x)
+
+    def load_unit_arrays(self, unit_arrays):
+        """Adds the units of a UnitArrays to the map without creating their GameUnits.
+        The GameUnits at a location are created the first time that location is read. The unit index,
+        blocked mask and versions are updated at once, but structure listeners are not called.
+
+        Args:
+            unit_arrays: The UnitArrays to load, kept as game_map.unit_arrays
+
+        """
+        self.unit_arrays = unit_arrays
+        if self.__pending is None:
+            self.__pending = {}
+        typedef = self.config["unitInformation"]
+        shorthands = [unit_info.get("shorthand") for unit_info in typedef]
+        blocked = self.get_blocked_mask()
+        for cell in unit_arrays.rows_by_cell:
+            rows = unit_arrays.rows_at(cell)
+            # Like rows_by_cell, pending holds a single row as a bare int
+            if cell in self.__pending:
+                self.__pending[cell] = self.__pending_rows(cell) + list(rows)
             else:
-                new_location = [new_location[0]+1, new_location[1]]
-        self.__start = new_location
-        return location 
-
-    def __empty_grid(self):
-        grid = []
-        for x in range(0, self.ARENA_SIZE):
-            grid.append([])
-            for _ in range(0, self.ARENA_SIZE):
-                grid[x].append([])
-        return grid
+                self.__pending[cell] = unit_arrays.rows_by_cell[cell]
+            bit = 1 << cell
+            for row in rows:
+                key = (unit_arrays.owner[row], shorthands[unit_arrays.type_index[row]])
+                self.__unit_masks[key] = self.__unit_masks.get(key, 0) | bit
+                if unit_arrays.stationary[row]:
+                    blocked |= bit
+        if blocked != self.__blocked:
+            self.__blocked = blocked
+            self.structure_version += 1
+        self.unit_version += 1
+
+    def __pending_rows(self, cell):
+        rows = self.__pending[cell]
+        return [rows] if type(rows) is int else list(rows)
+
+    def __materialize(self, cell):
+        rows = self.__pending_rows(cell)
+        del self.__pending[cell]
+        units = self.__writable(cell)
+        for row in rows:
+            units.append(self.unit_arrays.make_unit(row, self.config))
+        return units
+
+    def __structure_at(self, location):
+        for unit in self.units_at(location[0], location[1]):
+            if unit.stationary:
+                return unit
+        return None
+
+    def __reindex(self, cell):
+        self.unit_version += 1
+        bit = 1 << cell
+        keys = set((unit.player_index, unit.unit_type) for unit in self.__cells[cell])
+        for key, mask in self.__unit_masks.items():
+            if mask & bit and key not in keys:
+                self.__unit_masks[key] = mask & ~bit
+        for key in keys:
+            self.__unit_masks[key] = self.__unit_masks.get(key, 0) | bit
+
+    def __notify_if_changed(self, location, previous_structure):
+        if not self.in_arena_bounds(location):
+            return
+        structure = self.__structure_at(location)
+        if structure is previous_structure:
+            return
+        blocked = structure is not None
+        if blocked != (previous_structure is not None):
+            self.structure_version += 1
+            if self.__blocked is not None:
+                bit = 1 << bitboard.bit_index(location[0], location[1])
+                self.__blocked = self.__blocked | bit if blocked else self.__blocked & ~bit
+        for listener in self.__structure_listeners:
+            listener([location[0], location[1]], blocked)
+
+    def add_structure_listener(self, listener):
+        """Registers a function to be called whenever the structure at a location is added, removed or replaced.
+
+        Args:
+            listener: A function taking a location and a boolean, True if the location now holds a structure
+
+        Only changes made through add_unit, place_unit, remove_unit and game_map[x, y] = units are reported. Appending
+        to or removing from the list returned by game_map[x, y] directly is not seen by listeners.
+        """
+        self.__structure_listeners.append(listener)
+
+    def get_blocked_mask(self):
+        """Gets the bitboard mask of every location holding a structure
+
+        Returns:
+            An int with the bit of every blocked location set. See gamelib.bitboard
+
+        """
+        if self.__blocked is None:
+            self.__blocked = bitboard.blocked_mask(self)
+        return self.__blocked
+
+    def get_pocket_labels(self):
+        """Gets the labeling of the board into pockets of connected open space.
+        The labels are computed once and reused until a structure is added or removed.
+
+        Returns:
+            A bitboard.PocketLabels for the current structures
+
+        """
+        blocked = self.get_blocked_mask()
+        if self.__pocket_labels is None or self.__pocket_labels.blocked != blocked:
+            self.__pocket_labels = bitboard.PocketLabels(blocked)
+        return self.__pocket_labels
+
+    def get_pocket(self, location):
+        """Gets the pocket of connected open space a location belongs to
+
+        Args:
+            location: A map location
+
+        Returns:
+            The pocket's label, the same for every location in the pocket, or -1 if location is blocked
+
+        """
+        return self.get_pocket_labels().label(location)
+
+    def can_reach_edge(self, location, edge):
+        """Checks if a mobile unit at a location can walk to an edge
+
+        Args:
+            location: The location of the unit
+            edge: A constant corresponding to one of the 4 edges, such as game_map.TOP_LEFT
+
+        Returns:
+            True if the edge can be reached, False otherwise
+
+        """
+        return self.get_pocket_labels().can_reach_edge(location, edge)
+
+    def get_self_destruct_location(self, location, edge):
+        """Gets where a mobile unit at a location heading for an edge will self destruct
+
+        Args:
+            location: The location of the unit
+            edge: A constant corresponding to one of the 4 edges, such as game_map.TOP_LEFT
+
+        Returns:
+            The location the unit ends its path at, or None if it can reach the edge
+
+        """
+        return self.get_pocket_labels().self_destruct_location(location, edge)
 
     def _invalid_coordinates(self, location):
         self.warn("{} is out of bounds.".format(str(location)))
@@ -89,19 +390,7 @@ class GameMap:
         
         """
         x, y = location
-        half_board = self.HALF_ARENA
-
-        row_size = y + 1
-        startx = half_board - row_size
-        endx = startx + (2 * row_size) - 1
-        top_half_check = (y < self.HALF_ARENA and x >= startx and x <= endx)
-
-        row_size = (self.ARENA_SIZE - 1 - y) + 1
-        startx = half_board - row_size
-        endx = startx + (2 * row_size) - 1
-        bottom_half_check = (y >= self.HALF_ARENA and x >= startx and x <= endx)
-
-        return bottom_half_check or top_half_check
+        return geometry.in_bounds(x, y)
 
     def get_edge_locations(self, quadrant_description):
         """Takes in an edge description and returns a list of locations.
@@ -127,27 +416,7 @@ class GameMap:
             A list with four lists inside of it of locations corresponding to the four edges.
             [0] = top_right, [1] = top_left, [2] = bottom_left, [3] = bottom_right.
         """
-        top_right = []
-        for num in range(0, self.HALF_ARENA):
-            x = self.HALF_ARENA + num
-            y = self.ARENA_SIZE - 1 - num
-            top_right.append([int(x), int(y)])
-        top_left = []
-        for num in range(0, self.HALF_ARENA):
-            x = self.HALF_ARENA - 1 - num
-            y = self.ARENA_SIZE - 1 - num
-            top_left.append([int(x), int(y)])
-        bottom_left = []
-        for num in range(0, self.HALF_ARENA):
-            x = self.HALF_ARENA - 1 - num
-            y = num
-            bottom_left.append([int(x), int(y)])
-        bottom_right = []
-        for num in range(0, self.HALF_ARENA):
-            x = self.HALF_ARENA + num
-            y = num
-            bottom_right.append([int(x), int(y)])
-        return [top_right, top_left, bottom_left, bottom_right]
+        return [[[x, y] for x, y in edge] for edge in geometry.EDGES]
     
     def add_unit(self, unit_type, location, player_index=0):
         """Add a single GameUnit to the map at the given location.
@@ -163,15 +432,35 @@ class GameMap:
         """
         if not self.in_arena_bounds(location):
             self._invalid_coordinates(location)
+            return
         if player_index < 0 or player_index > 1:
             self.warn("Player index {} is invalid. Player index should be 0 or 1.".format(player_index))
 
-        x, y = location
+        cell = geometry.cell_id(location[0], location[1])
+        previous_structure = self.__structure_at(location)
         new_unit = GameUnit(unit_type, self.config, player_index, None, location[0], location[1])
         if not new_unit.stationary:
-            self.__map[x][y].append(new_unit)
+            self.__change(cell).append(new_unit)
         else:
-            self.__map[x][y] = [new_unit]
+            self.__replace(cell, [new_unit])
+        self.__reindex(cell)
+        self.__notify_if_changed(location, previous_structure)
+
+    def place_unit(self, unit):
+        """Adds an existing GameUnit to the units at its own location, keeping the units already there.
+
+        Args:
+            unit: The GameUnit to add. Its x and y must be integers of an in bounds location
+
+        Used by GameState to fill in the map while parsing. Like add_unit, it keeps the unit index
+        and structure listeners up to date.
+        """
+        cell = geometry.cell_id(unit.x, unit.y)
+        location = [unit.x, unit.y]
+        previous_structure = self.__structure_at(location)
+        self.__change(cell).append(unit)
+        self.__reindex(cell)
+        self.__notify_if_changed(location, previous_structure)
 
     def remove_unit(self, location):
         """Remove all units on the map in the given location.
@@ -184,9 +473,72 @@ class GameMap:
         """
         if not self.in_arena_bounds(location):
             self._invalid_coordinates(location)
-        
-        x, y = location
-        self.__map[x][y] = []
+            return
+
+        previous_structure = self.__structure_at(location)
+        cell = geometry.cell_id(location[0], location[1])
+        self.__replace(cell, [])
+        self.__reindex(cell)
+        self.__notify_if_changed(location, previous_structure)
+
+    def unit_changed(self, location):
+        """Tells the map a unit at location was changed in place, for example by GameUnit.upgrade.
+        Caches keyed on unit_version, such as GameState.get_region_sums, are then rebuilt.
+
+        """
+        self.unit_version += 1
+
+    def get_unit_mask(self, player_index, unit_type=None):
+        """Gets the bitboard mask of every location holding a unit of a player, read from the unit index
+
+        Args:
+            player_index: The index corresponding to the player controlling the units, 0 for you 1 for the enemy
+            unit_type: If given, only count units of this type. Use the constants provided in algo_strategy.
+
+        Returns:
+            An int with the bit of every location holding such a unit set. See gamelib.bitboard
+
+        """
+        if unit_type is not None:
+            return self.__unit_masks.get((player_index, unit_type), 0)
+        mask = 0
+        for (owner, _), unit_mask in self.__unit_masks.items():
+            if owner == player_index:
+                mask |= unit_mask
+        return mask
+
+    def get_units(self, player_index, unit_type=None, region=None):
+        """Lists the units of a player, visiting only locations the unit index says hold them
+
+        Args:
+            player_index: The index corresponding to the player controlling the units, 0 for you 1 for the enemy
+            unit_type: If given, only list units of this type
+            region: If given, a bitboard mask of the locations to look at, such as bitboard.rows_mask(range(14, 18))
+
+        Returns:
+            A list of GameUnits, ordered row by row from the bottom of the board
+
+        """
+        mask = self.get_unit_mask(player_index, unit_type)
+        if region is not None:
+            mask &= region
+        units = []
+        cells = self.__cells
+        pending = self.__pending
+        while mask:
+            low_bit = mask & -mask
+            cell = low_bit.bit_length() - 1
+            for unit in (self.__materialize(cell) if pending and cell in pending else cells[cell]):
+                if unit.player_index == player_index and (unit_type is None or unit.unit_type == unit_type):
+                    units.append(unit)
+            mask ^= low_bit
+        return units
+
+    def count_units(self, player_index, unit_type=None, region=None):
+        """Counts the units get_units would list
+
+        """
+        return len(self.get_units(player_index, unit_type, region))
 
     def get_locations_in_range(self, location, radius):
         """Gets locations in a circular area around a location
@@ -205,6 +557,9 @@ class GameMap:
             self._invalid_coordinates(location)
 
         x, y = location
+        if 0 <= radius <= self.ARENA_SIZE and type(x) == int and type(y) == int and bitboard.in_bounds(x, y):
+            return [[i, j] for i, j in self.get_coverage_table().in_range_locations(location, radius)]
+
         locations = []
         search_radius = math.ceil(radius)
         getHitRadius = self.config["unitInformation"][0]['getHitRadius']
@@ -216,6 +571,15 @@ class GameMap:
                     locations.append(new_location)
         return locations
 
+    def get_coverage_table(self):
+        """Gets the precomputed range masks for this map's config
+
+        Returns:
+            The coverage.CoverageTable shared by every map using the same config
+
+        """
+        return get_coverage_table(self.config)
+
     def distance_between_locations(self, location_1, location_2):
         """Euclidean distance
 
@@ -1,12 +1,19 @@
 import math
 import json
 import sys
-
-from .navigation import ShortestPathFinder
-from .util import send_command, debug_write
-from .unit import GameUnit
+import threading
+
+from . import bitboard, geometry, navigation
+from .navigation import ShortestPathFinder, BitboardPathFinder, EdgeDistanceField
+from .coverage import DamageHeatmap
+from .regions import RegionSums
+from .util import send_command, debug_write, decode_message
+from .unit import GameUnit, UnitArrays, get_unit_descriptors
 from .game_map import GameMap
 
+# Held while a turn is marked as submitted, so the turn budget's watchdog and the algo never both send it
+_submit_lock = threading.Lock()
+
 def is_stationary(unit_type):
     """
         Args:
@@ -44,15 +51,23 @@ class GameState:
         * my_time (int): The time you took to submit your previous turn
         * enemy_health (int): Your opponents current remaining health
         * enemy_time (int): Your opponents current remaining time
+        * lazy_units (bool): If units were parsed into game_map.unit_arrays instead of GameUnits
+        * budget (:obj: TurnBudget): The time budget of this turn, None if the turn is not timed
+        * submitted (bool): If submit_turn was called already
 
     """
 
-    def __init__(self, config, serialized_string):
+    def __init__(self, config, serialized_string, path_finder=None, lazy_units=False, budget=None):
         """ Setup a turns variables using arguments passed
 
         Args:
             * config (JSON): A json object containing information about the game
-            * serialized_string (string): A string containing information about the game state at the start of this turn
+            * serialized_string (string): A string containing information about the game state at the start of this turn.
+              A GameMessage or an already decoded dict is used without decoding the JSON again
+            * path_finder: The object used by find_path_to_edge, a ShortestPathFinder if None. Pass a BitboardPathFinder for faster pathing.
+            * lazy_units (bool): If True, units are parsed into game_map.unit_arrays and a GameUnit is only created when its location is read
+            * budget (TurnBudget): The time budget of the turn, usually AlgoCore.turn_budget. The turn is submitted
+              with the actions queued so far if the budget runs out before submit_turn is called
 
         """
         self.serialized_string = serialized_string
@@ -90,21 +105,48 @@ class GameState:
         SP = self.SP
 
         self.game_map = GameMap(self.config)
-        self._shortest_path_finder = ShortestPathFinder()
+        self._shortest_path_finder = path_finder if path_finder is not None else ShortestPathFinder()
+        self._edge_fields = {}
+        self._next_hop_tables = {}
+        self._damage_heatmap = None
+        self._region_sums = None
+        self.game_map.add_structure_listener(self.__on_structure_change)
         self._build_stack = []
         self._deploy_stack = []
         self._player_resources = [
                 {'SP': 0, 'MP': 0},  # player 0, which is you
                 {'SP': 0, 'MP': 0}]  # player 1, which is the opponent
+        self.lazy_units = lazy_units
+        self.submitted = False
         self.__parse_state(serialized_string)
+        self.budget = budget
+        if budget is not None:
+            budget.attach(self)
 
     def __parse_state(self, state_line):
         """
         Fills in map based on the serialized game state so that self.game_map[x,y] is a list of GameUnits at that location.
         state_line is the game state as a json string.
         """
-        state = json.loads(state_line)
+        state = decode_message(state_line)
+        self.__parse_stats(state)
+
+        p1units = state["p1Units"]
+        p2units = state["p2Units"]
+
+        if self.lazy_units:
+            unit_arrays = UnitArrays()
+            self.__load_parsed_units(p1units, 0, unit_arrays)
+            self.__load_parsed_units(p2units, 1, unit_arrays)
+            self.game_map.load_unit_arrays(unit_arrays)
+        else:
+            self.__create_parsed_units(p1units, 0)
+            self.__create_parsed_units(p2units, 1)
 
+    def __parse_stats(self, state):
+        """
+        Helper function for __parse_state and update to read the turn number, health, time and resources.
+        """
         turn_info = state["turnInfo"]
         self.turn_number = int(turn_info[1])
 
@@ -120,12 +162,6 @@ class GameState:
             {'SP': p1_SP, 'MP': p1_MP},
             {'SP': p2_SP, 'MP': p2_MP}]
 
-        p1units = state["p1Units"]
-        p2units = state["p2Units"]
-
-        self.__create_parsed_units(p1units, 0)
-        self.__create_parsed_units(p2units, 1)
-
     def __create_parsed_units(self, units, player_number):
         """
         Helper function for __parse_state to add units to the map.
@@ -141,13 +177,283 @@ class GameState:
                 if unit_type == REMOVE:
                     # Quick fix will deploy engine fix soon
                     if self.contains_stationary_unit([x,y]):
-                        self.game_map[x,y][0].pending_removal = True
+                        self.game_map.units_at(x, y)[0].pending_removal = True
                 elif unit_type == UPGRADE:
                     if self.contains_stationary_unit([x,y]):
-                        self.game_map[x,y][0].upgrade()
+                        self.game_map.units_at(x, y)[0].upgrade()
+                        self.game_map.unit_changed([x, y])
                 else:
                     unit = GameUnit(unit_type, self.config, player_number, hp, x, y)
-                    self.game_map[x,y].append(unit)
+                    self.game_map.place_unit(unit)
+
+    def __load_parsed_units(self, units, player_number, unit_arrays):
+        """
+        Helper function for __parse_state to add units to a UnitArrays without creating GameUnits.
+        """
+        typedef = self.config.get("unitInformation")
+        descriptors = get_unit_descriptors(self.config)
+        for i, unit_types in enumerate(units):
+            unit_type = typedef[i].get("shorthand")
+            for uinfo in unit_types:
+                sx, sy, shp = uinfo[:3]
+                x, y = int(sx), int(sy)
+                # This depends on RM and UP always being the last types to be processed
+                if unit_type == REMOVE or unit_type == UPGRADE:
+                    row = unit_arrays.structure_row(x, y)
+                    if row is not None:
+                        flags = unit_arrays.pending_removal if unit_type == REMOVE else unit_arrays.upgraded
+                        flags[row] = 1
+                else:
+                    unit_arrays.append(x, y, i, player_number, float(shp), descriptors[unit_type].stationary)
+
+    def update(self, serialized_string):
+        """Brings this GameState to a new turn, changing only the units that differ from the ones it holds.
+
+        Units still on the board keep their GameUnit, with their health, upgrade and removal flag updated in place,
+        and the other locations are refilled through game_map. The unit index, blocked mask, edge distance fields
+        and damage heatmap are repaired at the changed locations instead of being rebuilt, and next hop tables are
+        only rebuilt if structures changed. Afterwards the GameState matches one built from serialized_string,
+        with empty build and deploy stacks: units added by attempt_spawn or add_unit are dropped unless the new
+        turn has them too. Lazily parsed units are created first, and the update always creates GameUnits.
+
+        Args:
+            serialized_string: The message of the new turn, in any of the forms GameState accepts
+
+        """
+        state = decode_message(serialized_string)
+        self.serialized_string = serialized_string
+        self.__parse_stats(state)
+        self._build_stack = []
+        self._deploy_stack = []
+        self.submitted = False
+
+        game_map = self.game_map
+        game_map.get_cells()
+        game_map.unit_arrays = None
+        self.lazy_units = False
+
+        wanted = {}
+        self.__collect_parsed_units(state["p1Units"], 0, wanted)
+        self.__collect_parsed_units(state["p2Units"], 1, wanted)
+
+        stale = game_map.get_unit_mask(0) | game_map.get_unit_mask(1)
+        cells = game_map.get_cells()
+        for cell, entries in wanted.items():
+            stale &= ~(1 << cell)
+            units = cells[cell]
+            # Most locations hold one structure that did not change
+            if len(units) == 1 and len(entries) == 1:
+                unit = units[0]
+                player_index, unit_type, health, upgraded, pending_removal = entries[0]
+                if (unit.health == health and unit.unit_type == unit_type and unit.player_index == player_index and
+                        unit.pending_removal == pending_removal and unit.upgraded == upgraded):
+                    continue
+            self.__update_cell(cell, entries)
+        while stale:
+            low_bit = stale & -stale
+            game_map.remove_unit(geometry.location_of(low_bit.bit_length() - 1))
+            stale ^= low_bit
+
+    def __collect_parsed_units(self, units, player_number, wanted):
+        """
+        Helper function for update to list the units of a turn by cell, in the order __create_parsed_units adds them.
+        Each unit is a [player_index, unit_type, health, upgraded, pending_removal] list.
+        """
+        typedef = self.config.get("unitInformation")
+        descriptors = get_unit_descriptors(self.config)
+        row_stride = geometry.ROW_STRIDE
+        for i, unit_types in enumerate(units):
+            unit_type = typedef[i].get("shorthand")
+            # This depends on RM and UP always being the last types to be processed
+            if unit_type == REMOVE or unit_type == UPGRADE:
+                flag = 3 if unit_type == UPGRADE else 4
+                for uinfo in unit_types:
+                    entries = wanted.get(int(uinfo[1]) * row_stride + int(uinfo[0]))
+                    if entries and any(descriptors[entry[1]].stationary for entry in entries):
+                        entries[0][flag] = True
+                continue
+            max_health = descriptors[unit_type].max_health
+            for uinfo in unit_types:
+                sx, sy, shp = uinfo[:3]
+                hp = float(shp)
+                entry = [player_number, unit_type, hp if hp else max_health, False, False]
+                cell = int(sy) * row_stride + int(sx)
+                entries = wanted.get(cell)
+                if entries is None:
+                    wanted[cell] = [entry]
+                else:
+                    entries.append(entry)
+
+    def __update_cell(self, cell, entries):
+        """
+        Helper function for update to make the units at a cell match the entries listed for it.
+        """
+        game_map = self.game_map
+        x, y = geometry.location_of(cell)
+        units = game_map.units_at(x, y)
+        same_units = len(units) == len(entries)
+        if same_units:
+            for unit, (player_index, unit_type, health, upgraded, pending_removal) in zip(units, entries):
+                if unit.player_index != player_index or unit.unit_type != unit_type or (unit.upgraded and not upgraded):
+                    same_units = False
+                    break
+        if not same_units:
+            new_units = []
+            for player_index, unit_type, health, upgraded, pending_removal in entries:
+                unit = GameUnit(unit_type, self.config, player_index, health, x, y)
+                if upgraded:
+                    unit.upgrade()
+                unit.pending_removal = pending_removal
+                new_units.append(unit)
+            game_map[x, y] = new_units
+            return
+
+        if all(unit.health == health and unit.upgraded == upgraded and unit.pending_removal == pending_removal
+               for unit, (_, _, health, upgraded, pending_removal) in zip(units, entries)):
+            return
+        upgrades_changed = False
+        for unit, (_, _, health, upgraded, pending_removal) in zip(game_map.mutable_units_at(x, y), entries):
+            unit.health = health
+            unit.pending_removal = pending_removal
+            if upgraded and not unit.upgraded:
+                unit.upgrade()
+                upgrades_changed = True
+        game_map.unit_changed([x, y])
+        if upgrades_changed and self._damage_heatmap is not None:
+            self._damage_heatmap.refresh([x, y])
+
+    def fork(self):
+        """Creates a child GameState to try hypothetical actions on.
+
+        The child shares the parent's map cells copy on write, see GameMap.fork, and gets its own resources,
+        build and deploy stacks and caches. attempt_spawn, attempt_remove, attempt_upgrade and game_map.add_unit
+        or remove_unit on the child leave the parent unchanged, and the child can be forked again cheaply.
+        A fork is not attached to the turn budget, so submitting the parent is unaffected by its forks.
+
+        Returns:
+            The child GameState
+
+        """
+        child = GameState.__new__(GameState)
+        child.__dict__.update(self.__dict__)
+        child.game_map = self.game_map.fork()
+        child.game_map.add_structure_listener(child.__on_structure_change)
+        child._build_stack = list(self._build_stack)
+        child._deploy_stack = list(self._deploy_stack)
+        child._player_resources = [dict(resources) for resources in self._player_resources]
+        child._edge_fields = {edge: field.copy() for edge, field in self._edge_fields.items()}
+        # Next hop tables are keyed by the blocked mask they were built for, so they can be shared
+        child._next_hop_tables = dict(self._next_hop_tables)
+        child._damage_heatmap = self._damage_heatmap.copy(child.game_map) if self._damage_heatmap is not None else None
+        child._region_sums = None
+        child.submitted = False
+        return child
+
+    def savepoint(self):
+        """Marks the current resources, build and deploy stacks and map, so that attempt_spawn, attempt_remove
+        and attempt_upgrade calls made afterwards can be undone with rollback.
+
+        Returns:
+            The savepoint to pass to rollback or release
+
+        """
+        return (self.game_map.savepoint(), len(self._build_stack), len(self._deploy_stack),
+                [dict(resources) for resources in self._player_resources])
+
+    def rollback(self, savepoint):
+        """Undoes every action taken since a savepoint, in time proportional to the number of actions.
+        The savepoint stays set, so a strategy can try several sequences of actions from the same state.
+
+        Args:
+            savepoint: A savepoint returned by savepoint
+
+        """
+        map_savepoint, build_length, deploy_length, resources = savepoint
+        # Stacks and resources are left alone if the map could not be restored, so they still match it
+        if not self.game_map.rollback(map_savepoint):
+            return
+        del self._build_stack[build_length:]
+        del self._deploy_stack[deploy_length:]
+        self._player_resources = [dict(player_resources) for player_resources in resources]
+
+    def release(self, savepoint):
+        """Keeps the actions taken since a savepoint and forgets it, along with every later savepoint
+
+        """
+        self.game_map.release(savepoint[0])
+
+    def __on_structure_change(self, location, blocked):
+        """
+        Structure listener keeping the cached edge distance fields and damage heatmap in sync with the map.
+        """
+        if self._damage_heatmap is not None:
+            self._damage_heatmap.refresh(location)
+        for field in self._edge_fields.values():
+            if blocked:
+                field.block(location)
+            else:
+                field.unblock(location)
+
+    def get_edge_distance_field(self, target_edge):
+        """Gets the distance field to an edge, building it the first time it is requested.
+        The field is kept up to date as structures are added to or removed from game_map.
+
+        Args:
+            target_edge: The edge the field measures distance to. game_map.TOP_LEFT, game_map.BOTTOM_RIGHT, etc.
+
+        Returns:
+            An EdgeDistanceField, whose pathlength(location) is the number of steps a unit at location needs to reach the edge
+
+        """
+        field = self._edge_fields.get(target_edge)
+        if field is None:
+            end_points = self.game_map.get_edge_locations(target_edge)
+            field = EdgeDistanceField(end_points, self.game_map.get_blocked_mask())
+            self._edge_fields[target_edge] = field
+        return field
+
+    def get_damage_heatmap(self):
+        """Gets the damage per frame mobile units would take from structures at every location.
+        It is built the first time it is requested and then updated as structures are spawned, removed or upgraded.
+
+        Returns:
+            A DamageHeatmap, use damage_at(location, player_index) or path_damage(path, player_index)
+
+        """
+        if self._damage_heatmap is None:
+            self._damage_heatmap = DamageHeatmap(self.game_map)
+        return self._damage_heatmap
+
+    def get_region_sums(self):
+        """Gets summed-area tables of unit counts, health and upgrades for the current board.
+        They are rebuilt the first time they are requested after units change, for example after a batch of attempt_spawn calls.
+
+        Returns:
+            A RegionSums, use count, health or upgraded with a player index, optional unit type and rectangle
+
+        """
+        if self._region_sums is None or self._region_sums.unit_version != self.game_map.unit_version:
+            self._region_sums = RegionSums(self.game_map)
+        return self._region_sums
+
+    def get_next_hop_table(self, target_edge):
+        """Gets the table of moves every unit pathing to an edge would make. Use it to read the paths
+        of many start locations heading to the same edge at once. It is rebuilt only when structures change.
+
+        Args:
+            target_edge: The edge the units want to reach. game_map.TOP_LEFT, game_map.BOTTOM_RIGHT, etc.
+
+        Returns:
+            A NextHopTable, whose get_path(location) matches find_path_to_edge(location, target_edge)
+
+        """
+        blocked = self.game_map.get_blocked_mask()
+        table = self._next_hop_tables.get(target_edge)
+        if table is None or table.blocked != blocked:
+            end_points = self.game_map.get_edge_locations(target_edge)
+            table = self._shortest_path_finder.build_next_hop_table(end_points, self)
+            self._next_hop_tables[target_edge] = table
+        return table
 
     def __resource_required(self, unit_type):
         return self.SP if is_stationary(unit_type) else self.MP
@@ -174,9 +480,14 @@ class GameState:
     def submit_turn(self):
         """Submit and end your turn.
             Must be called at the end of your turn or the algo will hang.
+            Only the first call sends anything, so the turn budget's watchdog and the algo can both call it.
         """
-        build_string = json.dumps(self._build_stack)
-        deploy_string = json.dumps(self._deploy_stack)
+        with _submit_lock:
+            if self.submitted:
+                return
+            self.submitted = True
+            build_string = json.dumps(self._build_stack)
+            deploy_string = json.dumps(self._deploy_stack)
         send_command(build_string)
         send_command(deploy_string)
 
@@ -333,7 +644,7 @@ class GameState:
         stationary = is_stationary(unit_type)
         blocked = self.contains_stationary_unit(location) or (stationary and len(self.game_map[location[0],location[1]]) > 0)
         correct_territory = location[1] < self.HALF_ARENA
-        on_edge = location in (self.game_map.get_edge_locations(self.game_map.BOTTOM_LEFT) + self.game_map.get_edge_locations(self.game_map.BOTTOM_RIGHT))
+        on_edge = (location[0], location[1]) in geometry.FRIENDLY_EDGE_SET
 
         if self.enable_warnings:
             fail_reason = ""
@@ -370,26 +681,86 @@ class GameState:
         if num < 1 or not locations:
             self.warn("Attempted to spawn fewer than one units! ({})".format(num))
             return
-      
+
         if type(locations[0]) == int:
             locations = [locations]
-        spawned_units = 0
+        return sum(self.spawn_batch(unit_type, locations, num))
+
+    def spawn_batch(self, unit_type, locations, num=1):
+        """Spawns units of one type at every location of a list, validating the whole list in one pass.
+
+        Each location is checked the way can_spawn does, against the precomputed bounds and friendly edges,
+        while the costs are read once and taken from a running ledger of the resources left. As resources
+        only go down, the units placed are always the affordable prefix of the list, and they are added to
+        the map and the build or deploy stack in that order. Warnings are only formatted when enabled.
+
+        Args:
+            unit_type: The type of unit we want to spawn
+            locations: A list of locations to spawn units at
+            num: The number of units of unit_type to deploy at each location
+
+        Returns:
+            A list holding the number of units spawned at each location, in the order of locations
+
+        """
+        if unit_type not in ALL_UNITS:
+            self._invalid_unit(unit_type)
+            return
+        if num < 1:
+            self.warn("Attempted to spawn fewer than one units! ({})".format(num))
+            return
+
+        costs = self.type_cost(unit_type)
+        sp_cost, mp_cost = costs[SP], costs[MP]
+        # number_affordable is 0 for a unit without costs
+        has_cost = sp_cost > 0 or mp_cost > 0
+        stationary = is_stationary(unit_type)
+        stack = self._build_stack if stationary else self._deploy_stack
+        resources = self._player_resources[0]
+        game_map = self.game_map
+        warnings = self.enable_warnings
+        half_arena = self.HALF_ARENA
+        friendly_edges = geometry.FRIENDLY_EDGE_SET
+
+        results = []
         for location in locations:
-            for i in range(num):
-                if self.can_spawn(unit_type, location, 1):
-                    x, y = map(int, location)
-                    costs = self.type_cost(unit_type)
-                    self.__set_resource(SP, 0 - costs[SP])
-                    self.__set_resource(MP, 0 - costs[MP])
-                    self.game_map.add_unit(unit_type, location, 0)
-                    if is_stationary(unit_type):
-                        self._build_stack.append((unit_type, x, y))
-                    else:
-                        self._deploy_stack.append((unit_type, x, y))
-                    spawned_units += 1
+            x, y = location
+            spawned = 0
+            if not geometry.in_bounds(x, y):
+                if warnings:
+                    self.warn("Could not spawn {} at location {}. Location invalid.".format(unit_type, location))
+                results.append(spawned)
+                continue
+            cell_x, cell_y = int(x), int(y)
+            correct_territory = y < half_arena
+            on_edge = stationary or (x, y) in friendly_edges
+            while spawned < num:
+                units = game_map.units_at(cell_x, cell_y)
+                if stationary:
+                    blocked = len(units) > 0
                 else:
+                    blocked = any(unit.stationary for unit in units)
+                affordable = has_cost and resources['SP'] >= sp_cost and resources['MP'] >= mp_cost
+                if not (affordable and correct_territory and on_edge and not blocked):
+                    if warnings:
+                        fail_reason = ""
+                        if not affordable:
+                            fail_reason = fail_reason + " Not enough resources."
+                        if blocked:
+                            fail_reason = fail_reason + " Location is blocked."
+                        if not correct_territory:
+                            fail_reason = fail_reason + " Location in enemy territory."
+                        if not on_edge:
+                            fail_reason = fail_reason + " Information units must be deployed on the edge."
+                        self.warn("Could not spawn {} at location {}.{}".format(unit_type, location, fail_reason))
                     break
-        return spawned_units
+                resources['SP'] = resources['SP'] - sp_cost
+                resources['MP'] = resources['MP'] - mp_cost
+                game_map.add_unit(unit_type, [cell_x, cell_y], 0)
+                stack.append((unit_type, cell_x, cell_y))
+                spawned += 1
+            results.append(spawned)
+        return results
 
     def attempt_remove(self, locations):
         """Attempts to remove existing friendly structures in the given locations.
@@ -430,27 +801,72 @@ class GameState:
 
         if type(locations[0]) == int:
             locations = [locations]
-        spawned_units = 0
+        return sum(self.upgrade_batch(locations))
+
+    def upgrade_batch(self, locations):
+        """Upgrades the structures at every location of a list, validating the whole list in one pass.
+
+        Each location is checked the way attempt_upgrade does, while the upgrade costs of each structure type
+        are read once and taken from a running ledger of the resources left. Structures are only copied for
+        writing, and upgrades added to the build stack, at the locations that are actually upgraded.
+
+        Args:
+            locations: A list of locations to upgrade units at
+
+        Returns:
+            A list holding 1 for every location that was upgraded and 0 for the others, in the order of locations
+
+        """
+        resources = self._player_resources[0]
+        game_map = self.game_map
+        half_arena = self.HALF_ARENA
+        unit_information = self.config["unitInformation"]
+        # unit_type -> [SP, MP] upgrade costs, or None if the type has no upgrade
+        upgrade_costs = {}
+
+        results = []
         for location in locations:
-            if location[1] < self.HALF_ARENA and self.contains_stationary_unit(location):
-                x, y = map(int, location)
-                existing_unit = None
-                for unit in self.game_map[x,y]:
-                    if unit.stationary:
-                        existing_unit = unit
-
-                if not existing_unit.upgraded and self.config["unitInformation"][UNIT_TYPE_TO_INDEX[existing_unit.unit_type]].get("upgrade", None) is not None:
-                    costs = self.type_cost(existing_unit.unit_type, True)
-                    resources = self.get_resources()
-                    if resources[SP] >= costs[SP] and resources[MP] >= costs[MP]:
-                        self.__set_resource(SP, 0 - costs[SP])
-                        self.__set_resource(MP, 0 - costs[MP])
-                        existing_unit.upgrade()
-                        self._build_stack.append((UPGRADE, x, y))
-                        spawned_units += 1
-            else:
+            x, y = location
+            structure = None
+            if y < half_arena:
+                if geometry.in_bounds(x, y):
+                    for unit in game_map.units_at(int(x), int(y)):
+                        if unit.stationary:
+                            structure = unit
+                else:
+                    self.warn('Checked for stationary unit outside of arena bounds')
+            if structure is None:
                 self.warn("Could not upgrade a unit from {}. Location has no structures or is enemy territory.".format(location))
-        return spawned_units
+                results.append(0)
+                continue
+            if structure.upgraded:
+                results.append(0)
+                continue
+
+            unit_type = structure.unit_type
+            if unit_type not in upgrade_costs:
+                if unit_information[UNIT_TYPE_TO_INDEX[unit_type]].get("upgrade", None) is not None:
+                    upgrade_costs[unit_type] = self.type_cost(unit_type, True)
+                else:
+                    upgrade_costs[unit_type] = None
+            costs = upgrade_costs[unit_type]
+            if costs is None or resources['SP'] < costs[SP] or resources['MP'] < costs[MP]:
+                results.append(0)
+                continue
+
+            x, y = int(x), int(y)
+            resources['SP'] = resources['SP'] - costs[SP]
+            resources['MP'] = resources['MP'] - costs[MP]
+            for unit in game_map.mutable_units_at(x, y):
+                if unit.stationary:
+                    structure = unit
+            structure.upgrade()
+            game_map.unit_changed([x, y])
+            if self._damage_heatmap is not None:
+                self._damage_heatmap.refresh([x, y])
+            self._build_stack.append((UPGRADE, x, y))
+            results.append(1)
+        return results
 
     def get_target_edge(self, start_location):
         """Gets the target edge given a starting location
@@ -479,6 +895,12 @@ class GameState:
         """Gets the path a unit at a given location would take. 
         If final point is not on an edge, it is a self destruct path
 
+        Paths are looked up in navigation.path_cache first, which is shared across turns and keyed by the class
+        of the path finder. Otherwise, with a ShortestPathFinder or BitboardPathFinder, paths that reach the edge
+        are read from the edge's distance field, which is repaired incrementally as structures change rather than
+        rebuilt for every call, and self destruct paths use the path finder. Any other path finder, such as a
+        subclass, is used for every path.
+
         Args:
             start_location: The location of a hypothetical unit
             target_edge: The edge the unit wants to reach. game_map.TOP_LEFT, game_map.BOTTOM_RIGHT, etc. Induced from start_location if None.
@@ -495,8 +917,22 @@ class GameState:
         if target_edge is None:
             target_edge = self.get_target_edge(start_location)
 
-        end_points = self.game_map.get_edge_locations(target_edge)
-        return self._shortest_path_finder.navigate_multiple_endpoints(start_location, end_points, self)
+        blocked = self.game_map.get_blocked_mask()
+        finder_type = type(self._shortest_path_finder)
+        path = navigation.path_cache.get(blocked, start_location, target_edge, finder_type)
+        if path is not None:
+            return path
+
+        path = None
+        # The distance field gives the same paths as these two finders, but not necessarily as a custom one
+        if finder_type in (ShortestPathFinder, BitboardPathFinder):
+            path = self.get_edge_distance_field(target_edge).get_path(start_location)
+        if path is None:
+            end_points = self.game_map.get_edge_locations(target_edge)
+            path = self._shortest_path_finder.navigate_multiple_endpoints(start_location, end_points, self)
+        if path is not None:
+            navigation.path_cache.put(blocked, start_location, target_edge, path, finder_type)
+        return path
 
     def contains_stationary_unit(self, location):
         """Check if a location is blocked, return structures unit if it is
@@ -512,7 +948,7 @@ class GameState:
             self.warn('Checked for stationary unit outside of arena bounds')
             return False
         x, y = map(int, location)
-        for unit in self.game_map[x,y]:
+        for unit in self.game_map.units_at(x, y):
             if unit.stationary:
                 return unit
         return False
@@ -564,7 +1000,7 @@ class GameState:
         target_x_distance = 0
 
         for location in possible_locations:
-            for unit in self.game_map[location]:
+            for unit in self.game_map.units_at(location[0], location[1]):
                 if unit.player_index == attacking_unit.player_index or (attacking_unit.damage_f == 0 and is_stationary(unit.unit_type)) or (attacking_unit.damage_i == 0 and not(is_stationary(unit.unit_type))):
                     continue
 
@@ -639,9 +1075,20 @@ class GameState:
         for unit in self.config["unitInformation"]:
             if unit.get('attackRange', 0) >= max_range:
                 max_range = unit.get('attackRange', 0)
-        possible_locations= self.game_map.get_locations_in_range(location, max_range)
-        for location_unit in possible_locations:
-            for unit in self.game_map[location_unit]:
-                if unit.damage_i + unit.damage_f > 0 and unit.player_index != player_index and self.game_map.distance_between_locations(location, location_unit) <= unit.attackRange:
+        x, y = location
+        if type(x) != int or type(y) != int or not bitboard.in_bounds(x, y):
+            possible_locations= self.game_map.get_locations_in_range(location, max_range)
+            for location_unit in possible_locations:
+                for unit in self.game_map[location_unit]:
+                    if unit.damage_i + unit.damage_f > 0 and unit.player_index != player_index and self.game_map.distance_between_locations(location, location_unit) <= unit.attackRange:
+                        attackers.append(unit)
+            return attackers
+
+        # Distances are symmetric, so a unit attacks location exactly when its location is in the attack mask around location
+        coverage = self.game_map.get_coverage_table()
+        for location_unit in coverage.in_range_locations(location, max_range):
+            bit = bitboard.bit_index(location_unit[0], location_unit[1])
+            for unit in self.game_map.units_at(location_unit[0], location_unit[1]):
+                if unit.damage_i + unit.damage_f > 0 and unit.player_index != player_index and (coverage.attack_mask(location, unit.attackRange) >> bit) & 1:
                     attackers.append(unit)
         return attackers
@@ -0,0 +1,109 @@
+"""
+Fixed geometry of the diamond shaped game board, computed once at import.
+
+Every location of the 28 x 28 grid has a cell id, y * ROW_STRIDE + x, which is
+also its bit index in gamelib.bitboard. The row stride is one larger than the
+arena so the padding column between two rows is never in bounds. Tables indexed
+by cell id have CELL_COUNT entries, one spare row more than the board, so that
+stepping up from the top row of the board stays inside the table.
+"""
+
+ARENA_SIZE = 28
+HALF_ARENA = ARENA_SIZE // 2
+ROW_STRIDE = ARENA_SIZE + 1
+CELL_COUNT = (ARENA_SIZE + 1) * ROW_STRIDE
+
+TOP_RIGHT = 0
+TOP_LEFT = 1
+BOTTOM_LEFT = 2
+BOTTOM_RIGHT = 3
+
+
+def row_bounds(y):
+    """The first and last x coordinate of row y of the diamond
+
+    """
+    if y < HALF_ARENA:
+        return HALF_ARENA - 1 - y, HALF_ARENA + y
+    return y - HALF_ARENA, ARENA_SIZE + HALF_ARENA - 1 - y
+
+
+def cell_id(x, y):
+    """The cell id of [x, y]
+
+    """
+    return y * ROW_STRIDE + x
+
+
+def location_of(cell):
+    """The [x, y] location of a cell id
+
+    """
+    return [cell % ROW_STRIDE, cell // ROW_STRIDE]
+
+
+def _build_in_bounds():
+    table = [False] * CELL_COUNT
+    for y in range(ARENA_SIZE):
+        start_x, end_x = row_bounds(y)
+        for x in range(start_x, end_x + 1):
+            table[cell_id(x, y)] = True
+    return tuple(table)
+
+
+IN_BOUNDS = _build_in_bounds()
+
+# Row by row from the bottom of the board, left to right. This is the order GameMap iterates in.
+VALID_CELLS = tuple(cell for cell in range(CELL_COUNT) if IN_BOUNDS[cell])
+VALID_LOCATIONS = tuple((cell % ROW_STRIDE, cell // ROW_STRIDE) for cell in VALID_CELLS)
+
+# COORDINATES[cell] is the (x, y) tuple of a cell id
+COORDINATES = tuple((cell % ROW_STRIDE, cell // ROW_STRIDE) for cell in range(CELL_COUNT))
+
+
+def in_bounds(x, y):
+    """True if [x, y] is on the board. Non integer coordinates are checked against the diamond arithmetically.
+
+    """
+    if type(x) is int and type(y) is int:
+        return 0 <= x < ARENA_SIZE and 0 <= y < ARENA_SIZE and IN_BOUNDS[y * ROW_STRIDE + x]
+    if y < HALF_ARENA:
+        row_size = y + 1
+    else:
+        row_size = ARENA_SIZE - y
+    start_x = HALF_ARENA - row_size
+    return 0 <= y < ARENA_SIZE and start_x <= x <= start_x + 2 * row_size - 1
+
+
+def _build_edges():
+    edges = ([], [], [], [])
+    for num in range(HALF_ARENA):
+        edges[TOP_RIGHT].append((HALF_ARENA + num, ARENA_SIZE - 1 - num))
+        edges[TOP_LEFT].append((HALF_ARENA - 1 - num, ARENA_SIZE - 1 - num))
+        edges[BOTTOM_LEFT].append((HALF_ARENA - 1 - num, num))
+        edges[BOTTOM_RIGHT].append((HALF_ARENA + num, num))
+    return tuple(tuple(edge) for edge in edges)
+
+
+# EDGES[edge] lists the (x, y) locations of an edge in the order of GameMap.get_edge_locations
+EDGES = _build_edges()
+EDGE_SETS = tuple(frozenset(edge) for edge in EDGES)
+# Where player 0 can spawn mobile units
+FRIENDLY_EDGE_SET = EDGE_SETS[BOTTOM_LEFT] | EDGE_SETS[BOTTOM_RIGHT]
+# Where player 1 can spawn mobile units
+ENEMY_EDGE_SET = EDGE_SETS[TOP_LEFT] | EDGE_SETS[TOP_RIGHT]
+
+
+def _build_neighbors():
+    neighbors = []
+    for cell in range(CELL_COUNT):
+        if not IN_BOUNDS[cell]:
+            neighbors.append(())
+            continue
+        candidates = (cell + ROW_STRIDE, cell - ROW_STRIDE, cell + 1, cell - 1)
+        neighbors.append(tuple(n for n in candidates if 0 <= n < CELL_COUNT and IN_BOUNDS[n]))
+    return tuple(neighbors)
+
+
+# NEIGHBORS[cell] holds the in bounds cells orthogonally adjacent to a cell, in the order up, down, right, left
+NEIGHBORS = _build_neighbors()
@@ -0,0 +1,213 @@
+"""
+Declarative base layouts.
+
+A Layout lists the structures a base should have, most important first, instead
+of spelling them out as a sequence of attempt_spawn and attempt_upgrade calls.
+Compiled once against the config, it compares itself to a board through the
+unit index of GameMap: entries that are already built are ruled out a whole
+unit type at a time, so a turn only visits the entries that are missing or not
+yet upgraded, and plans as many of them as the resources allow.
+"""
+from . import geometry
+from .unit import get_unit_descriptors
+from .util import debug_write
+
+
+class Layout:
+    """A prioritized list of structures to build and upgrade.
+
+    Entries are added in priority order. An entry is a unit type, a location and whether the structure
+    should be upgraded. An upgrade entry spawns its structure first if it is missing, and like attempt_upgrade
+    it upgrades whichever of our structures stands at its location. When an entry cannot be afforded or its
+    location is taken by another unit, it is skipped and the next entries are still tried, as a sequence of
+    attempt_spawn and attempt_upgrade calls would.
+
+    Attributes :
+        * entries (list): The (unit_type, x, y, upgrade) entries, in priority order
+        * compiled (bool): Whether compile was called since the last entry was added
+
+    """
+    def __init__(self, entries=()):
+        """
+        Args:
+            entries: (unit_type, location) or (unit_type, location, upgrade) tuples, most important first
+
+        """
+        self.entries = []
+        self.compiled = False
+        for entry in entries:
+            self.add(*entry)
+
+    def add(self, unit_type, locations, upgrade=False):
+        """Adds entries after the ones already in the layout
+
+        Args:
+            unit_type: The structure type, WALL, TURRET, etc.
+            locations: A single location or list of locations
+            upgrade: Whether the structures should also be upgraded
+
+        """
+        if locations and type(locations[0]) == int:
+            locations = [locations]
+        for x, y in locations:
+            self.entries.append((unit_type, x, y, upgrade))
+        self.compiled = False
+
+    def compile(self, config):
+        """Prepares the layout for plan and apply. Call it once, for example in on_game_start, after adding the entries.
+
+        Entries that are not structures, or not in bounds on our half of the board, are dropped with a warning.
+
+        Args:
+            config: The game config
+
+        """
+        descriptors = get_unit_descriptors(config)
+        unit_information = config["unitInformation"]
+        self._upgrade_type = unit_information[7]["shorthand"]
+        # unit_type -> (mask, {cell: priority}) of the structures to spawn and to upgrade
+        self._spawns = {}
+        self._upgrades = {}
+        # unit_type -> ((SP, MP) cost, (SP, MP) upgrade cost or None) of every structure type
+        self._costs = {}
+        for unit_def in unit_information:
+            unit_type = unit_def.get("shorthand")
+            if unit_type in descriptors and descriptors[unit_type].stationary:
+                cost = (unit_def.get("cost1", 0), unit_def.get("cost2", 0))
+                upgrade_def = unit_def.get("upgrade")
+                upgrade_cost = None
+                if upgrade_def is not None:
+                    upgrade_cost = (upgrade_def.get("cost1", cost[0]), upgrade_def.get("cost2", cost[1]))
+                self._costs[unit_type] = (cost, upgrade_cost)
+        for priority, (unit_type, x, y, upgrade) in enumerate(self.entries):
+            descriptor = descriptors.get(unit_type)
+            if descriptor is None or not descriptor.stationary:
+                debug_write("Layout entry {} at {} is not a structure, skipping it".format(unit_type, [x, y]))
+                continue
+            if not geometry.in_bounds(x, y) or y >= geometry.HALF_ARENA:
+                debug_write("Layout entry {} at {} is not on our half of the board, skipping it".format(unit_type, [x, y]))
+                continue
+            cell = geometry.cell_id(x, y)
+            self.__add_compiled(self._spawns, unit_type, cell, priority)
+            if upgrade:
+                self.__add_compiled(self._upgrades, unit_type, cell, priority)
+        self.compiled = True
+
+    @staticmethod
+    def __add_compiled(compiled, unit_type, cell, priority):
+        mask, priorities = compiled.setdefault(unit_type, (0, {}))
+        if cell not in priorities:
+            priorities[cell] = priority
+        compiled[unit_type] = (mask | 1 << cell, priorities)
+
+    def missing(self, game_state):
+        """Lists the entries the board does not satisfy, without looking at resources
+
+        Args:
+            game_state: The GameState to compare the layout to
+
+        Returns:
+            A sorted list of (priority, is_upgrade, unit_type, cell) tuples. A missing structure with an upgrade
+            entry is listed twice, once to spawn and once to upgrade it. The unit_type of an upgrade is the type
+            of the structure that stands at its location, if any
+
+        """
+        if not self.compiled:
+            self.compile(game_state.config)
+        game_map = game_state.game_map
+        own_structures = game_map.get_blocked_mask() & game_map.get_unit_mask(0)
+        missing = []
+        for unit_type, (mask, priorities) in self._spawns.items():
+            unbuilt = mask & ~game_map.get_unit_mask(0, unit_type)
+            while unbuilt:
+                low_bit = unbuilt & -unbuilt
+                cell = low_bit.bit_length() - 1
+                missing.append((priorities[cell], False, unit_type, cell))
+                unbuilt ^= low_bit
+        for unit_type, (mask, priorities) in self._upgrades.items():
+            remaining = mask
+            while remaining:
+                low_bit = remaining & -remaining
+                cell = low_bit.bit_length() - 1
+                remaining ^= low_bit
+                built_type = unit_type
+                if own_structures & low_bit:
+                    x, y = geometry.COORDINATES[cell]
+                    structure = next(unit for unit in game_map.units_at(x, y) if unit.stationary)
+                    if structure.upgraded:
+                        continue
+                    built_type = structure.unit_type
+                missing.append((priorities[cell], True, built_type, cell))
+        missing.sort()
+        return missing
+
+    def plan(self, game_state):
+        """Plans the missing entries that can be afforded with the resources of game_state, most important first
+
+        Args:
+            game_state: The GameState to compare the layout to
+
+        Returns:
+            A list of (action, x, y) tuples like the build stack of a GameState, where action is a unit type
+            or UPGRADE. Nothing is queued on game_state
+
+        """
+        missing = self.missing(game_state)
+        if not missing:
+            return []
+        game_map = game_state.game_map
+        resources = game_state.get_resources()
+        # a structure cannot be spawned where any unit stands, not only another structure
+        taken = game_map.get_unit_mask(0) | game_map.get_unit_mask(1)
+        upgradable = game_map.get_blocked_mask() & game_map.get_unit_mask(0)
+        actions = []
+        for priority, upgrade, unit_type, cell in missing:
+            bit = 1 << cell
+            cost, upgrade_cost = self._costs[unit_type]
+            if upgrade:
+                if not upgradable & bit:
+                    continue
+                cost = upgrade_cost
+                if cost is None:
+                    continue
+            elif taken & bit:
+                continue
+            if resources[0] < cost[0] or resources[1] < cost[1]:
+                continue
+            resources[0] -= cost[0]
+            resources[1] -= cost[1]
+            x, y = geometry.COORDINATES[cell]
+            if upgrade:
+                actions.append((self._upgrade_type, x, y))
+            else:
+                taken |= bit
+                upgradable |= bit
+                actions.append((unit_type, x, y))
+        return actions
+
+    def apply(self, game_state):
+        """Queues the entries plan returns on game_state, with one spawn_batch or upgrade_batch call per run
+        of consecutive actions of the same kind
+
+        Args:
+            game_state: The GameState to build on
+
+        Returns:
+            The number of structures spawned or upgraded
+
+        """
+        actions = self.plan(game_state)
+        done = 0
+        start = 0
+        while start < len(actions):
+            action = actions[start][0]
+            end = start + 1
+            while end < len(actions) and actions[end][0] == action:
+                end += 1
+            locations = [[x, y] for _, x, y in actions[start:end]]
+            if action == self._upgrade_type:
+                done += sum(game_state.upgrade_batch(locations))
+            else:
+                done += sum(game_state.spawn_batch(action, locations))
+            start = end
+        return done
@@ -1,7 +1,10 @@
+import collections
 import heapq
 import math
 import sys
 import queue
+import threading
+from . import bitboard, geometry
 from .util import debug_write
 
 class Node:
@@ -20,6 +23,96 @@ class Node:
         self.blocked = False
         self.pathlength = -1
 
+class PathCache:
+    """A bounded least recently used cache of paths, shared by every GameState of a game.
+
+    Paths are keyed by the exact set of blocked locations (as a bitboard mask), the start location,
+    the target edge and the class of the path finder that found them, so a cached path is only returned
+    for a board where it is still correct, and never to a GameState using a different path finder.
+    When the cache is full, the entry that has gone unused the longest is evicted.
+    It can be shared with speculative tasks running on another thread.
+
+    Attributes :
+        * capacity (int): The maximum number of paths kept. 0 disables caching
+        * hits (int): The number of lookups answered from the cache
+        * misses (int): The number of lookups that were not in the cache
+        * evictions (int): The number of paths dropped to stay within capacity
+
+    """
+    def __init__(self, capacity=2048):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, blocked, start_location, target_edge, finder_type=None):
+        """Looks up a path
+
+        Args:
+            * blocked: A bitboard mask of the locations holding structures
+            * start_location: The location of the unit
+            * target_edge: The edge the unit is pathing to
+            * finder_type: The class of the path finder the path is wanted from
+
+        Returns:
+            A copy of the cached path, or None if it is not cached
+
+        """
+        key = (blocked, start_location[0], start_location[1], target_edge, finder_type)
+        with self._lock:
+            path = self._entries.get(key)
+            if path is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+        return [list(location) for location in path]
+
+    def put(self, blocked, start_location, target_edge, path, finder_type=None):
+        """Stores a path, evicting the least recently used paths if the cache is full
+
+        """
+        if self.capacity <= 0:
+            return
+        key = (blocked, start_location[0], start_location[1], target_edge, finder_type)
+        stored = tuple(tuple(location) for location in path)
+        with self._lock:
+            self._entries[key] = stored
+            self._entries.move_to_end(key)
+            self.resize(self.capacity)
+
+    def resize(self, capacity):
+        """Changes the capacity, evicting the least recently used paths that no longer fit
+
+        """
+        with self._lock:
+            self.capacity = capacity
+            while len(self._entries) > max(capacity, 0):
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drops every cached path and resets the counters
+
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+
+"""
+The path cache used by GameState.find_path_to_edge. It lives at module level so it survives
+from one turn's GameState to the next.
+"""
+path_cache = PathCache()
+
 """
 This class helps with pathfinding. We guarantee the results will
 be accurate, but top players may want to write their own pathfinding
@@ -289,6 +382,22 @@ class ShortestPathFinder:
             return False
         return True
 
+    def build_next_hop_table(self, end_points, game_state):
+        """Builds the move every unit would make from every location when pathing to end_points
+
+        The table gives the same paths as navigate_multiple_endpoints for every start location at once, so the
+        paths of many units heading to the same edge cost one search instead of one search each.
+
+        Args:
+            * end_points: The end points of the units, should be a list of edge locations
+            * game_state: The current game state
+
+        Returns:
+            A NextHopTable for the current structures
+
+        """
+        return NextHopTable(end_points, game_state.game_map.get_blocked_mask())
+
     def print_map(self):
         """Prints an ASCII version of the current game map for debug purposes
 
@@ -314,3 +423,478 @@ class ShortestPathFinder:
             sys.stderr.write(" ")
         sys.stderr.write(str(number))
         sys.stderr.write(" ")
+
+
+class BitboardPathFinder(ShortestPathFinder):
+    """A drop-in replacement for ShortestPathFinder that stores the board as integer bitmasks.
+
+    The idealness and validation searches are run as flood fills over whole masks at once
+    instead of node by node, and no per-call grid of Nodes is allocated. The paths returned
+    are identical to those of ShortestPathFinder, including its tie-breaking between equally short moves.
+
+    """
+    def __init__(self):
+        super().__init__()
+        self._layers = None
+
+    def navigate_multiple_endpoints(self, start_point, end_points, game_state):
+        """Finds the path a unit would take to reach a set of endpoints
+
+        Args:
+            * start_point: The starting location of the unit
+            * end_points: The end points of the unit, should be a list of edge locations
+            * game_state: The current game state
+
+        Returns:
+            The path a unit at start_point would take when trying to reach end_points given the current game state.
+
+        """
+        if game_state.contains_stationary_unit(start_point):
+            return
+        if not game_state.game_map.in_arena_bounds(start_point):
+            return super().navigate_multiple_endpoints(start_point, end_points, game_state)
+
+        self.game_state = game_state
+        game_map = game_state.game_map
+        return self.navigate_blocked_mask(start_point, end_points, game_map.get_blocked_mask(), game_map.get_pocket_labels().pocket_mask(start_point))
+
+    def navigate_blocked_mask(self, start_point, end_points, blocked, pocket=None):
+        """Finds the path a unit would take to reach a set of endpoints on a board given as a mask of blocked locations
+
+        Args:
+            * start_point: The starting location of the unit, which must be in bounds and unblocked
+            * end_points: The end points of the unit, should be a list of edge locations
+            * blocked: A bitboard mask of the locations holding structures
+            * pocket: The mask of the open space around start_point if it is already known
+
+        Returns:
+            The path a unit at start_point would take when trying to reach end_points
+
+        """
+        open_mask = bitboard.BOARD_MASK & ~blocked
+        start_bit = 1 << bitboard.bit_index(start_point[0], start_point[1])
+        targets = bitboard.from_locations(end_points)
+
+        if pocket is None:
+            pocket = bitboard.flood_fill(start_bit, open_mask)
+        if pocket & targets:
+            seeds = targets
+        else:
+            seeds = self._most_ideal_bit(pocket, self._get_direction_from_endpoints(end_points))
+
+        layers = bitboard.bfs_layers(seeds, open_mask, start_bit)
+        self._layers = layers
+        return self._descend(start_point, len(layers) - 1, lambda index, distance: (layers[distance] >> index) & 1, end_points)
+
+    def navigate_boards(self, start_point, end_points, boards):
+        """Finds the path a unit would take on each of many boards, searching all of the boards at once
+
+        The boards are packed side by side into one bitmask so each step of the idealness and validation
+        flood fills advances the search on every board in a single operation. This makes evaluating
+        hundreds of hypothetical structure layouts far cheaper than pathing on each board in turn.
+
+        Args:
+            * start_point: The starting location of the unit, the same on every board
+            * end_points: The end points of the unit, should be a list of edge locations
+            * boards: A list of blocked location masks, one per board. Each board is either a bitboard mask
+              or a 28 x 28 grid indexed board[x][y] that is truthy where a structure stands
+
+        Returns:
+            A list holding, for each board, the path navigate_multiple_endpoints would return on it,
+            or None where start_point is blocked
+
+        """
+        count = len(boards)
+        if count == 0:
+            return []
+        blocked = [board if isinstance(board, int) else bitboard.mask_from_grid(board) for board in boards]
+        if not bitboard.in_bounds(start_point[0], start_point[1]):
+            debug_write("Attempted to navigate boards from out of bounds location {}".format(start_point))
+            return [None] * count
+
+        start_index = bitboard.bit_index(start_point[0], start_point[1])
+        start_bit = 1 << start_index
+        open_all = bitboard.pack_lanes([bitboard.BOARD_MASK & ~mask for mask in blocked])
+        starts = bitboard.pack_lanes([0 if mask & start_bit else start_bit for mask in blocked])
+
+        # Idealness, every pocket flooded together then each board's target chosen from its own pocket
+        targets = bitboard.from_locations(end_points)
+        direction = self._get_direction_from_endpoints(end_points)
+        seeds = []
+        for pocket in bitboard.unpack_lanes(bitboard.flood_fill(starts, open_all), count):
+            if not pocket:
+                seeds.append(0)
+            elif pocket & targets:
+                seeds.append(targets)
+            else:
+                seeds.append(self._most_ideal_bit(pocket, direction))
+
+        # Validation, searching every board until each board's start has been reached
+        frontier = bitboard.pack_lanes(seeds) & open_all
+        visited = frontier
+        unreached = starts
+        layers = []
+        while frontier and unreached:
+            layers.append(bitboard.lane_bytes(frontier, count))
+            unreached &= ~frontier
+            frontier = bitboard.expand(frontier) & open_all & ~visited
+            visited |= frontier
+
+        paths = []
+        for lane, mask in enumerate(blocked):
+            if mask & start_bit:
+                paths.append(None)
+                continue
+            offset = lane * bitboard.LANE_BITS
+
+            def at_distance(index, distance):
+                index += offset
+                return (layers[distance][index >> 3] >> (index & 7)) & 1
+
+            distance = next(d for d in range(len(layers)) if at_distance(start_index, d))
+            paths.append(self._descend(start_point, distance, at_distance, end_points))
+        return paths
+
+    def _most_ideal_bit(self, pocket, direction):
+        """The bit of the most ideal self destruct location in a pocket which does not touch the target edge
+
+        """
+        return bitboard.most_ideal_bit(pocket, direction)
+
+    def _get_direction_from_endpoints(self, end_points):
+        """A direction [x,y] representing the edge. For example, [1,1] for the top right and [-1, 1] for the top left
+
+        """
+        x, y = end_points[0]
+        return [1 if x >= geometry.HALF_ARENA else -1, 1 if y >= geometry.HALF_ARENA else -1]
+
+    def _descend(self, start_point, distance, at_distance, end_points):
+        """Walks from start_point down a distance field, choosing between equally short moves like _choose_next_move
+
+        Args:
+            * start_point: The location to walk from
+            * distance: The pathlength of start_point
+            * at_distance: A function taking a bit index and a pathlength, True if that location has that pathlength
+            * end_points: The end points of the unit
+
+        """
+        path = [start_point]
+        current = start_point
+        move_direction = 0
+
+        while distance > 0:
+            next_move = None
+            for neighbor in self._get_neighbors(current):
+                index = bitboard.bit_index(neighbor[0], neighbor[1])
+                if index < 0 or not at_distance(index, distance - 1):
+                    continue
+                if next_move is None or self._better_direction(current, neighbor, next_move, move_direction, end_points):
+                    next_move = neighbor
+
+            if current[0] == next_move[0]:
+                move_direction = self.VERTICAL
+            else:
+                move_direction = self.HORIZONTAL
+            path.append(next_move)
+            current = next_move
+            distance -= 1
+
+        return path
+
+    def print_map(self):
+        """Prints an ASCII version of the last searched distance field for debug purposes
+
+        """
+        if self._layers is None:
+            debug_write("Attempted to print_map before any path was found. Use 'this_object.navigate_multiple_endpoints(...)' first")
+            return
+
+        for y in range(28):
+            for x in range(28):
+                index = bitboard.bit_index(x, 28 - y - 1)
+                distance = next((i for i, layer in enumerate(self._layers) if (layer >> index) & 1), None)
+                if distance is not None:
+                    self._print_justified(distance)
+                else:
+                    sys.stderr.write("   ")
+            debug_write("")
+
+
+class EdgeDistanceField:
+    """The pathlength from every location to a set of endpoints, repaired in place as structures are added or removed.
+
+    This is the same field ShortestPathFinder builds in its validation step when a unit can reach its target edge,
+    but instead of being rebuilt for every query, blocking or unblocking a location only revisits the locations
+    whose pathlength actually changes.
+
+    Attributes :
+        * end_points (list): The locations the field measures distance to, usually an edge
+        * blocked (int): A bitboard mask of the locations holding structures
+
+    """
+    def __init__(self, end_points, blocked):
+        """Builds the field with a full breadth first search
+
+        Args:
+            * end_points: The end points of the field, should be a list of edge locations
+            * blocked: A bitboard mask of the locations holding structures
+
+        """
+        self.end_points = end_points
+        self.blocked = blocked
+        self._targets = bitboard.from_locations(end_points)
+        # One spare row so that stepping off the top of the board stays inside the list
+        self._pathlength = [-1] * ((bitboard.ARENA_SIZE + 1) * bitboard.ROW_STRIDE)
+        self._path_finder = BitboardPathFinder()
+
+        open_mask = bitboard.BOARD_MASK & ~blocked
+        for distance, layer in enumerate(bitboard.bfs_layers(self._targets, open_mask)):
+            while layer:
+                low_bit = layer & -layer
+                self._pathlength[low_bit.bit_length() - 1] = distance
+                layer ^= low_bit
+
+    def copy(self):
+        """A field with the same pathlengths that can be repaired independently of this one
+
+        """
+        field = EdgeDistanceField.__new__(EdgeDistanceField)
+        field.__dict__.update(self.__dict__)
+        field._pathlength = list(self._pathlength)
+        return field
+
+    def pathlength(self, location):
+        """The number of steps from location to the nearest end point, or -1 if it is blocked or cannot reach one
+
+        """
+        x, y = location
+        if not bitboard.in_bounds(x, y):
+            return -1
+        return self._pathlength[bitboard.bit_index(x, y)]
+
+    def get_path(self, start_point):
+        """The path a unit at start_point would take to the end points, or None if it cannot reach them
+
+        """
+        distance = self.pathlength(start_point)
+        if distance < 0:
+            return None
+        pathlength = self._pathlength
+        return self._path_finder._descend(start_point, distance, lambda index, d: pathlength[index] == d, self.end_points)
+
+    def _open_neighbors(self, index):
+        blocked = self.blocked
+        for neighbor in geometry.NEIGHBORS[index]:
+            if not (blocked >> neighbor) & 1:
+                yield neighbor
+
+    def block(self, location):
+        """Updates the field for a structure placed at location
+
+        """
+        x, y = location
+        if not bitboard.in_bounds(x, y):
+            return
+        index = bitboard.bit_index(x, y)
+        if (self.blocked >> index) & 1:
+            return
+        self.blocked |= 1 << index
+
+        pathlength = self._pathlength
+        old_distance = pathlength[index]
+        pathlength[index] = -1
+        if old_distance < 0:
+            return
+
+        # Find every location that lost all of its shortest routes. Candidates are visited in order of
+        # increasing pathlength, so whether a closer neighbor still holds its pathlength is already known.
+        affected = set()
+        candidates = collections.deque(n for n in self._open_neighbors(index) if pathlength[n] == old_distance + 1)
+        seen = set(candidates)
+        while candidates:
+            current = candidates.popleft()
+            distance = pathlength[current]
+            if any(pathlength[n] == distance - 1 and n not in affected for n in self._open_neighbors(current)):
+                continue
+            affected.add(current)
+            for neighbor in self._open_neighbors(current):
+                if pathlength[neighbor] == distance + 1 and neighbor not in seen:
+                    seen.add(neighbor)
+                    candidates.append(neighbor)
+
+        # Recompute the affected region outwards from the unaffected locations bordering it
+        frontier = []
+        for current in affected:
+            pathlength[current] = -1
+        for current in affected:
+            for neighbor in self._open_neighbors(current):
+                if neighbor not in affected and pathlength[neighbor] >= 0:
+                    heapq.heappush(frontier, (pathlength[neighbor], neighbor))
+        while frontier:
+            distance, current = heapq.heappop(frontier)
+            if distance > pathlength[current] >= 0:
+                continue
+            for neighbor in self._open_neighbors(current):
+                if neighbor in affected and (pathlength[neighbor] < 0 or pathlength[neighbor] > distance + 1):
+                    pathlength[neighbor] = distance + 1
+                    heapq.heappush(frontier, (distance + 1, neighbor))
+
+    def unblock(self, location):
+        """Updates the field for a structure removed from location
+
+        """
+        x, y = location
+        if not bitboard.in_bounds(x, y):
+            return
+        index = bitboard.bit_index(x, y)
+        if not (self.blocked >> index) & 1:
+            return
+        self.blocked &= ~(1 << index)
+
+        pathlength = self._pathlength
+        if (self._targets >> index) & 1:
+            pathlength[index] = 0
+        else:
+            reachable = [pathlength[n] for n in self._open_neighbors(index) if pathlength[n] >= 0]
+            if not reachable:
+                return
+            pathlength[index] = min(reachable) + 1
+
+        # Shorter routes through the new opening spread outwards in breadth first order
+        improved = collections.deque([index])
+        while improved:
+            current = improved.popleft()
+            distance = pathlength[current] + 1
+            for neighbor in self._open_neighbors(current):
+                if pathlength[neighbor] < 0 or pathlength[neighbor] > distance:
+                    pathlength[neighbor] = distance
+                    improved.append(neighbor)
+
+
+class NextHopTable:
+    """The next step a unit takes from every (location, previous move direction) state when pathing to a set of endpoints.
+
+    Built from one distance field covering the whole board. Locations that can reach the end points share the
+    field measured from the end points. Every other pocket of open space gets a field measured from its own
+    most ideal self destruct location, exactly as navigate_multiple_endpoints would compute for a unit inside it.
+    Paths are read out by following the table, and the tail of every path read so far is stored once and shared
+    with any later path that joins it.
+
+    Attributes :
+        * end_points (list): The locations the units are pathing to
+        * blocked (int): The bitboard mask of blocked locations the table was built for
+
+    """
+    def __init__(self, end_points, blocked):
+        self.end_points = end_points
+        self.blocked = blocked
+        self._path_finder = BitboardPathFinder()
+        # One spare row so that stepping off the top of the board stays inside the lists
+        size = (bitboard.ARENA_SIZE + 1) * bitboard.ROW_STRIDE
+        self._pathlength = [-1] * size
+        self._next_hop = {}
+        self._suffixes = {}
+        self._build_field()
+
+    def _build_field(self):
+        open_mask = bitboard.BOARD_MASK & ~self.blocked
+        direction = self._path_finder._get_direction_from_endpoints(self.end_points)
+        targets = bitboard.from_locations(self.end_points)
+
+        remaining = open_mask
+        seeds = targets
+        while remaining:
+            layers = bitboard.bfs_layers(seeds, remaining)
+            for distance, layer in enumerate(layers):
+                remaining &= ~layer
+                while layer:
+                    low_bit = layer & -layer
+                    self._pathlength[low_bit.bit_length() - 1] = distance
+                    layer ^= low_bit
+            if remaining:
+                pocket = bitboard.flood_fill(remaining & -remaining, remaining)
+                seeds = self._path_finder._most_ideal_bit(pocket, direction)
+
+    def pathlength(self, location):
+        """The number of steps a unit at location takes to finish its path, or -1 if location is blocked
+
+        """
+        x, y = location
+        if not bitboard.in_bounds(x, y):
+            return -1
+        return self._pathlength[bitboard.bit_index(x, y)]
+
+    def next_hop(self, location, previous_move_direction=0):
+        """The location a unit moves to next
+
+        Args:
+            * location: The current location of the unit
+            * previous_move_direction: The direction of the unit's last move, 0 if it has not moved yet,
+              otherwise ShortestPathFinder.HORIZONTAL or ShortestPathFinder.VERTICAL
+
+        Returns:
+            The next location, or None if the unit has finished its path or location is blocked
+
+        """
+        state = (location[0], location[1], previous_move_direction)
+        if state not in self._next_hop:
+            self._next_hop[state] = self._choose_next_hop(location, previous_move_direction)
+        return self._next_hop[state]
+
+    def _choose_next_hop(self, location, previous_move_direction):
+        distance = self.pathlength(location)
+        if distance <= 0:
+            return None
+        pathlength = self._pathlength
+        next_move = None
+        for neighbor in self._path_finder._get_neighbors(location):
+            index = bitboard.bit_index(neighbor[0], neighbor[1])
+            if index < 0 or pathlength[index] != distance - 1:
+                continue
+            if next_move is None or self._path_finder._better_direction(location, neighbor, next_move, previous_move_direction, self.end_points):
+                next_move = neighbor
+        return (next_move[0], next_move[1])
+
+    def _suffix(self, location, previous_move_direction):
+        """The path from a state as a chain of (location, rest of path) pairs shared between paths"""
+        state = (location[0], location[1], previous_move_direction)
+        chain = []
+        while state not in self._suffixes:
+            chain.append(state)
+            hop = self.next_hop(state[:2], state[2])
+            if hop is None:
+                self._suffixes[state] = ((state[0], state[1]), None)
+                chain.pop()
+                break
+            move_direction = self._path_finder.VERTICAL if hop[0] == state[0] else self._path_finder.HORIZONTAL
+            state = (hop[0], hop[1], move_direction)
+        suffix = self._suffixes[state]
+        for state in reversed(chain):
+            suffix = ((state[0], state[1]), suffix)
+            self._suffixes[state] = suffix
+        return suffix
+
+    def get_path(self, start_point):
+        """The path a unit at start_point would take, the same as navigate_multiple_endpoints would return
+
+        Returns:
+            A list of locations, or None if start_point is blocked or out of bounds
+
+        """
+        if self.pathlength(start_point) < 0:
+            return None
+        path = []
+        suffix = self._suffix(start_point, 0)
+        while suffix is not None:
+            location, suffix = suffix
+            path.append(list(location))
+        return path
+
+    def get_paths(self, start_points):
+        """The paths units at each of start_points would take
+
+        Returns:
+            A list with the path from each start point, None for blocked start points
+
+        """
+        return [self.get_path(start_point) for start_point in start_points]
@@ -0,0 +1,133 @@
+"""
+Background reading of the messages sent by the game engine.
+
+A MessageReader drains stdin on its own thread into a queue, so a slow
+on_action_frame never backs up the engine's pipe. Action frames are the only
+messages that may be merged: once max_frames frames are waiting, each new frame
+is coalesced into the newest waiting one. Turn, config and end messages are
+always delivered, in the order they were received.
+"""
+import sys
+import threading
+import collections
+
+from .util import GameMessage, message_type, debug_write, ACTION_FRAME_MESSAGE
+
+
+def read_field(data, path):
+    """Reads a dotted field path such as "events.breach" from decoded JSON, None if it is missing
+
+    """
+    for key in path.split("."):
+        if not isinstance(data, dict) or key not in data:
+            return None
+        data = data[key]
+    return data
+
+
+def _with_field(data, keys, value):
+    # A copy of data with the field at keys set to value, copying every dict along the way
+    copy = dict(data) if isinstance(data, dict) else {}
+    copy[keys[0]] = value if len(keys) == 1 else _with_field(copy.get(keys[0]), keys[1:], value)
+    return copy
+
+
+def coalesce_frames(older, newer, frame_fields=None):
+    """Merges two action frames into one message holding the newest frame.
+
+    Args:
+        older: The GameMessage of the earlier frame, possibly already coalesced
+        newer: The GameMessage of the later frame
+        frame_fields: Dotted field paths, such as "events.breach", whose lists are concatenated
+            across merged frames. Other fields take the value of the newer frame.
+
+    Returns:
+        A GameMessage whose raw string is the newer frame, whose data is the merged frame and whose
+        skipped_frames attribute counts the frames merged into it
+
+    """
+    merged = GameMessage(newer)
+    if frame_fields:
+        data = newer.data
+        for path in frame_fields:
+            earlier = read_field(older.data, path)
+            later = read_field(newer.data, path)
+            if isinstance(earlier, list) and isinstance(later, list):
+                data = _with_field(data, path.split("."), earlier + later)
+        merged.__dict__["_data"] = data
+    merged.skipped_frames = getattr(older, "skipped_frames", 0) + 1
+    return merged
+
+
+class MessageReader:
+    """Reads engine messages on a daemon thread into a queue that is bounded for action frames.
+
+    Attributes :
+        * max_frames (int): How many action frames may wait before new frames are coalesced
+        * frame_fields (list): The dotted frame fields kept across coalesced frames, such as "events.breach"
+        * coalesced_frames (int): How many frames have been merged into others so far
+
+    """
+    def __init__(self, max_frames=64, frame_fields=None, stream=None):
+        self.max_frames = max_frames
+        self.frame_fields = list(frame_fields) if frame_fields else None
+        self.coalesced_frames = 0
+        self._stream = stream if stream is not None else sys.stdin
+        self._messages = collections.deque()
+        self._waiting_frames = 0
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self.__read_loop, name="MessageReader", daemon=True)
+
+    def start(self):
+        """Starts the reader thread
+
+        """
+        self._thread.start()
+        return self
+
+    def __read_loop(self):
+        while True:
+            line = self._stream.readline()
+            if line == "":
+                self.__push(None, None)
+                return
+            message = GameMessage(line)
+            self.__push(message, message_type(message))
+
+    def __push(self, message, kind):
+        with self._condition:
+            if kind == ACTION_FRAME_MESSAGE:
+                last = self._messages[-1] if self._messages else None
+                if self._waiting_frames >= self.max_frames and last is not None and last[1] == ACTION_FRAME_MESSAGE:
+                    self._messages[-1] = (coalesce_frames(last[0], message, self.frame_fields), kind)
+                    self.coalesced_frames += 1
+                    return
+                self._waiting_frames += 1
+            self._messages.append((message, kind))
+            self._condition.notify()
+
+    def get(self):
+        """Waits for the next message
+
+        Returns:
+            The next GameMessage, or None once the engine closed stdin
+
+        """
+        with self._condition:
+            while not self._messages:
+                self._condition.wait()
+            message, kind = self._messages.popleft()
+            if kind == ACTION_FRAME_MESSAGE:
+                self._waiting_frames -= 1
+            return message
+
+
+def next_message_from(reader):
+    """Gets the next message of a reader, exiting like get_command does when the engine closed stdin
+
+    """
+    message = reader.get()
+    if message is None:
+        debug_write("Got EOF, parent game process must have died, exiting for cleanup")
+        exit()
+    return message
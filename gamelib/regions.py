@@ -0,0 +1,98 @@
+"""
+Summed-area tables answering rectangular region questions about units in constant time.
+
+For a table T, T[(y + 1) * TABLE_STRIDE + (x + 1)] holds the sum of a value over every
+location [x', y'] with x' <= x and y' <= y. The sum over any axis aligned rectangle is then
+four lookups, whatever the size of the rectangle.
+"""
+from . import geometry
+
+TABLE_STRIDE = geometry.ARENA_SIZE + 1
+
+COUNT = 0
+HEALTH = 1
+UPGRADED = 2
+
+
+class RegionSums:
+    """Unit counts, total health and upgraded counts over rectangles of the board, per owner and unit type.
+
+    Tables are built from the GameMap unit index the first time a (player, unit type) pair is asked
+    for, and are only valid for the board they were built from. GameState.get_region_sums hands out
+    a new RegionSums whenever the map changes.
+
+    Rectangles are given by inclusive bounds and are clipped to the board, so region.count(1, y0=14, y1=17)
+    counts every enemy unit in rows 14 to 17.
+
+    Attributes :
+        * unit_version (int): The GameMap.unit_version the tables describe
+
+    """
+    def __init__(self, game_map):
+        self.game_map = game_map
+        self.unit_version = game_map.unit_version
+        self._tables = {}
+
+    def __tables(self, player_index, unit_type):
+        key = (player_index, unit_type)
+        tables = self._tables.get(key)
+        if tables is None:
+            tables = self.__build(player_index, unit_type)
+            self._tables[key] = tables
+        return tables
+
+    def __build(self, player_index, unit_type):
+        size = TABLE_STRIDE * TABLE_STRIDE
+        grids = ([0] * size, [0.0] * size, [0] * size)
+        for unit in self.game_map.get_units(player_index, unit_type):
+            index = (unit.y + 1) * TABLE_STRIDE + unit.x + 1
+            grids[COUNT][index] += 1
+            grids[HEALTH][index] += unit.health
+            if unit.upgraded:
+                grids[UPGRADED][index] += 1
+
+        for grid in grids:
+            for y in range(1, TABLE_STRIDE):
+                row_start = y * TABLE_STRIDE
+                running = 0
+                for index in range(row_start + 1, row_start + TABLE_STRIDE):
+                    running += grid[index]
+                    grid[index] = running + grid[index - TABLE_STRIDE]
+        return grids
+
+    def __sum(self, table, player_index, unit_type, x0, y0, x1, y1):
+        x0, y0 = max(x0, 0), max(y0, 0)
+        x1, y1 = min(x1, geometry.ARENA_SIZE - 1), min(y1, geometry.ARENA_SIZE - 1)
+        if x0 > x1 or y0 > y1:
+            return 0
+        grid = self.__tables(player_index, unit_type)[table]
+        top = (y1 + 1) * TABLE_STRIDE
+        bottom = y0 * TABLE_STRIDE
+        return grid[top + x1 + 1] - grid[top + x0] - grid[bottom + x1 + 1] + grid[bottom + x0]
+
+    def count(self, player_index, unit_type=None, x0=0, y0=0, x1=27, y1=27):
+        """The number of units of a player inside a rectangle
+
+        Args:
+            player_index: The index corresponding to the player controlling the units, 0 for you 1 for the enemy
+            unit_type: If given, only count units of this type
+            x0, y0: The lower left corner of the rectangle, inclusive
+            x1, y1: The upper right corner of the rectangle, inclusive
+
+        Returns:
+            The number of matching units
+
+        """
+        return self.__sum(COUNT, player_index, unit_type, x0, y0, x1, y1)
+
+    def health(self, player_index, unit_type=None, x0=0, y0=0, x1=27, y1=27):
+        """The total health of the units count would count
+
+        """
+        return self.__sum(HEALTH, player_index, unit_type, x0, y0, x1, y1)
+
+    def upgraded(self, player_index, unit_type=None, x0=0, y0=0, x1=27, y1=27):
+        """The number of upgraded units among the units count would count
+
+        """
+        return self.__sum(UPGRADED, player_index, unit_type, x0, y0, x1, y1)
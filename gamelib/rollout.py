@@ -0,0 +1,172 @@
+"""
+Parallel evaluation of candidate deploy plans.
+
+A RolloutPool keeps a pool of worker processes alive for the whole game. Each
+worker compiles the config once when it starts, and keeps the Simulator of the
+last board it was sent, so the path tables of a board are built once per worker
+rather than once per plan. Boards travel to the workers as the compact structure
+tuples of simulation.snapshot, never as GameState objects.
+"""
+import math
+import multiprocessing
+import time
+
+from .coverage import get_coverage_table
+from .simulation import Simulator, snapshot
+from .unit import get_unit_descriptors
+
+# State of the current worker process, set by _init_worker
+_worker = {}
+
+
+def default_score(result):
+    """Scores a SimulationResult for player 0: health taken from the enemy first, then damage dealt to structures
+
+    """
+    return (result.breach_damage[1], result.structure_damage[0])
+
+
+def _init_state(state, config, score):
+    state["config"] = config
+    state["score"] = score
+    state["board"] = None
+    state["simulator"] = None
+    get_coverage_table(config)
+    get_unit_descriptors(config)
+
+
+def _init_worker(config, score):
+    _init_state(_worker, config, score)
+
+
+def _evaluate_chunk(board_id, structures, chunk, deadline, max_frames):
+    return _evaluate(_worker, board_id, structures, chunk, deadline, max_frames)
+
+
+def _evaluate(state, board_id, structures, chunk, deadline, max_frames):
+    # Plans left once the deadline, a time.time() value, has passed are skipped
+    if state["board"] != board_id:
+        state["simulator"] = Simulator(state["config"], structures)
+        state["board"] = board_id
+    simulator = state["simulator"]
+    score = state["score"]
+    evaluated = []
+    for index, plan in chunk:
+        if time.time() >= deadline:
+            break
+        result = simulator.simulate(plan, max_frames)
+        evaluated.append((index, score(result), result))
+    return evaluated
+
+
+class RolloutPool:
+    """Scores candidate deploy plans by simulating them on a pool of worker processes.
+
+    A plan is a list of deploys in the form Simulator.simulate takes, such as [(SCOUT, [13, 0], 8)].
+    Create the pool once, for example in on_game_start, and close it when the game ends.
+
+    Attributes :
+        * processes (int): The number of worker processes. 0 evaluates plans in the calling process
+        * evaluated (int): How many plans the last call to evaluate scored in time
+
+    """
+    def __init__(self, config, processes=None, score=default_score):
+        """
+        Args:
+            config: The game config
+            processes: The number of worker processes, one less than the number of CPUs if None
+            score: A function scoring a SimulationResult, higher is better. It runs in the workers,
+                so it must be a module level function
+
+        """
+        if processes is None:
+            processes = max(multiprocessing.cpu_count() - 1, 1)
+        self.config = config
+        self.processes = processes
+        self.evaluated = 0
+        self._board_id = 0
+        self._structures = None
+        self._pool = None
+        self._local = None
+        if processes > 0:
+            self._pool = multiprocessing.Pool(processes, _init_worker, (config, score))
+        else:
+            self._local = {}
+            _init_state(self._local, config, score)
+
+    def evaluate(self, board, plans, budget=None, max_frames=500):
+        """Simulates every plan against a board and ranks them
+
+        Args:
+            board: A GameState, or the structures of a board as returned by simulation.snapshot
+            plans: A list of plans, each a list of deploys
+            budget: The time allowed in seconds, or a TurnBudget. Plans that were not scored in time are left out
+            max_frames: The frame after which each simulation stops
+
+        Returns:
+            A list of (score, plan, SimulationResult) tuples, best first. Plans with equal scores keep their order
+
+        """
+        structures = snapshot(board) if hasattr(board, "game_map") else tuple(board)
+        if structures != self._structures:
+            self._structures = structures
+            self._board_id += 1
+
+        if budget is None:
+            seconds = math.inf
+        elif hasattr(budget, "remaining"):
+            seconds = budget.remaining()
+        else:
+            seconds = budget
+        deadline = time.time() + seconds
+
+        indexed = list(enumerate(plans))
+        if self._pool is None:
+            evaluated = _evaluate(self._local, self._board_id, structures, indexed, deadline, max_frames)
+        else:
+            evaluated = self.__evaluate_in_pool(structures, indexed, deadline, max_frames)
+
+        self.evaluated = len(evaluated)
+        evaluated.sort(key=lambda entry: entry[0])
+        evaluated.sort(key=lambda entry: entry[1], reverse=True)
+        return [(score, plans[index], result) for index, score, result in evaluated]
+
+    def __evaluate_in_pool(self, structures, indexed, deadline, max_frames):
+        # Small chunks keep the workers busy until the deadline without shipping the board for every plan
+        chunk_size = max(1, math.ceil(len(indexed) / (self.processes * 4)))
+        pending = [self._pool.apply_async(_evaluate_chunk, (self._board_id, structures, indexed[i:i + chunk_size], deadline, max_frames))
+                   for i in range(0, len(indexed), chunk_size)]
+        evaluated = []
+        for chunk in pending:
+            timeout = deadline - time.time()
+            try:
+                evaluated.extend(chunk.get(None if timeout == math.inf else max(timeout, 0)))
+            except multiprocessing.TimeoutError:
+                # The workers skip what is left of their chunks, so the pool is free again shortly
+                continue
+        return evaluated
+
+    def close(self):
+        """Stops the worker processes
+
+        """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def candidate_plans(unit_types, locations, counts):
+    """Every single deploy plan combining one unit type, one location and one count
+
+    Returns:
+        A list of plans, each a list holding one (unit_type, location, count) deploy
+
+    """
+    return [[(unit_type, location, count)] for unit_type in unit_types for location in locations for count in counts]
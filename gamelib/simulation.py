@@ -0,0 +1,364 @@
+"""
+Frame by frame simulation of the action phase.
+
+A Simulator holds the structures of a board and plays out deploys of mobile units
+against them, one frame at a time: shielding, movement, attacks and the removal of
+destroyed structures. Units of one type deployed together at one location move as
+a single stack, so ten scouts cost about as much as one. Paths are read from
+NextHopTables that are only rebuilt when a structure is destroyed, and tables
+for the starting board are shared between every simulation of a Simulator.
+"""
+from . import bitboard, geometry
+from .coverage import get_coverage_table
+from .navigation import NextHopTable
+from .unit import get_unit_descriptors
+
+HORIZONTAL = 1
+VERTICAL = 2
+
+# Tables for boards reached after structures were destroyed are dropped once this many are cached
+MAX_CACHED_TABLES = 64
+
+
+def target_edge_of(location):
+    """The edge a mobile unit spawned at location paths to, see GameState.get_target_edge
+
+    """
+    left = location[0] < geometry.HALF_ARENA
+    bottom = location[1] < geometry.HALF_ARENA
+    if left:
+        return geometry.TOP_RIGHT if bottom else geometry.BOTTOM_RIGHT
+    return geometry.TOP_LEFT if bottom else geometry.BOTTOM_LEFT
+
+
+class _Stack:
+    """Identical mobile units sharing a location. Only the front unit has taken damage, the others share health."""
+    __slots__ = ("player_index", "descriptor", "rules", "edge", "x", "y", "direction", "count", "front", "health",
+                 "progress", "steps", "shielded")
+
+    def __init__(self, player_index, descriptor, rules, location, count):
+        self.player_index = player_index
+        self.descriptor = descriptor
+        self.rules = rules
+        self.edge = target_edge_of(location)
+        self.x, self.y = location
+        self.direction = 0
+        self.count = count
+        self.front = descriptor.max_health
+        self.health = descriptor.max_health
+        self.progress = 0.0
+        self.steps = 0
+        self.shielded = 0
+
+
+class SimulationResult:
+    """What happened during one simulated action phase.
+
+    Attributes :
+        * frames (int): The number of frames simulated
+        * breaches (list): (frame, (x, y), unit_type, player_index, count) for every stack that reached its edge
+        * breach_damage (list): The health each player's units took from the opponent, by player index
+        * structure_damage (list): The damage each player's mobile units dealt to enemy structures, by player index
+        * unit_damage (list): The damage each player's units dealt to enemy mobile units, by player index
+        * destroyed (list): (unit_type, (x, y), player_index) for every structure destroyed, in order
+        * self_destructs (list): The number of units of each player that self destructed, by player index
+        * lost (list): The number of mobile units of each player that were destroyed, by player index
+
+    """
+    def __init__(self):
+        self.frames = 0
+        self.breaches = []
+        self.breach_damage = [0.0, 0.0]
+        self.structure_damage = [0.0, 0.0]
+        self.unit_damage = [0.0, 0.0]
+        self.destroyed = []
+        self.self_destructs = [0, 0]
+        self.lost = [0, 0]
+
+    def __repr__(self):
+        return "SimulationResult(frames={}, breach_damage={}, structure_damage={}, destroyed={})".format(
+            self.frames, self.breach_damage, self.structure_damage, len(self.destroyed))
+
+
+class Simulator:
+    """Plays out deploys of mobile units against a fixed set of structures.
+
+    The simulation follows the rules gamelib already models: units path like find_path_to_edge and
+    repath when a structure is destroyed, pick targets like get_target and are hit by the structures
+    get_attackers lists. Each frame, supports shield the units entering their shieldRange once each,
+    units move once every 1/speed frames, every unit alive at the start of the attack step attacks, and
+    destroyed structures stop blocking paths from the next move on. A unit at the end of its path
+    scores if it is on its target edge, and self destructs otherwise, damaging structures within
+    selfDestructRange if it has moved selfDestructStepsRequired times.
+
+    Within a stack, attacks always land on the front unit, so damage is never spread across several
+    units of a stack. Self destructs only damage structures.
+
+    Attributes :
+        * config (JSON): The game config
+        * structures (tuple): (player_index, unit_type, upgraded, health, x, y) for every structure of the board
+
+    """
+    def __init__(self, config, structures):
+        """
+        Args:
+            config: The game config
+            structures: An iterable of (player_index, unit_type, upgraded, health, x, y), see snapshot
+
+        """
+        self.config = config
+        self.structures = tuple(structures)
+        self._coverage = get_coverage_table(config)
+        self._descriptors = get_unit_descriptors(config)
+        self._rules = {}
+        for unit_info in config["unitInformation"]:
+            if unit_info.get("unitCategory") == 1:
+                self._rules[unit_info["shorthand"]] = (
+                    unit_info.get("playerBreachDamage", 1.0),
+                    unit_info.get("selfDestructStepsRequired", 0),
+                    unit_info.get("selfDestructRange", 0),
+                    unit_info.get("selfDestructDamageTower", 0))
+
+        self._health = {}
+        self._owners = {}
+        self._owned = [0, 0]
+        self._shields = {}
+        # _turrets[player_index][attackRange] is the mask of that player's structures able to hit mobile units
+        self._turrets = [{}, {}]
+        for player_index, unit_type, upgraded, health, x, y in self.structures:
+            descriptor = self._descriptors[unit_type]
+            if upgraded:
+                descriptor = descriptor.upgrade
+            cell = bitboard.bit_index(x, y)
+            self._health[cell] = health
+            self._owners[cell] = (player_index, descriptor)
+            self._owned[player_index] |= 1 << cell
+            if descriptor.damage_i > 0:
+                turrets = self._turrets[player_index]
+                turrets[descriptor.attackRange] = turrets.get(descriptor.attackRange, 0) | 1 << cell
+            if descriptor.shieldPerUnit > 0 or descriptor.shieldBonusPerY > 0:
+                rows = y if player_index == 0 else geometry.ARENA_SIZE - 1 - y
+                self._shields[cell] = descriptor.shieldPerUnit + descriptor.shieldBonusPerY * rows
+        self._tables = {}
+        self._end_points = [[list(location) for location in edge] for edge in geometry.EDGES]
+        self._base_blocked = self._owned[0] | self._owned[1]
+
+    @classmethod
+    def from_game_state(cls, game_state):
+        """A Simulator for the structures currently on a GameState's map
+
+        """
+        return cls(game_state.config, snapshot(game_state))
+
+    def _next_hop_table(self, edge, blocked):
+        key = (edge, blocked)
+        table = self._tables.get(key)
+        if table is None:
+            if len(self._tables) >= MAX_CACHED_TABLES:
+                self._tables = {k: v for k, v in self._tables.items() if k[1] == self._base_blocked}
+            table = NextHopTable(self._end_points[edge], blocked)
+            self._tables[key] = table
+        return table
+
+    def simulate(self, deploys, max_frames=500):
+        """Plays out an action phase
+
+        Args:
+            deploys: A list of (unit_type, location, count) or (unit_type, location, count, player_index) tuples.
+                player_index defaults to 0. Deploys on blocked or out of bounds locations are ignored
+            max_frames: The frame after which the simulation stops even if units are still alive
+
+        Returns:
+            A SimulationResult
+
+        """
+        result = SimulationResult()
+        health = dict(self._health)
+        owned = list(self._owned)
+        blocked = self._base_blocked
+        stacks = []
+        for deploy in deploys:
+            unit_type, location, count = deploy[:3]
+            player_index = deploy[3] if len(deploy) > 3 else 0
+            x, y = location
+            if count <= 0 or not bitboard.in_bounds(x, y) or (blocked >> bitboard.bit_index(x, y)) & 1:
+                continue
+            for stack in stacks:
+                if stack.descriptor.unit_type == unit_type and stack.player_index == player_index and (stack.x, stack.y) == (x, y):
+                    stack.count += count
+                    break
+            else:
+                stacks.append(_Stack(player_index, self._descriptors[unit_type], self._rules[unit_type], (x, y), count))
+
+        while stacks and result.frames < max_frames:
+            result.frames += 1
+            if self._shields:
+                self.__shield(stacks, owned)
+            stacks = self.__move(stacks, blocked, health, owned, result)
+            if not stacks:
+                break
+            if self.__attack(stacks, health, owned, result):
+                # Paths change from the next move on
+                blocked = owned[0] | owned[1]
+            stacks = [stack for stack in stacks if stack.count > 0]
+        return result
+
+    def __shield(self, stacks, owned):
+        attack_mask = self._coverage.attack_mask
+        for stack in stacks:
+            supports = owned[stack.player_index] & ~stack.shielded
+            if not supports:
+                continue
+            for cell, amount in self._shields.items():
+                if (supports >> cell) & 1:
+                    descriptor = self._owners[cell][1]
+                    if (attack_mask((stack.x, stack.y), descriptor.shieldRange) >> cell) & 1:
+                        stack.shielded |= 1 << cell
+                        stack.front += amount
+                        stack.health += amount
+
+    def __move(self, stacks, blocked, health, owned, result):
+        moved = []
+        for stack in stacks:
+            stack.progress += stack.descriptor.speed
+            if stack.progress < 1 - 1e-9:
+                moved.append(stack)
+                continue
+            stack.progress -= 1
+            hop = self._next_hop_table(stack.edge, blocked).next_hop((stack.x, stack.y), stack.direction)
+            if hop is not None:
+                stack.direction = VERTICAL if hop[0] == stack.x else HORIZONTAL
+                stack.x, stack.y = hop
+                stack.steps += 1
+                moved.append(stack)
+                continue
+
+            location = (stack.x, stack.y)
+            breach_damage, steps_required, destruct_range, destruct_damage = stack.rules
+            if location in geometry.EDGE_SETS[stack.edge]:
+                result.breaches.append((result.frames, location, stack.descriptor.unit_type, stack.player_index, stack.count))
+                result.breach_damage[1 - stack.player_index] += breach_damage * stack.count
+            else:
+                result.self_destructs[stack.player_index] += stack.count
+                if stack.steps >= steps_required and destruct_damage > 0:
+                    enemy = 1 - stack.player_index
+                    in_range = owned[enemy] & self._coverage.attack_mask(location, destruct_range)
+                    for cell in _cells_of(in_range):
+                        self.__damage_structure(cell, destruct_damage * stack.count, stack.player_index, health, owned, result)
+        return moved
+
+    def __attack(self, stacks, health, owned, result):
+        """Every unit alive at the start of the step attacks. Returns True if a structure was destroyed"""
+        attack_mask = self._coverage.attack_mask
+        owners = self._owners
+        destroyed = len(result.destroyed)
+
+        # Structures choose their targets among the stacks in range before any damage is dealt
+        turret_targets = {}
+        for stack in stacks:
+            enemy = 1 - stack.player_index
+            for attack_range, turrets in self._turrets[enemy].items():
+                for cell in _cells_of(turrets & owned[enemy] & attack_mask((stack.x, stack.y), attack_range)):
+                    turret_targets.setdefault(cell, []).append(stack)
+        attackers = [(stack, stack.count) for stack in stacks]
+
+        for stack, count in attackers:
+            descriptor = stack.descriptor
+            location = (stack.x, stack.y)
+            enemy = 1 - stack.player_index
+            reach = attack_mask(location, descriptor.attackRange) if descriptor.damage_f > 0 else 0
+            target = None
+            for _ in range(count):
+                if target is None or (target.count <= 0 if type(target) is _Stack else target not in health):
+                    target = self.__choose_target(stack, location, stacks, owned[enemy] & reach, health)
+                    if target is None:
+                        break
+                if type(target) is _Stack:
+                    self.__damage_stack(target, descriptor.damage_i, stack.player_index, result)
+                else:
+                    self.__damage_structure(target, descriptor.damage_f, stack.player_index, health, owned, result)
+
+        for cell, candidates in turret_targets.items():
+            player_index, descriptor = owners[cell]
+            x, y = geometry.COORDINATES[cell]
+            alive = [stack for stack in candidates if stack.count > 0]
+            if alive:
+                target = min(alive, key=lambda stack: _priority(player_index, x, y, stack.x, stack.y, stack.front))
+                self.__damage_stack(target, descriptor.damage_i, player_index, result)
+
+        return len(result.destroyed) > destroyed
+
+    def __choose_target(self, stack, location, stacks, structures, health):
+        player_index = stack.player_index
+        descriptor = stack.descriptor
+        x, y = location
+        best = None
+        best_priority = None
+        if descriptor.damage_i > 0:
+            reach = descriptor.attackRange ** 2
+            for other in stacks:
+                if other.player_index != player_index and other.count > 0 and (other.x - x) ** 2 + (other.y - y) ** 2 <= reach:
+                    priority = _priority(player_index, x, y, other.x, other.y, other.front)
+                    if best is None or priority < best_priority:
+                        best, best_priority = other, priority
+        if best is not None or not structures:
+            return best
+        for cell in _cells_of(structures):
+            target_x, target_y = geometry.COORDINATES[cell]
+            priority = _priority(player_index, x, y, target_x, target_y, health[cell])
+            if best is None or priority < best_priority:
+                best, best_priority = cell, priority
+        return best
+
+    def __damage_stack(self, stack, damage, attacker_index, result):
+        if damage <= 0 or stack.count <= 0:
+            return
+        dealt = min(damage, stack.front)
+        result.unit_damage[attacker_index] += dealt
+        stack.front -= damage
+        if stack.front <= 0:
+            stack.count -= 1
+            stack.front = stack.health
+            result.lost[stack.player_index] += 1
+
+    def __damage_structure(self, cell, damage, attacker_index, health, owned, result):
+        if damage <= 0 or cell not in health:
+            return
+        remaining = health[cell]
+        result.structure_damage[attacker_index] += min(damage, remaining)
+        if remaining > damage:
+            health[cell] = remaining - damage
+            return
+        del health[cell]
+        player_index, descriptor = self._owners[cell]
+        owned[player_index] &= ~(1 << cell)
+        result.destroyed.append((descriptor.unit_type, geometry.COORDINATES[cell], player_index))
+
+
+def _priority(player_index, x, y, target_x, target_y, target_health):
+    # get_target's order once mobile targets have been preferred: nearest, lowest health,
+    # closest to the attacker's own side, then furthest from the center column
+    return ((target_x - x) ** 2 + (target_y - y) ** 2, target_health,
+            target_y if player_index == 0 else -target_y, -abs(geometry.HALF_ARENA - 0.5 - target_x))
+
+
+def _cells_of(mask):
+    while mask:
+        low_bit = mask & -mask
+        yield low_bit.bit_length() - 1
+        mask ^= low_bit
+
+
+def snapshot(game_state):
+    """The structures of a GameState's map in the compact form Simulator takes
+
+    Returns:
+        A tuple of (player_index, unit_type, upgraded, health, x, y) tuples
+
+    """
+    structures = []
+    for player_index in (0, 1):
+        for unit in game_state.game_map.get_units(player_index):
+            if unit.stationary:
+                structures.append((player_index, unit.unit_type, unit.upgraded, unit.health, unit.x, unit.y))
+    return tuple(structures)
@@ -0,0 +1,143 @@
+"""
+Speculative work done while the action phase plays out.
+
+Between two turns the algo mostly waits for action frames. A SpeculativeRunner
+uses that time to run tasks on a worker thread against the board of the newest
+frame. When the next turn arrives, the results are only handed over if the
+turn's board still matches the board they were computed on.
+"""
+import threading
+
+from .game_state import GameState
+from .util import decode_message, debug_write
+
+# Index of the UP entries in p1Units and p2Units, see GameState
+UPGRADE_INDEX = 7
+
+
+def board_fingerprint(config, state):
+    """A hashable summary of the structures of a decoded game state or action frame: the owner, type
+    and location of every structure and of every upgrade. Health is left out.
+
+    Args:
+        config: The game config
+        state: The decoded JSON of a turn or action frame message
+
+    """
+    type_indices = [i for i, unit_info in enumerate(config["unitInformation"]) if unit_info.get("unitCategory") == 0]
+    type_indices.append(UPGRADE_INDEX)
+    entries = []
+    for player_index, key in ((0, "p1Units"), (1, "p2Units")):
+        units = state.get(key, [])
+        for type_index in type_indices:
+            if type_index < len(units):
+                for unit in units[type_index]:
+                    entries.append((player_index, type_index, int(unit[0]), int(unit[1])))
+    return frozenset(entries)
+
+
+class SpeculativeRunner:
+    """Runs tasks on a worker thread against the newest action frame of a turn.
+
+    Each task is a function taking a GameState and returning any result. Tasks run one after another,
+    and a run is abandoned between two tasks when a frame with a different board or the next turn arrives.
+    Results are plain values handed to the next turn, so tasks should return data rather than
+    objects tied to their GameState.
+
+    """
+    def __init__(self, config, tasks):
+        """
+        Args:
+            config: The game config
+            tasks: A list of (name, task) pairs
+
+        """
+        self.config = config
+        self.tasks = list(tasks)
+        self._condition = threading.Condition()
+        self._latest = None
+        self._busy = False
+        self._generation = 0
+        self._completed = None
+        self._thread = threading.Thread(target=self.__work, name="SpeculativeRunner", daemon=True)
+        self._thread.start()
+
+    def submit(self, frame):
+        """Makes a frame the newest board to speculate on. Cheap, the frame is decoded by the worker
+
+        Args:
+            frame: The GameMessage, JSON string or decoded dict of an action frame
+
+        """
+        with self._condition:
+            self._latest = frame
+            self._condition.notify_all()
+
+    def collect(self, turn):
+        """Ends the current action phase and gets the results computed on the same board as a turn
+
+        Args:
+            turn: The GameMessage, JSON string or decoded dict of the turn message
+
+        Returns:
+            A dict of task name to result, empty if the board changed or nothing finished in time
+
+        """
+        with self._condition:
+            self._generation += 1
+            self._latest = None
+            completed, self._completed = self._completed, None
+        if completed is None or completed[0] != board_fingerprint(self.config, decode_message(turn)):
+            return {}
+        return completed[1]
+
+    def wait(self, timeout=None):
+        """Waits until the worker has nothing left to do
+
+        Returns:
+            True if it is idle, False if the timeout expired first
+
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self._latest is None and not self._busy, timeout)
+
+    def __work(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._latest is not None)
+                frame, self._latest = self._latest, None
+                generation = self._generation
+                completed = self._completed
+                self._busy = True
+            try:
+                self.__run(frame, generation, completed)
+            except Exception as error:
+                debug_write("Speculative run failed: {}".format(error))
+            with self._condition:
+                self._busy = False
+                self._condition.notify_all()
+
+    def __run(self, frame, generation, completed):
+        state = decode_message(frame)
+        fingerprint = board_fingerprint(self.config, state)
+        if completed is not None and completed[0] == fingerprint:
+            return
+        game_state = GameState(self.config, state)
+        results = {}
+        for name, task in self.tasks:
+            if self.__stale(generation, fingerprint):
+                return
+            try:
+                results[name] = task(game_state)
+            except Exception as error:
+                debug_write("Speculative task {} failed: {}".format(name, error))
+        with self._condition:
+            if self._generation == generation:
+                self._completed = (fingerprint, results)
+
+    def __stale(self, generation, fingerprint):
+        with self._condition:
+            if self._generation != generation:
+                return True
+            newer = self._latest
+        return newer is not None and board_fingerprint(self.config, decode_message(newer)) != fingerprint
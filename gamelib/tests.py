@@ -1,196 +1,26 @@
 import unittest
 import json
+import random
+import io
+import contextlib
 from .game_state import GameState
 from .unit import GameUnit
+from .navigation import ShortestPathFinder, BitboardPathFinder, EdgeDistanceField, PathCache
+from . import bitboard, geometry, navigation
+from .util import GameMessage, message_type, decode_message
+from .reader import MessageReader
+from .speculation import SpeculativeRunner
+from .budget import TurnBudget, BudgetExceeded, run_anytime
+from .simulation import Simulator, snapshot
+from .rollout import RolloutPool, candidate_plans
+from .layout import Layout
+from .algocore import AlgoCore
+from .fixtures import make_turn_0_state
 
 class BasicTests(unittest.TestCase):
 
     def make_turn_0_map(self):
-        config = """
-            {
-            "seasonCompatibilityModeP1": 5,
-            "seasonCompatibilityModeP2": 5,
-            "debug":{
-                "printMapString":false,
-                "printTStrings":false,
-                "printActStrings":false,
-                "printHitStrings":false,
-                "printPlayerInputStrings":false,
-                "printBotErrors":true,
-                "printPlayerGetHitStrings":false
-            },
-            "unitInformation": [
-                {
-                "icon": "S3_filter",
-                "iconxScale": 0.4,
-                "iconyScale": 0.4,
-                "cost1": 1.0,
-                "getHitRadius":0.01,
-                "display":"filter",
-                "shorthand":"FF",
-                "startHealth":75.0,
-                "unitCategory": 0,
-                "refundPercentage": 0.75,
-                "turnsRequiredToRemove": 1,
-                "upgrade": {
-                    "startHealth": 150.0
-                }
-                },
-                {
-                "icon": "S3_encryptor",
-                "iconxScale": 0.5,
-                "iconyScale": 0.5,
-                "cost1":4.0,
-                "getHitRadius":0.01,
-                "display":"encryptor",
-                "shieldRange":0,
-                "shorthand":"EF",
-                "startHealth":30.0,
-                "unitCategory": 0,
-                "refundPercentage": 0.75,
-                "turnsRequiredToRemove": 1,
-                "generatesResource1": 1,
-                "upgrade": {
-                    "generatesResource2": 1
-                }
-                },
-                {
-                "icon": "S3_destructor",
-                "iconxScale": 0.5,
-                "iconyScale": 0.5,
-                "attackDamageWalker":5.0,
-                "cost1":2.0,
-                "getHitRadius":0.01,
-                "display":"destructor",
-                "attackRange":2.5,
-                "shorthand":"DF",
-                "startHealth":90.0,
-                "unitCategory": 0,
-                "refundPercentage": 0.75,
-                "turnsRequiredToRemove": 1,
-                "upgrade": {
-                    "cost1": 4.0,
-                    "attackRange":3.5,
-                    "attackDamageWalker":15.0
-                }
-                },
-                {
-                "icon": "S3_ping",
-                "iconxScale": 0.7,
-                "iconyScale": 0.7,
-                "attackDamageTower":2.0,
-                "attackDamageWalker":2.0,
-                "playerBreachDamage":1.0,
-                "cost2":1.0,
-                "getHitRadius":0.01,
-                "display":"ping",
-                "attackRange":3.5,
-                "shorthand":"PI",
-                "startHealth":15.0,
-                "speed":1,
-                "unitCategory": 1,
-                "selfDestructDamageWalker": 15.0,
-                "selfDestructDamageTower": 15.0,
-                "metalForBreach": 1.0,
-                "selfDestructRange": 1.5,
-                "selfDestructStepsRequired": 5
-                },
-                {
-                "icon": "S3_emp",
-                "iconxScale": 0.47,
-                "iconyScale": 0.47,
-                "attackDamageWalker":6.0,
-                "attackDamageTower":6.0,
-                "playerBreachDamage":1.0,
-                "cost2":3.0,
-                "getHitRadius":0.01,
-                "display":"emp",
-                "attackRange":4.5,
-                "shorthand":"EI",
-                "startHealth":5.0,
-                "speed":0.5,
-                "unitCategory": 1,
-                "selfDestructDamageWalker": 5.0,
-                "selfDestructDamageTower": 5.0,
-                "metalForBreach": 1.0,
-                "selfDestructRange": 1.5,
-                "selfDestructStepsRequired": 5
-                },
-                {
-                "icon": "S3_scrambler",
-                "iconxScale": 0.5,
-                "iconyScale": 0.5,
-                "attackDamageWalker":20.0,
-                "playerBreachDamage":1.0,
-                "cost2":1.0,
-                "getHitRadius":0.01,
-                "display":"scrambler",
-                "attackRange":4.5,
-                "shorthand":"SI",
-                "startHealth":40.0,
-                "speed":0.25,
-                "unitCategory": 1,
-                "selfDestructDamageWalker": 40.0,
-                "selfDestructDamageTower": 40.0,
-                "metalForBreach": 1.0,
-                "selfDestructRange": 1.5,
-                "selfDestructStepsRequired": 5
-                },
-                {
-                "display":"Remove",
-                "shorthand":"RM",
-                "icon": "S3_removal",
-                "iconxScale": 0.4,
-                "iconyScale": 0.4
-                },
-                {
-                "display":"Upgrade",
-                "shorthand":"UP",
-                "icon": "S3_upgrade",
-                "iconxScale": 0.4,
-                "iconyScale": 0.4
-                }
-            ],
-            "timingAndReplay":{
-                "waitTimeBotMax":35000,
-                "playWaitTimeBotMax":40000,
-                "waitTimeManual":1820000,
-                "waitForever":false,
-                "waitTimeBotSoft":5000,
-                "playWaitTimeBotSoft":10000,
-                "replaySave":1,
-                "playReplaySave":0,
-                "storeBotTimes":true,
-                "waitTimeStartGame":3000,
-                "waitTimeEndGame":3000
-            },
-            "resources":{
-                "turnIntervalForBitCapSchedule":10,
-                "turnIntervalForBitSchedule":10,
-                "bitRampBitCapGrowthRate":5.0,
-                "roundStartBitRamp":10,
-                "bitGrowthRate":1.0,
-                "startingHP":40.0,
-                "maxBits":150.0,
-                "bitsPerRound":5.0,
-                "coresPerRound":5.0,
-                "coresForPlayerDamage":1.0,
-                "startingBits":5.0,
-                "bitDecayPerRound":0.25,
-                "startingCores":20.0
-            },
-            "misc":{
-                "numBlockedLocations": 0,
-                "blockedLocations": [
-                ]
-            }
-        }
-        """
-        turn_0 = """{"p2Units":[[],[],[],[],[],[],[]],"turnInfo":[0,0,-1],"p1Stats":[30.0,25.0,5.0,0],"p1Units":[[],[],[],[],[],[],[]],"p2Stats":[30.0,25.0,5.0,0],"events":{"selfDestruct":[],"breach":[],"damage":[],"shield":[],"move":[],"spawn":[],"death":[],"attack":[],"melee":[]}}"""
-        
-        state = GameState(json.loads(config), turn_0)
-        state.suppress_warnings(True)
-        return state
+        return make_turn_0_state()
 
     def test_basic(self):
         self.assertEqual(True, True, "It's the end of the world as we know it, and I feel fine")
@@ -256,6 +86,564 @@ class BasicTests(unittest.TestCase):
         game.game_map.add_unit("DF", [14,14], 1)
         self.assertEqual(3, len(game.get_attackers([13,13], 0)), "We should be in danger from 3 places")
 
+    def test_bitboard_paths_match_reference(self):
+        game = self.make_turn_0_map()
+        rng = random.Random(2021)
+        locations = list(game.game_map)
+        for location in locations:
+            if rng.random() < 0.35:
+                game.game_map.add_unit("FF", location, rng.randint(0, 1))
+
+        reference = ShortestPathFinder()
+        bitboard_finder = BitboardPathFinder()
+        for location in rng.sample(locations, 40):
+            for edge in range(4):
+                end_points = game.game_map.get_edge_locations(edge)
+                expected = reference.navigate_multiple_endpoints(location, end_points, game)
+                got = bitboard_finder.navigate_multiple_endpoints(location, end_points, game)
+                self.assertEqual(expected, got, "Bitboard path from {} to edge {} differs".format(location, edge))
+
+    def test_edge_distance_field_repair(self):
+        game = self.make_turn_0_map()
+        rng = random.Random(7)
+        locations = list(game.game_map)
+        field = game.get_edge_distance_field(game.game_map.TOP_RIGHT)
+        for _ in range(150):
+            location = rng.choice(locations)
+            if rng.random() < 0.6:
+                game.game_map.add_unit("FF", location)
+            else:
+                game.game_map.remove_unit(location)
+
+        rebuilt = EdgeDistanceField(game.game_map.get_edge_locations(game.game_map.TOP_RIGHT), bitboard.blocked_mask(game.game_map))
+        for location in locations:
+            self.assertEqual(rebuilt.pathlength(location), field.pathlength(location), "Repaired pathlength at {} is wrong".format(location))
+
+    def test_path_cache(self):
+        cache = PathCache(capacity=2)
+        self.assertIsNone(cache.get(0, [13, 0], 0), "An empty cache should miss")
+        cache.put(0, [13, 0], 0, [[13, 0], [13, 1]])
+        cache.put(0, [14, 0], 1, [[14, 0]])
+        self.assertEqual([[13, 0], [13, 1]], cache.get(0, [13, 0], 0), "Cached path was not returned")
+        self.assertIsNone(cache.get(1, [13, 0], 0), "A different board should miss")
+        cache.put(0, [15, 1], 1, [[15, 1]])
+        self.assertIsNone(cache.get(0, [14, 0], 1), "The least recently used path should have been evicted")
+        self.assertEqual((1, 3, 1), (cache.hits, cache.misses, cache.evictions), "Cache counters are wrong")
+
+    def test_custom_path_finder(self):
+        class CustomPathFinder(ShortestPathFinder):
+            def navigate_multiple_endpoints(self, start_point, end_points, game_state):
+                return [list(start_point), [0, 13]]
+
+        turn_0 = self.make_turn_0_map()
+        game = GameState(turn_0.config, turn_0.serialized_string, path_finder=CustomPathFinder())
+        # The shared path cache keeps the paths of each kind of path finder apart, in either order
+        expected = turn_0.find_path_to_edge([13, 0])
+        self.assertEqual([[13, 0], [0, 13]], game.find_path_to_edge([13, 0]))
+        self.assertEqual([[13, 0], [0, 13]], game.find_path_to_edge([13, 0]))
+        self.assertEqual(expected, turn_0.find_path_to_edge([13, 0]))
+        self.assertEqual(expected, turn_0.fork().find_path_to_edge([13, 0]))
+
+    def test_next_hop_table_matches_paths(self):
+        game = self.make_turn_0_map()
+        rng = random.Random(11)
+        locations = list(game.game_map)
+        for location in locations:
+            if rng.random() < 0.4:
+                game.game_map.add_unit("FF", location)
+
+        path_finder = BitboardPathFinder()
+        end_points = game.game_map.get_edge_locations(game.game_map.TOP_LEFT)
+        table = game.get_next_hop_table(game.game_map.TOP_LEFT)
+        for location in locations:
+            expected = path_finder.navigate_multiple_endpoints(location, end_points, game)
+            self.assertEqual(expected, table.get_path(location), "Next hop path from {} differs".format(location))
+
+    def test_navigate_boards_matches_single_boards(self):
+        game = self.make_turn_0_map()
+        rng = random.Random(5)
+        locations = list(game.game_map)
+        boards = [bitboard.from_locations([l for l in locations if rng.random() < 0.4]) for _ in range(25)]
+
+        path_finder = BitboardPathFinder()
+        end_points = game.game_map.get_edge_locations(game.game_map.TOP_RIGHT)
+        paths = path_finder.navigate_boards([13, 0], end_points, boards)
+        for board, path in zip(boards, paths):
+            if bitboard.contains(board, [13, 0]):
+                self.assertIsNone(path, "A blocked start should have no path")
+            else:
+                self.assertEqual(path_finder.navigate_blocked_mask([13, 0], end_points, board), path, "Batched path differs")
+
+    def test_pockets(self):
+        game = self.make_turn_0_map()
+        game_map = game.game_map
+        for x in range(0, 28):
+            if game_map.in_arena_bounds([x, 13]):
+                game_map.add_unit("FF", [x, 13])
+        self.assertTrue(game_map.can_reach_edge([13, 5], game_map.BOTTOM_LEFT), "The bottom edges should be reachable")
+        self.assertFalse(game_map.can_reach_edge([13, 5], game_map.TOP_RIGHT), "The wall should cut off the top edges")
+        self.assertNotEqual(game_map.get_pocket([13, 5]), game_map.get_pocket([13, 20]), "The wall should split the board")
+        self.assertEqual(-1, game_map.get_pocket([13, 13]), "Blocked locations belong to no pocket")
+        self.assertEqual([1, 12], game_map.get_self_destruct_location([13, 5], game_map.TOP_LEFT), "Wrong self destruct location")
+        self.assertEqual(game.find_path_to_edge([13, 5], game_map.TOP_LEFT)[-1], game_map.get_self_destruct_location([13, 5], game_map.TOP_LEFT))
+
+        game_map.remove_unit([20, 13])
+        self.assertTrue(game_map.can_reach_edge([13, 5], game_map.TOP_RIGHT), "Labels were not updated after removing a wall")
+
+    def test_damage_heatmap_matches_attackers(self):
+        game = self.make_turn_0_map()
+        game._player_resources[0]['SP'] = 100
+        heatmap = game.get_damage_heatmap()
+        for location in [[12, 14], [14, 15], [20, 16], [13, 24]]:
+            game.game_map.add_unit("DF", location, 1)
+        game.attempt_spawn("DF", [[13, 10], [6, 9], [16, 12]])
+        game.attempt_upgrade([[13, 10], [16, 12]])
+        game.game_map.add_unit("FF", [14, 15], 1)
+
+        for location in game.game_map:
+            for player_index in (0, 1):
+                expected = sum(unit.damage_i for unit in game.get_attackers(location, player_index) if unit.stationary)
+                self.assertEqual(expected, heatmap.damage_at(location, player_index), "Wrong damage at {}".format(location))
+
+    def test_coverage_table_matches_distances(self):
+        game = self.make_turn_0_map()
+        coverage = game.game_map.get_coverage_table()
+        hit_radius = game.config["unitInformation"][0]['getHitRadius']
+        for location in game.game_map:
+            for radius in (0, 1.5, 3.5, 4.5):
+                expected = [[x, y] for x in range(28) for y in range(28) if game.game_map.in_arena_bounds([x, y])
+                            and game.game_map.distance_between_locations(location, [x, y]) < radius + hit_radius]
+                self.assertEqual(expected, game.game_map.get_locations_in_range(location, radius))
+                self.assertEqual(len(expected), bitboard.count(coverage.in_range_mask(location, radius)))
+
+        upgraded_range = game.config["unitInformation"][2]["upgrade"]["attackRange"]
+        self.assertEqual(coverage.attack_mask([13, 13], upgraded_range), coverage.type_attack_mask("DF", [13, 13], True))
+        game.game_map.add_unit("DF", [13, 15], 1)
+        game.game_map.add_unit("PI", [13, 14], 1)
+        attackers = game.get_attackers([13, 13], 0)
+        self.assertEqual(["PI", "DF"], [unit.unit_type for unit in attackers])
+
+    def test_geometry_tables(self):
+        game = self.make_turn_0_map()
+        locations = list(game.game_map)
+        self.assertEqual(420, len(locations))
+        self.assertEqual([13, 0], locations[0])
+        self.assertEqual([14, 27], locations[-1])
+        nested = sum(1 for _ in game.game_map for _ in game.game_map)
+        self.assertEqual(420 * 420, nested)
+
+        for x in range(-2, 30):
+            for y in range(-2, 30):
+                row_size = y + 1 if y < 14 else 28 - y
+                expected = 14 - row_size <= x <= 13 + row_size
+                self.assertEqual(expected, game.game_map.in_arena_bounds([x, y]))
+        self.assertTrue(game.game_map.in_arena_bounds([13.5, 0]))
+        self.assertFalse(game.game_map.in_arena_bounds([11.5, 1]))
+
+        self.assertEqual([14, 27], game.game_map.get_edges()[game.game_map.TOP_RIGHT][0])
+        self.assertEqual([0, 13], game.game_map.get_edge_locations(game.game_map.BOTTOM_LEFT)[-1])
+        self.assertIn((27, 13), geometry.FRIENDLY_EDGE_SET)
+        self.assertEqual((geometry.cell_id(13, 1), geometry.cell_id(14, 0)), geometry.NEIGHBORS[geometry.cell_id(13, 0)])
+
+    def test_unit_index(self):
+        game = self.make_turn_0_map()
+        game_map = game.game_map
+        rng = random.Random(11)
+        for _ in range(300):
+            x, y = rng.choice(geometry.VALID_LOCATIONS)
+            action = rng.random()
+            if action < 0.6:
+                game_map.add_unit(rng.choice(["FF", "DF", "PI"]), [x, y], rng.randint(0, 1))
+            elif action < 0.8:
+                game_map.remove_unit([x, y])
+            else:
+                game_map[x, y] = []
+
+        for player_index in (0, 1):
+            for unit_type in (None, "FF", "DF", "PI"):
+                expected = [unit for location in game_map for unit in game_map[location]
+                            if unit.player_index == player_index and (unit_type is None or unit.unit_type == unit_type)]
+                self.assertEqual(expected, game_map.get_units(player_index, unit_type))
+                band = [unit for unit in expected if 14 <= unit.y <= 17]
+                self.assertEqual(len(band), game_map.count_units(player_index, unit_type, bitboard.rows_mask(range(14, 18))))
+
+        parsed = GameState(game.config, """{"p2Units":[[],[],[[13,15,90.0,"1"],[12,16,40.0,"2"]],[],[],[],[]],"turnInfo":[0,1,-1],"p1Stats":[30.0,25.0,5.0,0],"p1Units":[[[13,10,75.0,"3"]],[],[],[],[],[],[]],"p2Stats":[30.0,25.0,5.0,0],"events":{}}""")
+        self.assertEqual([[13, 15], [12, 16]], [[unit.x, unit.y] for unit in parsed.game_map.get_units(1, "DF")])
+        self.assertEqual(1, parsed.game_map.count_units(0))
+
+    def test_region_sums(self):
+        game = self.make_turn_0_map()
+        game._player_resources[0]['SP'] = 100
+        rng = random.Random(5)
+        for x, y in rng.sample(geometry.VALID_LOCATIONS, 80):
+            game.game_map.add_unit(rng.choice(["FF", "DF"]), [x, y], 0 if y < 14 else 1)
+        regions = game.get_region_sums()
+        game.attempt_spawn("DF", [[13, 3], [10, 5]])
+        game.attempt_upgrade([[13, 3]])
+        self.assertIsNot(regions, game.get_region_sums())
+        regions = game.get_region_sums()
+        self.assertIs(regions, game.get_region_sums())
+
+        for _ in range(50):
+            x0, x1 = sorted(rng.randint(-2, 29) for _ in range(2))
+            y0, y1 = sorted(rng.randint(-2, 29) for _ in range(2))
+            for player_index in (0, 1):
+                for unit_type in (None, "FF", "DF"):
+                    units = [unit for location in game.game_map for unit in game.game_map[location]
+                             if unit.player_index == player_index and (unit_type is None or unit.unit_type == unit_type)
+                             and x0 <= unit.x <= x1 and y0 <= unit.y <= y1]
+                    self.assertEqual(len(units), regions.count(player_index, unit_type, x0, y0, x1, y1))
+                    self.assertAlmostEqual(sum(unit.health for unit in units), regions.health(player_index, unit_type, x0, y0, x1, y1))
+                    self.assertEqual(sum(1 for unit in units if unit.upgraded), regions.upgraded(player_index, unit_type, x0, y0, x1, y1))
+
+    def test_unit_descriptors(self):
+        game = self.make_turn_0_map()
+        first = GameUnit("DF", game.config, 0, None, 13, 3)
+        second = GameUnit("DF", game.config, 1, 20.0, 14, 20)
+        self.assertIs(first.descriptor, second.descriptor)
+        self.assertFalse(hasattr(first, "__dict__"))
+        self.assertEqual((90.0, 20.0, 2.5, [2.0, 0]), (first.health, second.health, first.attackRange, first.cost))
+
+        first.upgrade()
+        self.assertIs(first.descriptor, second.descriptor.upgrade)
+        self.assertEqual((True, False), (first.upgraded, second.upgraded))
+        self.assertEqual((3.5, 15.0, [6.0, 0], 90.0), (first.attackRange, first.damage_i, first.cost, first.health))
+        with self.assertRaises(AttributeError):
+            first.descriptor.attackRange = 10
+
+    def make_late_game_state(self, seed, lazy_units=False):
+        game = self.make_turn_0_map()
+        rng = random.Random(seed)
+        units = [[[], [], [], [], [], [], [], []], [[], [], [], [], [], [], [], []]]
+        for x, y in rng.sample(geometry.VALID_LOCATIONS, 160):
+            player_index = 0 if y < 14 else 1
+            units[player_index][rng.randint(0, 2)].append([x, y, float(rng.randint(1, 60)), "1"])
+            if rng.random() < 0.3:
+                units[player_index][6 + rng.randint(0, 1)].append([x, y, 0.0, "2"])
+        for _ in range(10):
+            x, y = rng.choice(geometry.VALID_LOCATIONS)
+            units[0][3].append([x, y, 15.0, "3"])
+        state = {"p1Units": units[0], "p2Units": units[1], "turnInfo": [0, 30, -1], "p1Stats": [30.0, 25.0, 5.0, 0],
+                 "p2Stats": [30.0, 25.0, 5.0, 0], "events": {}}
+        return GameState(game.config, json.dumps(state), lazy_units=lazy_units)
+
+    def test_lazy_units_match_parsed_units(self):
+        for seed in range(3):
+            eager = self.make_late_game_state(seed)
+            lazy = self.make_late_game_state(seed, lazy_units=True)
+            self.assertEqual(eager.game_map.get_blocked_mask(), lazy.game_map.get_blocked_mask())
+            self.assertEqual([str(unit) for unit in eager.game_map.get_units(1)], [str(unit) for unit in lazy.game_map.get_units(1)])
+            self.assertEqual(len(lazy.game_map.unit_arrays), sum(len(eager.game_map[location]) for location in eager.game_map))
+            for location in eager.game_map:
+                expected = [(str(unit), unit.cost, unit.pending_removal) for unit in eager.game_map[location]]
+                self.assertEqual(expected, [(str(unit), unit.cost, unit.pending_removal) for unit in lazy.game_map[location]])
+
+    def test_game_messages(self):
+        turn_0 = self.make_turn_0_map().serialized_string
+        self.assertEqual("turn", message_type(turn_0))
+        self.assertEqual("action_frame", message_type('{"p2Units":[], "turnInfo": [1, 4, 12, 80]}'))
+        self.assertEqual("end", message_type('{"turnInfo":[2,30,-1]}'))
+        self.assertEqual("config", message_type('{"timingAndReplay":{"replaySave":1}}'))
+        self.assertEqual("unknown", message_type('{"turnInfo":[7,0]}'))
+        self.assertEqual("unknown", message_type("garbage"))
+
+        message = GameMessage(turn_0)
+        self.assertEqual(turn_0, message)
+        self.assertIs(message.data, decode_message(message))
+        game = GameState(self.make_turn_0_map().config, message)
+        self.assertEqual(25, game.get_resource(game.SP))
+        game = GameState(game.config, json.loads(turn_0))
+        self.assertEqual(5, game.get_resource(game.MP))
+
+    def test_message_reader_coalesces_frames(self):
+        lines = ['{"turnInfo":[0,1,-1]}']
+        for frame in range(10):
+            lines.append(json.dumps({"turnInfo": [1, 1, frame], "events": {"breach": [[[frame, 14]]], "death": []}}))
+        lines.append('{"turnInfo":[0,2,-1]}')
+        lines.append('{"turnInfo":[1,2,0],"events":{"breach":[],"death":[]}}')
+        reader = MessageReader(max_frames=3, frame_fields=["events.breach"], stream=io.StringIO("\n".join(lines) + "\n"))
+        reader._MessageReader__read_loop()
+
+        received = []
+        message = reader.get()
+        while message is not None:
+            received.append(message)
+            message = reader.get()
+        self.assertEqual(["turn", "action_frame", "action_frame", "action_frame", "turn", "action_frame"], [message_type(m) for m in received])
+        self.assertEqual(7, reader.coalesced_frames)
+        merged = received[3]
+        self.assertEqual(7, merged.skipped_frames)
+        self.assertEqual([1, 1, 9], merged.data["turnInfo"])
+        self.assertEqual([[[frame, 14]] for frame in range(2, 10)], merged.data["events"]["breach"])
+        breaches = [b for m in received if message_type(m) == "action_frame" for b in m.data["events"]["breach"]]
+        self.assertEqual(10, len(breaches))
+
+    def test_speculative_runner(self):
+        game = self.make_late_game_state(4)
+        frame = json.loads(game.serialized_string)
+        frame["turnInfo"] = [1, 30, 12]
+        for units in frame["p1Units"][:3]:
+            for unit in units:
+                unit[2] = 1.0
+        runner = SpeculativeRunner(game.config, [("blocked", lambda state: state.game_map.get_blocked_mask()),
+                                                 ("broken", lambda state: 1 / 0)])
+        runner.submit(GameMessage(json.dumps(frame)))
+        self.assertTrue(runner.wait(10))
+        # Health differs between the frame and the turn, but the structures are the same
+        self.assertEqual({"blocked": game.game_map.get_blocked_mask()}, runner.collect(game.serialized_string))
+
+        runner.submit(frame)
+        self.assertTrue(runner.wait(10))
+        turn = json.loads(game.serialized_string)
+        x, y = next(location for location in geometry.VALID_LOCATIONS if location[1] >= 14 and not game.contains_stationary_unit(location))
+        turn["p2Units"][0].append([x, y, 60.0, "9"])
+        self.assertEqual({}, runner.collect(turn))
+
+    def test_turn_budget(self):
+        now = [100.0]
+        clock = lambda: now[0]
+        game = self.make_turn_0_map()
+        state = json.loads(game.serialized_string)
+        budget = TurnBudget.for_turn(game.config, state)
+        self.assertAlmostEqual(4.0, budget.deadline - budget.started)
+        # The last turn went over the 5 second soft limit, so the share is halved
+        state["p1Stats"][3] = 6000
+        budget = TurnBudget.for_turn(game.config, state)
+        self.assertAlmostEqual(2.0, budget.deadline - budget.started)
+
+        budget = TurnBudget(2.0, clock=clock)
+        def evaluate(candidate):
+            now[0] += 0.75
+            return -abs(candidate - 3)
+        # Candidates 0, 1 and 2 are scored by the deadline, 3 would be the best but is never reached
+        result = run_anytime(range(6), evaluate, budget)
+        self.assertEqual((2, 3), (result.best, result.offers))
+        self.assertTrue(budget.expired())
+        self.assertRaises(BudgetExceeded, budget.checkpoint)
+        self.assertEqual(0.0, budget.sub_budget(0.5).remaining())
+
+        game = GameState(game.config, game.serialized_string, budget=TurnBudget(1.0, clock=clock))
+        game.attempt_spawn("FF", [13, 0])
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            game.budget.finish()
+            game.submit_turn()
+        self.assertEqual(['[["FF", 13, 0]]', '[]'], output.getvalue().splitlines())
+
+    def test_simulator(self):
+        game = self.make_turn_0_map()
+        # Scouts move every frame and score on the frame after reaching the last location of their path
+        result = Simulator.from_game_state(game).simulate([("PI", [13, 0], 5)])
+        self.assertEqual(len(game.find_path_to_edge([13, 0])), result.frames)
+        self.assertEqual([(result.frames, (27, 14), "PI", 0, 5)], result.breaches)
+        self.assertEqual([0.0, 5.0], result.breach_damage)
+
+        game.game_map.add_unit("DF", [24, 13], 1)
+        game.game_map.add_unit("FF", [20, 9], 1)
+        game.game_map[20, 9][0].health = 3.0
+        simulator = Simulator.from_game_state(game)
+        self.assertEqual(((1, "DF", False, 90.0, 24, 13), (1, "FF", False, 3.0, 20, 9)), tuple(sorted(snapshot(game))))
+        result = simulator.simulate([("PI", [13, 0], 5)])
+        # The turret kills a scout every 3 frames while they are in range, the wall falls to the first volley
+        self.assertEqual([("FF", (20, 9), 1)], result.destroyed)
+        self.assertEqual([2, 0], result.lost)
+        self.assertEqual([0.0, 35.0], result.unit_damage)
+        self.assertEqual([0.0, 3.0], result.breach_damage)
+        result = simulator.simulate([("PI", [13, 0], 1)])
+        self.assertEqual(([], [1, 0]), (result.breaches, result.lost))
+
+    def test_rollout_pool(self):
+        game = self.make_late_game_state(0)
+        plans = candidate_plans(["PI", "EI"], [[1, 12], [14, 0], [24, 10]], [2, 6])
+        plans.append([])
+        with RolloutPool(game.config, processes=0) as local:
+            expected = local.evaluate(game, plans)
+            self.assertEqual(len(plans), local.evaluated)
+            self.assertEqual([], local.evaluate(game, plans, budget=0))
+        self.assertEqual(sorted(expected, key=lambda entry: entry[0], reverse=True), expected)
+        self.assertEqual((0.0, 0.0), expected[-1][0])
+        with RolloutPool(game.config, processes=2) as pool:
+            ranked = pool.evaluate(snapshot(game), plans)
+        self.assertEqual([(score, plan) for score, plan, _ in expected], [(score, plan) for score, plan, _ in ranked])
+
+    def test_fork(self):
+        game = self.make_turn_0_map()
+        game.suppress_warnings(True)
+        game.attempt_spawn("DF", [13, 10])
+        heatmap = game.get_damage_heatmap()
+        child = game.fork()
+        self.assertEqual(2, child.attempt_spawn("FF", [[12, 10], [14, 10]]))
+        self.assertEqual(1, child.attempt_upgrade([13, 10]))
+        self.assertEqual(1, child.attempt_spawn("PI", [13, 0], 1))
+        grandchild = child.fork()
+        grandchild.game_map.remove_unit([13, 10])
+
+        # The parent sees none of its children's changes
+        self.assertEqual([], game.game_map[12, 10])
+        self.assertFalse(game.game_map[13, 10][0].upgraded)
+        self.assertEqual([], game.game_map[13, 0])
+        self.assertEqual(23, game.get_resource(game.SP))
+        self.assertEqual([("DF", 13, 10)], game._build_stack)
+        self.assertEqual(5, heatmap.damage_at([13, 12], 1))
+        self.assertIs(heatmap, game.get_damage_heatmap())
+
+        self.assertTrue(child.game_map[13, 10][0].upgraded)
+        self.assertEqual(17, child.get_resource(child.SP))
+        self.assertEqual(15, child.get_damage_heatmap().damage_at([13, 12], 1))
+        self.assertEqual(1, len(child.game_map[13, 0]))
+        self.assertEqual([], grandchild.game_map[13, 10])
+        self.assertEqual(0, grandchild.get_damage_heatmap().damage_at([13, 12], 1))
+        self.assertEqual(game.game_map.get_blocked_mask() | bitboard.from_locations([[12, 10], [14, 10]]), child.game_map.get_blocked_mask())
+
+    def test_savepoints(self):
+        game = self.make_late_game_state(1)
+        game.suppress_warnings(True)
+        heatmap = game.get_damage_heatmap()
+        field = game.get_edge_distance_field(game.game_map.TOP_RIGHT)
+        def board():
+            return ([str(game.game_map[location]) for location in game.game_map], game.game_map.get_blocked_mask(),
+                    list(game._build_stack), list(game._deploy_stack), game.get_resources(), list(heatmap.damage[0]),
+                    [field.pathlength(location) for location in game.game_map])
+        locations = [[x, y] for x, y in geometry.VALID_LOCATIONS if y < 14 and not game.game_map[x, y]][:6]
+        upgradable = [[unit.x, unit.y] for unit in game.game_map.get_units(0, "DF") if not unit.upgraded]
+        edge = next([x, y] for x, y in geometry.EDGES[geometry.BOTTOM_LEFT] if not game.contains_stationary_unit([x, y]) and [x, y] not in locations)
+
+        start = board()
+        savepoint = game.savepoint()
+        self.assertEqual(6, game.attempt_spawn("FF", locations))
+        self.assertEqual(1, game.attempt_spawn("PI", edge, 1))
+        self.assertEqual(1, game.attempt_upgrade(upgradable[0]))
+        self.assertNotEqual(start, board())
+        game.rollback(savepoint)
+        self.assertEqual(start, board())
+
+        # The savepoint is still set, and nested savepoints roll back independently
+        game.attempt_spawn("DF", locations[0])
+        inner = game.savepoint()
+        after_turret = board()
+        game.attempt_remove(locations[0])
+        game.game_map.remove_unit(locations[0])
+        game.rollback(inner)
+        self.assertEqual(after_turret, board())
+        game.release(inner)
+        game.rollback(savepoint)
+        self.assertEqual(start, board())
+        game.release(savepoint)
+
+        # Savepoints taken with no change between them are still told apart
+        outer = game.savepoint()
+        inner = game.savepoint()
+        game.release(inner)
+        game.attempt_spawn("FF", locations[0])
+        game.rollback(outer)
+        self.assertEqual(start, board())
+        game.release(outer)
+
+        # An unknown savepoint leaves the map, stacks and resources alone
+        game.attempt_spawn("FF", locations[0])
+        after_wall = board()
+        game.rollback(outer)
+        self.assertEqual(after_wall, board())
+
+    def test_batches(self):
+        game = self.make_turn_0_map()
+        game.suppress_warnings(True)
+        game._player_resources[0]['SP'] = 4.0
+        game._player_resources[0]['MP'] = 3.0
+
+        # Out of bounds, enemy territory, a repeated location, then more walls than the ledger can pay for
+        walls = [[0, 0], [13, 20], [13, 5], [13, 5], [14, 5], [15, 5], [16, 5], [17, 5]]
+        self.assertEqual([0, 0, 1, 0, 1, 1, 1, 0], game.spawn_batch("FF", walls))
+        self.assertEqual([("FF", 13, 5), ("FF", 14, 5), ("FF", 15, 5), ("FF", 16, 5)], game._build_stack)
+        self.assertEqual(0.0, game.get_resource(game.SP))
+
+        # Mobile units stack up to num at each edge location until the MP run out
+        self.assertEqual([0, 2, 1, 0], game.spawn_batch("PI", [[13, 5], [13, 0], [14, 0], [0, 13]], 2))
+        self.assertEqual([("PI", 13, 0), ("PI", 13, 0), ("PI", 14, 0)], game._deploy_stack)
+
+        game._player_resources[0]['SP'] = 2.0
+        self.assertEqual([1, 0, 0, 1, 0], game.upgrade_batch([[13, 5], [13, 5], [12, 5], [14, 5], [15, 5]]))
+        self.assertEqual([("UP", 13, 5), ("UP", 14, 5)], game._build_stack[4:])
+        self.assertTrue(game.contains_stationary_unit([14, 5]).upgraded)
+        self.assertFalse(game.contains_stationary_unit([15, 5]).upgraded)
+
+        # attempt_spawn and attempt_upgrade report the totals of the same batches
+        game._player_resources[0]['SP'] = 2.0
+        self.assertEqual(2, game.attempt_spawn("FF", [[12, 5], [11, 5], [10, 5]]))
+        self.assertEqual(0, game.attempt_upgrade([12, 5]))
+
+    def test_layout(self):
+        game = self.make_turn_0_map()
+        game.suppress_warnings(True)
+        layout = Layout()
+        layout.add("FF", [[13, 5], [14, 5], [15, 5]])
+        layout.add("DF", [13, 4], upgrade=True)
+        layout.add("FF", [[13, 5], [16, 5]], upgrade=True)
+        layout.add("PI", [13, 0])
+        layout.add("DF", [13, 20])
+        with contextlib.redirect_stderr(io.StringIO()):
+            layout.compile(game.config)
+        self.assertEqual(8, len(layout.entries))
+
+        # Mobile units and enemy territory are dropped when compiling
+        self.assertEqual([("FF", 13, 5), ("FF", 14, 5), ("FF", 15, 5), ("DF", 13, 4), ("UP", 13, 4), ("UP", 13, 5),
+                          ("FF", 16, 5), ("UP", 16, 5)], layout.plan(game))
+
+        # Only what the structure points pay for is queued, skipping entries that are too expensive
+        game._player_resources[0]['SP'] = 9.0
+        game.game_map.add_unit("EF", [15, 5], 0)
+        self.assertEqual(5, layout.apply(game))
+        self.assertEqual([("FF", 13, 5), ("FF", 14, 5), ("DF", 13, 4), ("UP", 13, 4), ("UP", 13, 5)], game._build_stack)
+        self.assertEqual(0.0, game.get_resource(game.SP))
+
+        # Built and upgraded entries are not planned again
+        game._player_resources[0]['SP'] = 30.0
+        self.assertEqual([("FF", 16, 5), ("UP", 16, 5)], layout.plan(game))
+        game.game_map.remove_unit([13, 4])
+        self.assertEqual([("DF", 13, 4), ("UP", 13, 4), ("FF", 16, 5), ("UP", 16, 5)], layout.plan(game))
+
+        # Like attempt_upgrade, an upgrade entry upgrades whichever of our structures stands at its location,
+        # and no structure is planned where a mobile unit stands
+        game.game_map.add_unit("EF", [13, 4], 0)
+        game.game_map.add_unit("PI", [16, 5], 0)
+        self.assertEqual([("UP", 13, 4)], layout.plan(game))
+        self.assertEqual(1, layout.apply(game))
+        self.assertTrue(game.game_map[13, 4][0].upgraded)
+
+    def test_update(self):
+        def board(game):
+            game_map = game.game_map
+            return ([[(str(unit), unit.pending_removal) for unit in game_map[location]] for location in game_map],
+                    game_map.get_blocked_mask(), [game_map.get_unit_mask(player_index) for player_index in (0, 1)],
+                    [[game.get_edge_distance_field(edge).pathlength(location) for location in game_map] for edge in range(4)],
+                    [list(damage) for damage in game.get_damage_heatmap().damage], game.get_region_sums().health(1),
+                    game.get_next_hop_table(game_map.TOP_RIGHT).get_path([13, 0]), game.get_resources(), game.turn_number)
+
+        game = self.make_late_game_state(0, lazy_units=True)
+        game.suppress_warnings(True)
+        board(game)
+        for seed in range(1, 4):
+            turn = json.loads(self.make_late_game_state(seed).serialized_string)
+            # A turn where only health and upgrades changed, then a different board
+            for state in (dict(turn, p1Units=[[[x, y, health / 2, unit_id] for x, y, health, unit_id in units] for units in turn["p1Units"]]), turn):
+                game.attempt_spawn("FF", [[13, 5], [14, 5]])
+                game.update(json.dumps(state))
+                expected = GameState(game.config, json.dumps(state))
+                self.assertEqual(board(expected), board(game))
+                self.assertEqual([], game._build_stack)
+
+        # With persistent_state, AlgoCore updates one kept GameState and hands out forks of it
+        core = AlgoCore()
+        core.config = game.config
+        core.persistent_state = True
+        first = core.make_game_state(self.make_late_game_state(1).serialized_string)
+        kept = first.game_map[first.game_map.get_units(0)[0].x, first.game_map.get_units(0)[0].y]
+        before = [str(unit) for unit in kept]
+        second = core.make_game_state(self.make_late_game_state(2).serialized_string)
+        self.assertEqual(board(self.make_late_game_state(2)), board(second))
+        self.assertEqual(before, [str(unit) for unit in kept])
+        self.assertIsNot(first.game_map, second.game_map)
+
     def test_print_unit(self):
         game = self.make_turn_0_map()
 
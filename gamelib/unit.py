@@ -1,3 +1,9 @@
+from array import array
+from operator import attrgetter
+
+from . import geometry
+
+
 def is_stationary(unit_type, structure_types):
     """
         Args:
@@ -9,12 +15,94 @@ def is_stationary(unit_type, structure_types):
     return unit_type in structure_types
 
 
+_STATS = ("speed", "damage_f", "damage_i", "attackRange", "shieldRange", "max_health", "shieldPerUnit", "shieldBonusPerY")
+_STAT_KEYS = ("speed", "attackDamageTower", "attackDamageWalker", "attackRange", "shieldRange", "startHealth", "shieldPerUnit", "shieldBonusPerY")
+
+
+class UnitDescriptor:
+    """The immutable stats shared by every unit of one type, either upgraded or not.
+
+    Descriptors are compiled once per config by get_unit_descriptors. A GameUnit holds a reference
+    to the descriptor of its type, and upgrading it swaps that reference for descriptor.upgrade.
+
+    Attributes :
+        * unit_type (string): The type described
+        * stationary (bool): Whether or not units of this type are structures
+        * upgraded (bool): If these are the stats of an upgraded unit
+        * upgrade (UnitDescriptor): The upgraded stats. An upgraded descriptor is its own upgrade
+        * cost (tuple): The total SP and MP paid for a unit with these stats
+        * speed, damage_f, damage_i, attackRange, shieldRange, max_health, shieldPerUnit, shieldBonusPerY: See GameUnit
+
+    """
+    __slots__ = ("unit_type", "stationary", "upgraded", "upgrade", "cost") + _STATS
+
+    def __init__(self, unit_type, stationary, upgraded, cost, stats):
+        set_field = object.__setattr__
+        set_field(self, "unit_type", unit_type)
+        set_field(self, "stationary", stationary)
+        set_field(self, "upgraded", upgraded)
+        set_field(self, "cost", cost)
+        for name, value in zip(_STATS, stats):
+            set_field(self, name, value)
+        set_field(self, "upgrade", self)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("UnitDescriptor is immutable")
+
+    # Immutable, so copies of maps and units can share it
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def compile_unit_descriptor(type_config):
+    """Builds the base descriptor of one entry of config["unitInformation"], linked to its upgraded descriptor
+
+    """
+    stats = tuple(type_config.get(key, 0) for key in _STAT_KEYS)
+    cost = (type_config.get("cost1", 0), type_config.get("cost2", 0))
+    base = UnitDescriptor(type_config["shorthand"], type_config["unitCategory"] == 0, False, cost, stats)
+
+    upgrade_config = type_config.get("upgrade", {})
+    upgraded_stats = tuple(upgrade_config.get(key, value) for key, value in zip(_STAT_KEYS, stats))
+    upgraded_cost = (upgrade_config.get("cost1", 0) + cost[0], upgrade_config.get("cost2", 0) + cost[1])
+    upgraded = UnitDescriptor(base.unit_type, base.stationary, True, upgraded_cost, upgraded_stats)
+    object.__setattr__(base, "upgrade", upgraded)
+    return base
+
+
+_descriptors = {}
+
+
+def get_unit_descriptors(config):
+    """Gets the base UnitDescriptor of every unit type in a config, keyed by shorthand.
+    They are compiled the first time the config is seen.
+
+    """
+    entry = _descriptors.get(id(config))
+    if entry is None or entry[0] is not config:
+        compiled = {}
+        for type_config in config["unitInformation"]:
+            if "unitCategory" in type_config:
+                compiled[type_config["shorthand"]] = compile_unit_descriptor(type_config)
+        entry = (config, compiled)
+        _descriptors[id(config)] = entry
+    return entry[1]
+
+
+def _descriptor_field(name, doc):
+    return property(attrgetter("descriptor." + name), doc=doc)
+
+
 class GameUnit:
     """Holds information about a Unit. 
 
     Attributes :
         * unit_type (string): This unit's type
         * config (JSON): Contains information about the game
+        * descriptor (UnitDescriptor): The stats this unit has, shared with every unit of its type and upgrade level
         * player_index (integer): The player that controls this unit. 0 for you, 1 for your opponent.
         * x (integer): The x coordinate of the unit
         * y (integer): The y coordinate of the unit
@@ -31,50 +119,52 @@ class GameUnit:
         * pending_removal (boolean): If this unit is marked for removal by its owner
         * upgraded (boolean): If this unit is upgraded
 
+    The stats that change with an upgrade are read from the descriptor.
+
     """
+    __slots__ = ("descriptor", "config", "unit_type", "stationary", "player_index", "pending_removal", "x", "y", "health")
+
     def __init__(self, unit_type, config, player_index=None, health=None, x=-1, y=-1):
         """ Initialize unit variables using args passed
 
         """
-        self.unit_type = unit_type
+        self.descriptor = get_unit_descriptors(config)[unit_type]
         self.config = config
+        # Read on almost every map query and never changed by an upgrade, so kept on the unit
+        self.unit_type = unit_type
+        self.stationary = self.descriptor.stationary
         self.player_index = player_index
         self.pending_removal = False
-        self.upgraded = False
         self.x = x
         self.y = y
-        self.__serialize_type()
-        self.health = self.max_health if not health else health
-
-    def __serialize_type(self):
-        from .game_state import STRUCTURE_TYPES, UNIT_TYPE_TO_INDEX, SUPPORT
-        type_config = self.config["unitInformation"][UNIT_TYPE_TO_INDEX[self.unit_type]]
-        self.stationary = type_config["unitCategory"] == 0
-        self.speed = type_config.get("speed", 0)
-        self.damage_f = type_config.get("attackDamageTower", 0)
-        self.damage_i = type_config.get("attackDamageWalker", 0)
-        self.attackRange = type_config.get("attackRange", 0)
-        self.shieldRange = type_config.get("shieldRange", 0)
-        self.max_health = type_config.get("startHealth", 0)
-        self.shieldPerUnit = type_config.get("shieldPerUnit", 0)
-        self.shieldBonusPerY = type_config.get("shieldBonusPerY", 0)
-        self.cost = [type_config.get("cost1", 0), type_config.get("cost2", 0)]
+        self.health = self.descriptor.max_health if not health else health
+
+    upgraded = _descriptor_field("upgraded", "If this unit is upgraded")
+    speed = _descriptor_field("speed", "A unit will move once every 1/speed frames")
+    damage_f = _descriptor_field("damage_f", "The amount of damage this unit will deal to enemy structures")
+    damage_i = _descriptor_field("damage_i", "The amount of damage this unit will deal to enemy mobile units")
+    attackRange = _descriptor_field("attackRange", "The effective range of this unit for attacking")
+    shieldRange = _descriptor_field("shieldRange", "The effective range of this unit for shielding")
+    max_health = _descriptor_field("max_health", "The starting health of this unit")
+    shieldPerUnit = _descriptor_field("shieldPerUnit", "How much shield is given per unit")
+    shieldBonusPerY = _descriptor_field("shieldBonusPerY", "Extra shield given per row")
 
+    @property
+    def cost(self):
+        """The resource costs of this unit, first is SP second is MP"""
+        return list(self.descriptor.cost)
 
     def upgrade(self):
-        from .game_state import UNIT_TYPE_TO_INDEX
-        type_config = self.config["unitInformation"][UNIT_TYPE_TO_INDEX[self.unit_type]].get("upgrade", {})
-        self.speed = type_config.get("speed", self.speed)
-        self.damage_f = type_config.get("attackDamageTower", self.damage_f)
-        self.damage_i = type_config.get("attackDamageWalker", self.damage_i)
-        self.attackRange = type_config.get("attackRange", self.attackRange)
-        self.shieldRange = type_config.get("shieldRange", self.shieldRange)
-        self.max_health = type_config.get("startHealth", self.max_health)
-        self.shieldPerUnit = type_config.get("shieldPerUnit", self.shieldPerUnit)
-        self.shieldBonusPerY = type_config.get("shieldBonusPerY", self.shieldBonusPerY)
-        self.cost = [type_config.get("cost1", 0) + self.cost[0], type_config.get("cost2", 0) + self.cost[1]]
-        self.upgraded = True
+        self.descriptor = self.descriptor.upgrade
+
+    def copy(self):
+        """A new GameUnit with the same stats, owner, location, health and flags
 
+        """
+        unit = GameUnit.__new__(GameUnit)
+        for name in GameUnit.__slots__:
+            setattr(unit, name, getattr(self, name))
+        return unit
 
     def __toString(self):
         owner = "Friendly" if self.player_index == 0 else "Enemy"
@@ -87,3 +177,88 @@ class GameUnit:
     def __repr__(self):
         return self.__toString()
 
+
+
+class UnitArrays:
+    """The units of one game state stored as parallel arrays, one entry per unit, in the order they were parsed.
+
+    Used by GameState(lazy_units=True) so that GameUnit objects are only created for the locations
+    the algo actually looks at. The arrays describe the units as parsed and are not updated when
+    the map is changed afterwards.
+
+    Attributes :
+        * x, y (array): The location of each unit
+        * type_index (array): The index of each unit's type in config["unitInformation"]
+        * owner (array): The player index controlling each unit
+        * health (array): The health of each unit
+        * stationary (array): 1 for structures, 0 for mobile units
+        * upgraded (array): 1 for units upgraded by an UP entry
+        * pending_removal (array): 1 for units marked for removal by an RM entry
+        * rows_by_cell (dict): The index of the unit at each geometry cell id, or a list of indices in parse order
+          when a location holds several units. Use rows_at to always get a sequence
+
+    """
+    def __init__(self):
+        self.x = array("b")
+        self.y = array("b")
+        self.type_index = array("b")
+        self.owner = array("b")
+        self.health = array("d")
+        self.stationary = array("b")
+        self.upgraded = array("b")
+        self.pending_removal = array("b")
+        self.rows_by_cell = {}
+
+    def __len__(self):
+        return len(self.x)
+
+    def append(self, x, y, type_index, owner, health, stationary):
+        """Adds a unit and returns its row index
+
+        """
+        row = len(self.x)
+        self.x.append(x)
+        self.y.append(y)
+        self.type_index.append(type_index)
+        self.owner.append(owner)
+        self.health.append(health)
+        self.stationary.append(1 if stationary else 0)
+        self.upgraded.append(0)
+        self.pending_removal.append(0)
+        cell = geometry.cell_id(x, y)
+        rows = self.rows_by_cell.get(cell)
+        if rows is None:
+            self.rows_by_cell[cell] = row
+        elif type(rows) is int:
+            self.rows_by_cell[cell] = [rows, row]
+        else:
+            rows.append(row)
+        return row
+
+    def rows_at(self, cell):
+        """The rows of the units at a cell id, in parse order
+
+        """
+        rows = self.rows_by_cell.get(cell, ())
+        return (rows,) if type(rows) is int else rows
+
+    def structure_row(self, x, y):
+        """The row of the structure at [x, y], or None if there is none
+
+        """
+        for row in self.rows_at(geometry.cell_id(x, y)):
+            if self.stationary[row]:
+                return row
+        return None
+
+    def make_unit(self, row, config):
+        """Creates the GameUnit described by a row
+
+        """
+        unit_type = config["unitInformation"][self.type_index[row]]["shorthand"]
+        unit = GameUnit(unit_type, config, self.owner[row], self.health[row], self.x[row], self.y[row])
+        if self.upgraded[row]:
+            unit.upgrade()
+        if self.pending_removal[row]:
+            unit.pending_removal = True
+        return unit
@@ -1,3 +1,4 @@
+import json
 import sys
 
 
@@ -21,6 +22,68 @@ def get_command():
         exit()
     return ret
 
+CONFIG_MESSAGE = "config"
+TURN_MESSAGE = "turn"
+ACTION_FRAME_MESSAGE = "action_frame"
+END_MESSAGE = "end"
+UNKNOWN_MESSAGE = "unknown"
+
+_STATE_TYPES = {"0": TURN_MESSAGE, "1": ACTION_FRAME_MESSAGE, "2": END_MESSAGE}
+
+
+class GameMessage(str):
+    """A line received from the game engine. It is the raw string, so it can be used anywhere the
+    string was, and also decodes the JSON the first time data is read, so every consumer shares one decode.
+
+    """
+    @property
+    def data(self):
+        """The decoded JSON of the message, decoded once and then shared"""
+        try:
+            return self.__dict__["_data"]
+        except KeyError:
+            data = self.__dict__["_data"] = json.loads(self)
+            return data
+
+
+def decode_message(message):
+    """Gets the decoded JSON of a message, reusing the decode of a GameMessage
+
+    Args:
+        message: A GameMessage, a JSON string, or an already decoded dict
+
+    """
+    if isinstance(message, dict):
+        return message
+    if isinstance(message, GameMessage):
+        return message.data
+    return json.loads(message)
+
+
+def message_type(message):
+    """Classifies a message from the game engine without decoding it, by scanning for its turnInfo state type
+
+    Returns:
+        CONFIG_MESSAGE, TURN_MESSAGE, ACTION_FRAME_MESSAGE, END_MESSAGE or UNKNOWN_MESSAGE
+
+    """
+    if "replaySave" in message:
+        return CONFIG_MESSAGE
+    index = message.find('"turnInfo"')
+    if index < 0:
+        return UNKNOWN_MESSAGE
+    index = message.find("[", index)
+    if index < 0:
+        return UNKNOWN_MESSAGE
+    index += 1
+    while index < len(message) and message[index] in " \t\"":
+        index += 1
+    end = index
+    while end < len(message) and message[end] not in ",]\"":
+        end += 1
+    return _STATE_TYPES.get(message[index:end].strip(), UNKNOWN_MESSAGE)
+
+
 def send_command(cmd):
     """Sends your turn to standard output.
     Should usually only be called by 'GameState.submit_turn()'